@@ -2,9 +2,34 @@
 """
 pyNecktie
 """
-from pynecktie.app import Necktie
-from pynecktie.blueprints import Blueprint
+import sys
+from importlib import import_module
 
 __version__ = "0.7.99a1"
 
+# Imported on first access, so that importing pynecktie or one of its
+# modules, such as pynecktie.response, does not import the application,
+# the server and their dependencies
+_LAZY_ATTRIBUTES = {
+    'Necktie': 'pynecktie.app',
+    'Blueprint': 'pynecktie.blueprints',
+}
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        try:
+            module = _LAZY_ATTRIBUTES[name]
+        except KeyError:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(
+                __name__, name))
+        value = getattr(import_module(module), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+else:  # module __getattr__ is new in Python 3.7
+    from pynecktie.app import Necktie  # noqa: F401
+    from pynecktie.blueprints import Blueprint  # noqa: F401
+
 __all__ = ['Necktie', 'Blueprint']
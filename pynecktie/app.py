@@ -2,16 +2,27 @@
 import os
 import logging
 import warnings
+import asyncio
+from asyncio import CancelledError
 from functools import partial
+from inspect import isawaitable, iscoroutinefunction
+from traceback import format_exc
 from sanic.app import Sanic, Purpose, create_default_context
+from sanic.exceptions import SanicException
+from sanic.response import StreamingHTTPResponse
 from sanic import reloader_helpers
 from pynecktie.config import Config
+from pynecktie.event_loop import get_event_loop_name
+from pynecktie.exceptions import ServerError
+from pynecktie.response import BaseHTTPResponse, HTTPResponse, \
+    JSONHTTPResponse
 from pynecktie.router import Router
-from pynecktie.server import Signal, HttpProtocol, serve, serve_multiple
+from pynecktie.server import Signal, HttpProtocol, serve_multiple, \
+    serve_worker, worker_cpus, trigger_events, freeze_objects
+from pynecktie.static import register as static_register, StaticCache
 from pynecktie.handlers import ErrorHandler
+from pynecktie import json_codec
 from pynecktie.log import logger, error_logger, LOGGING_CONFIG_DEFAULTS
-from pynecktie.testing import NecktieTestClient
-from pynecktie.websocket import WebSocketProtocol
 
 
 class Necktie(Sanic):
@@ -30,6 +41,10 @@ class Necktie(Sanic):
                                       configure_logging=configure_logging)
         self.config = Config(load_env=load_env)
         self.go_fast = self._necktie_serious
+        self._middleware_chain = None
+        self.static_cache = StaticCache()
+        # Set from the JSON_ENCODER setting when the server starts
+        self.json_codec = json_codec.default_codec
 
     # Decorator
     def route(self, uri, methods=frozenset({'GET'}), host=None,
@@ -81,25 +96,195 @@ class Necktie(Sanic):
         """
         return super(Necktie, self).exception(*exceptions)
 
+    def register_middleware(self, middleware, attach_to='request'):
+        middleware = super(Necktie, self)\
+            .register_middleware(middleware, attach_to=attach_to)
+        self._middleware_chain = None
+        return middleware
+
     def middleware(self, middleware_or_request):
         """Decorate and register middleware to be called before a request.
         Can either be called as @app.middleware or @app.middleware('request')
         """
         return super(Necktie, self).middleware(middleware_or_request)
 
+    def _compile_middleware(self):
+        """Freeze the request and response middleware into the chains run
+        by `handle_request`. Whether each middleware is a coroutine function
+        is decided once here, so that plain functions are called without
+        going through the await machinery on every request.
+
+        Blueprint middleware is registered on the app itself and applies
+        to every route, so a single chain serves all routes.
+
+        :return: tuple of (request chain, response chain)
+        """
+        self._middleware_chain = tuple(
+            tuple((middleware, iscoroutinefunction(middleware))
+                  for middleware in middlewares)
+            for middlewares in (self.request_middleware,
+                                self.response_middleware))
+        return self._middleware_chain
+
+    async def _run_request_middleware(self, request):
+        request_middleware, _ = \
+            self._middleware_chain or self._compile_middleware()
+        for middleware, is_coroutine in request_middleware:
+            if is_coroutine:
+                response = await middleware(request)
+            else:
+                response = middleware(request)
+                if response and isawaitable(response):
+                    response = await response
+            if response:
+                return response
+        return None
+
+    async def _run_response_middleware(self, request, response):
+        _, response_middleware = \
+            self._middleware_chain or self._compile_middleware()
+        for middleware, is_coroutine in response_middleware:
+            if is_coroutine:
+                _response = await middleware(request, response)
+            else:
+                _response = middleware(request, response)
+                if _response and isawaitable(_response):
+                    _response = await _response
+            if _response:
+                response = _response
+                break
+        return response
+
+    def _set_json_codec(self, response):
+        """Set the codec of this application on a response, and encode the
+        body of a `json()` response with it, so that an object which cannot
+        be encoded is handled like any other error of the handler."""
+        if isinstance(response, BaseHTTPResponse):
+            response.json_codec = self.json_codec
+            if isinstance(response, JSONHTTPResponse):
+                response.encode()
+
+    async def handle_request(self, request, write_callback, stream_callback):
+        """Take a request from the HTTP Server and return a response object
+        to be sent back The HTTP Server only expects a response object, so
+        exception handling must be done here
+
+        :param request: HTTP Request object
+        :param write_callback: Synchronous response function to be
+            called with the response as the only argument
+        :param stream_callback: Coroutine that handles streaming a
+            StreamingHTTPResponse if produced by the handler.
+
+        :return: Nothing
+        """
+        request_middleware, response_middleware = \
+            self._middleware_chain or self._compile_middleware()
+        # Define `response` var here to remove warnings about
+        # allocation before assignment below.
+        response = None
+        cancelled = False
+        try:
+            # -------------------------------------------- #
+            # Request Middleware
+            # -------------------------------------------- #
+
+            request.app = self
+            if request_middleware:
+                response = await self._run_request_middleware(request)
+            # No middleware results
+            if not response:
+                # -------------------------------------------- #
+                # Execute Handler
+                # -------------------------------------------- #
+
+                # Fetch handler from router
+                handler, args, kwargs, uri = self.router.get(request)
+
+                request.uri_template = uri
+                if handler is None:
+                    raise ServerError(
+                        ("'None' was returned while requesting a "
+                         "handler from the router"))
+
+                # Run response handler
+                response = handler(request, *args, **kwargs)
+                if isawaitable(response):
+                    response = await response
+            self._set_json_codec(response)
+        except CancelledError:
+            # If response handler times out, the server handles the error
+            # and cancels the handle_request job.
+            # In this case, the transport is already closed and we cannot
+            # issue a response.
+            response = None
+            cancelled = True
+        except Exception as e:
+            # -------------------------------------------- #
+            # Response Generation Failed
+            # -------------------------------------------- #
+
+            try:
+                response = self.error_handler.response(request, e)
+                if isawaitable(response):
+                    response = await response
+                self._set_json_codec(response)
+            except Exception as e:
+                if isinstance(e, SanicException):
+                    response = self.error_handler.default(request=request,
+                                                          exception=e)
+                elif self.debug:
+                    response = HTTPResponse(
+                        "Error while handling error: {}\nStack: {}".format(
+                            e, format_exc()), status=500)
+                else:
+                    response = HTTPResponse(
+                        "An error occurred while handling an error",
+                        status=500)
+        finally:
+            # -------------------------------------------- #
+            # Response Middleware
+            # -------------------------------------------- #
+            # Don't run response middleware if response is None
+            if response is not None and response_middleware:
+                try:
+                    response = await self._run_response_middleware(request,
+                                                                   response)
+                    self._set_json_codec(response)
+                except CancelledError:
+                    # Response middleware can timeout too, as above.
+                    response = None
+                    cancelled = True
+                except BaseException:
+                    error_logger.exception(
+                        'Exception occurred in one of response '
+                        'middleware handlers'
+                    )
+            if cancelled:
+                raise CancelledError()
+
+        # pass the response to the correct callback
+        if isinstance(response, StreamingHTTPResponse):
+            await stream_callback(response)
+        else:
+            write_callback(response)
+
     def static(self, uri, file_or_directory, pattern=r'/?.+',
                use_modified_since=True, use_content_range=False,
                stream_large_files=False, name='static', host=None,
-               strict_slashes=None):
+               strict_slashes=None, content_type=None, use_sendfile=True,
+               cache=False):
         """Register a root to serve files from. The input can either be a
-        file or a directory. See
+        file or a directory. Files are sent with sendfile where the
+        connection allows it, unless `use_sendfile` is False. With `cache`
+        True they are served from the application's `static_cache`, or
+        from the given :class:`pynecktie.static.StaticCache`.
         """
-        return super(Necktie, self)\
-            .static(uri, file_or_directory, pattern=pattern,
-                    use_modified_since=use_modified_since,
-                    use_content_range=use_content_range,
-                    stream_large_files=stream_large_files, name=name,
-                    host=host, strict_slashes=strict_slashes)
+        if cache is True:
+            cache = self.static_cache
+        static_register(self, uri, file_or_directory, pattern,
+                        use_modified_since, use_content_range,
+                        stream_large_files, name, host, strict_slashes,
+                        content_type, use_sendfile, cache or None)
 
     def blueprint(self, blueprint, **options):
         """Register a blueprint on the application.
@@ -112,12 +297,15 @@ class Necktie(Sanic):
 
     @property
     def test_client(self):
+        # imported on first use, servers never need the test client
+        from pynecktie.testing import NecktieTestClient
         return NecktieTestClient(self)
 
     def run(self, host=None, port=None, debug=False, ssl=None,
             sock=None, workers=1, protocol=None,
             backlog=100, stop_event=None, register_sys_signals=True,
-            access_log=True, **kwargs):
+            access_log=True, reuse_port=False, cpu_affinity=None,
+            preload=False, **kwargs):
         """Run the HTTP Server and listen until keyboard interrupt or term
         signal. On termination, drain connections before closing.
 
@@ -133,6 +321,17 @@ class Necktie(Sanic):
         :param stop_event:
         :param register_sys_signals:
         :param protocol: Subclass of asyncio protocol class
+        :param reuse_port: Bind a socket with `SO_REUSEPORT` in every
+                           worker, so that the kernel balances the
+                           connections across them
+        :param cpu_affinity: `True` to pin every worker to a CPU of its own,
+                             or a sequence of a CPU number or set of CPU
+                             numbers for every worker
+        :param preload: Run the `before_fork` listeners, then freeze the
+                        objects of the main process before forking the
+                        workers, so that they stay shared between the
+                        workers. With a single worker, the listeners run
+                        and the objects are frozen before it serves.
         :return: Nothing
         """
 
@@ -148,8 +347,11 @@ class Necktie(Sanic):
             host, port = host or "127.0.0.1", port or 8000
 
         if protocol is None:
-            protocol = (WebSocketProtocol if self.websocket_enabled
-                        else HttpProtocol)
+            if self.websocket_enabled:
+                from pynecktie.websocket import WebSocketProtocol
+                protocol = WebSocketProtocol
+            else:
+                protocol = HttpProtocol
         if stop_event is not None:
             if debug:
                 warnings.simplefilter('default')
@@ -173,17 +375,43 @@ class Necktie(Sanic):
                         os.environ.get('SANIC_SERVER_RUNNING') != 'true':
                     reloader_helpers.watchdog(2)
                 else:
-                    serve(**server_settings)
+                    if preload:
+                        self._before_fork()
+                        freeze_objects()
+                    server_settings['reuse_port'] = reuse_port
+                    serve_worker(server_settings,
+                                 worker_cpus(0, cpu_affinity))
             else:
-                serve_multiple(server_settings, workers)
+                self._before_fork()
+                serve_multiple(server_settings, workers,
+                               reuse_port=reuse_port,
+                               cpu_affinity=cpu_affinity,
+                               max_requests=self.config.WORKER_MAX_REQUESTS,
+                               max_memory=self.config.WORKER_MAX_MEMORY,
+                               preload=preload)
         except BaseException:
             error_logger.exception(
                 'Experienced exception while trying to serve')
             raise
         finally:
             self.is_running = False
+            if hasattr(self.router, 'unfreeze'):
+                self.router.unfreeze()
         logger.info("Server Stopped")
 
+    def _before_fork(self):
+        """Run the `before_fork` listeners in the main process, on an event
+        loop of their own, before the workers are forked."""
+        listeners = [partial(listener, self)
+                     for listener in self.listeners['before_fork']]
+        if not listeners:
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            trigger_events(listeners, loop)
+        finally:
+            loop.close()
+
     def _helper(self, host=None, port=None, debug=False,
                 ssl=None, sock=None, workers=1, loop=None,
                 protocol=HttpProtocol, backlog=100, stop_event=None,
@@ -207,6 +435,18 @@ class Necktie(Sanic):
 
         self.error_handler.debug = debug
         self.debug = debug
+        self._compile_middleware()
+        if hasattr(self.router, 'cache'):
+            self.router.cache.resize(self.config.ROUTER_CACHE_SIZE)
+        if hasattr(self.router, 'freeze'):
+            self.router.freeze()
+        self.static_cache.resize(self.config.STATIC_CACHE_SIZE,
+                                 self.config.STATIC_CACHE_FILE_SIZE)
+        self.static_cache.check_interval = \
+            self.config.STATIC_CACHE_CHECK_INTERVAL
+        self.json_codec = json_codec.get_codec(self.config.JSON_ENCODER)
+        # fail before forking workers when the loop is not available
+        event_loop = get_event_loop_name(self.config.EVENT_LOOP)
 
         server_settings = {
             'protocol': protocol,
@@ -226,7 +466,14 @@ class Necktie(Sanic):
             'keep_alive_timeout': self.config.KEEP_ALIVE_TIMEOUT,
             'request_max_size': self.config.REQUEST_MAX_SIZE,
             'keep_alive': self.config.KEEP_ALIVE,
+            'pipeline_concurrency': self.config.PIPELINE_CONCURRENCY,
+            'stream_high_water': self.config.REQUEST_STREAM_HIGH_WATER,
+            'stream_low_water': self.config.REQUEST_STREAM_LOW_WATER,
+            'body_preallocate_max': self.config.REQUEST_BODY_PREALLOCATE,
             'loop': loop,
+            'event_loop': event_loop,
+            'loop_executor_size': self.config.EVENT_LOOP_EXECUTOR_SIZE,
+            'slow_callback_duration': self.config.EVENT_LOOP_SLOW_CALLBACK,
             'register_sys_signals': register_sys_signals,
             'backlog': backlog,
             'access_log': self.config.ACCESS_LOG,
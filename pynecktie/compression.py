@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from pynecktie.headers import accepted_encodings
+from pynecktie.response import FileHTTPResponse, HTTPResponse, \
+    StreamingHTTPResponse
+
+COMPRESS_MIMETYPES = frozenset((
+    'application/javascript', 'application/json', 'application/x-ndjson',
+    'application/xml', 'image/svg+xml', 'text/css', 'text/csv',
+    'text/html', 'text/javascript', 'text/plain', 'text/xml',
+))
+
+# window bits of the zlib streams for each content coding
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+class _ZlibCompressor:
+    __slots__ = ('_compressor',)
+
+    def __init__(self, encoding, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            _WBITS[encoding])
+
+    def compress(self, data):
+        """Compress a chunk, flushing it so that the client can decode
+        everything sent so far."""
+        compressor = self._compressor
+        return compressor.compress(data) + \
+            compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    __slots__ = ('_compressor',)
+
+    def __init__(self, encoding, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        compressor = self._compressor
+        return compressor.process(data) + compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compress:
+    """Compresses responses with brotli, gzip or deflate, whichever is
+    allowed by the request's Accept-Encoding header, in that order. Brotli
+    is only used when the `brotli` package is installed.
+
+    Register it on an application with `Compress(app)`. It compresses
+    :class:`HTTPResponse` bodies of at least `min_size` bytes, running the
+    compression of bodies of `executor_size` bytes or more in the default
+    executor so that it does not block the event loop. Streaming responses
+    are compressed chunk by chunk as they are written. File responses,
+    which are sent with sendfile, and responses that already have a
+    Content-Encoding are sent as they are.
+
+    :param app: Necktie application to register the response middleware on
+    :param min_size: smallest body to compress (bytes)
+    :param mimetypes: content types to compress
+    :param level: gzip and deflate compression level, 1 to 9
+    :param brotli_level: brotli quality, 0 to 11
+    :param executor_size: smallest body compressed in the executor (bytes)
+    """
+    def __init__(self, app=None, min_size=500, mimetypes=COMPRESS_MIMETYPES,
+                 level=6, brotli_level=4, executor_size=65536):
+        self.min_size = min_size
+        self.mimetypes = frozenset(mimetypes)
+        self.levels = {'br': brotli_level, 'gzip': level, 'deflate': level}
+        self.executor_size = executor_size
+        self.encodings = ('br', 'gzip', 'deflate') if brotli is not None \
+            else ('gzip', 'deflate')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the response middleware on an application.
+
+        :param app: Necktie application
+        """
+        app.register_middleware(self.compress_response, 'response')
+
+    def compressor(self, encoding):
+        """Create an incremental compressor for a content coding.
+
+        :param encoding: 'br', 'gzip' or 'deflate'
+        :return: object with `compress(data)` and `finish()` methods
+        """
+        if encoding == 'br':
+            return _BrotliCompressor(encoding, self.levels[encoding])
+        return _ZlibCompressor(encoding, self.levels[encoding])
+
+    def compress(self, encoding, data):
+        """Compress a whole body.
+
+        :param encoding: 'br', 'gzip' or 'deflate'
+        :param data: bytes to compress
+        :return: bytes
+        """
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.levels[encoding])
+        compressor = zlib.compressobj(self.levels[encoding], zlib.DEFLATED,
+                                      _WBITS[encoding])
+        return compressor.compress(data) + compressor.flush()
+
+    def _compressible(self, response):
+        headers = response.headers
+        if 'Content-Encoding' in headers or \
+                response.status < 200 or response.status in (204, 206, 304):
+            return False
+        # a range of the body is sent as is, compressing it would not give
+        # a range of the compressed representation
+        if 'Content-Range' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        content_type = headers.get('Content-Type') or response.content_type
+        mimetype = content_type.split(';', 1)[0].strip().lower()
+        return mimetype in self.mimetypes
+
+    async def compress_response(self, request, response):
+        """Response middleware compressing the response in place."""
+        if isinstance(response, FileHTTPResponse):
+            return
+        if isinstance(response, HTTPResponse):
+            if len(response.body) < self.min_size:
+                return
+        elif not isinstance(response, StreamingHTTPResponse):
+            return
+        if not self._compressible(response):
+            return
+
+        headers = response.headers
+        vary = headers.get('Vary')
+        if not vary:
+            headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower() and vary != '*':
+            headers['Vary'] = vary + ', Accept-Encoding'
+
+        accept_encoding = request.headers.get('Accept-Encoding')
+        if not accept_encoding or request.method == 'HEAD':
+            return
+        allowed = accepted_encodings(accept_encoding, self.encodings)
+        for encoding in self.encodings:
+            if encoding in allowed:
+                break
+        else:
+            return
+
+        if isinstance(response, StreamingHTTPResponse):
+            response.compressor = self.compressor(encoding)
+        else:
+            body = response.body
+            if len(body) >= self.executor_size:
+                loop = asyncio.get_event_loop()
+                body = await loop.run_in_executor(
+                    None, self.compress, encoding, body)
+            else:
+                body = self.compress(encoding, body)
+            response.body = body
+            headers.pop('Content-Length', None)
+        headers['Content-Encoding'] = encoding
+        # the compressed body is a different representation
+        etag = headers.get('ETag')
+        if etag and etag.startswith('"'):
+            headers['ETag'] = 'W/' + etag
+
+
+__all__ = ["Compress", "COMPRESS_MIMETYPES"]
@@ -1,10 +1,29 @@
 # -*- coding: utf-8 -*-
 from sanic.config import Config as SanicConfig
 
+DEFAULT_CONFIG = {
+    'ROUTER_CACHE_SIZE': 1024,  # route lookups
+    'PIPELINE_CONCURRENCY': 1,  # pipelined requests handled at once
+    'REQUEST_STREAM_HIGH_WATER': 1048576,  # streamed body bytes buffered
+    'REQUEST_STREAM_LOW_WATER': 262144,  # buffered bytes to resume reading
+    'REQUEST_BODY_PREALLOCATE': 64 * 1024 * 1024,  # body bytes allocated
+    'JSON_ENCODER': 'auto',  # ujson or json, orjson, or an encoder function
+    'STATIC_CACHE_SIZE': 64 * 1024 * 1024,  # bytes of cached static files
+    'STATIC_CACHE_FILE_SIZE': 1024 * 1024,  # largest file kept in memory
+    'STATIC_CACHE_CHECK_INTERVAL': 1,  # seconds between checks for changes
+    'EVENT_LOOP': 'auto',  # uvloop, asyncio or auto for uvloop if installed
+    'EVENT_LOOP_EXECUTOR_SIZE': None,  # threads of the default executor
+    'EVENT_LOOP_SLOW_CALLBACK': 0.1,  # seconds, logged in debug mode
+    'WORKER_MAX_REQUESTS': 0,  # requests before a worker is recycled
+    'WORKER_MAX_MEMORY': 0,  # resident bytes before a worker is recycled
+}
+
 
 class Config(SanicConfig):
     def __init__(self, defaults=None, load_env=True, keep_alive=True):
-        super(Config, self).__init__(defaults, load_env=load_env,
+        necktie_defaults = dict(DEFAULT_CONFIG)
+        necktie_defaults.update(defaults or {})
+        super(Config, self).__init__(necktie_defaults, load_env=load_env,
                                      keep_alive=keep_alive)
         self.LOGO = """**! Starting pyNecktie High Performance HTTP Service !**"""
 
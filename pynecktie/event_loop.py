@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+EVENT_LOOP_POLICIES = {
+    'asyncio': asyncio.DefaultEventLoopPolicy,
+}
+if uvloop is not None:
+    EVENT_LOOP_POLICIES['uvloop'] = uvloop.EventLoopPolicy
+
+
+def get_event_loop_name(event_loop='auto'):
+    """Get the event loop implementation for an `EVENT_LOOP` setting.
+
+    :param event_loop: `'auto'` for uvloop when it is installed and the
+                       asyncio loop otherwise, `'uvloop'` or `'asyncio'`
+    :return: name of the implementation
+    """
+    if event_loop == 'auto':
+        return 'uvloop' if 'uvloop' in EVENT_LOOP_POLICIES else 'asyncio'
+    if event_loop not in EVENT_LOOP_POLICIES:
+        raise ValueError('Event loop {!r} is not available, expected '
+                         'one of: auto, {}'.format(
+                             event_loop,
+                             ', '.join(sorted(EVENT_LOOP_POLICIES))))
+    return event_loop
+
+
+def new_event_loop(event_loop='auto', executor_size=None, debug=False,
+                   slow_callback_duration=None):
+    """Create the event loop of a worker and set it as the current loop.
+
+    The policy of the chosen implementation is installed as well, so that
+    loops the application creates itself in the worker are of the same
+    kind. Debug mode is set explicitly, so that `PYTHONASYNCIODEBUG` in the
+    environment does not slow down a production server.
+
+    :param event_loop: setting as accepted by :func:`get_event_loop_name`
+    :param executor_size: threads of the loop's default executor, None for
+                          the default of `concurrent.futures`
+    :param debug: enables the loop's debug mode
+    :param slow_callback_duration: callbacks running longer than this are
+                                   logged in debug mode (seconds)
+    :return: the event loop
+    """
+    name = get_event_loop_name(event_loop)
+    asyncio.set_event_loop_policy(EVENT_LOOP_POLICIES[name]())
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.set_debug(debug)
+    if slow_callback_duration is not None:
+        loop.slow_callback_duration = slow_callback_duration
+    if executor_size is not None:
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=executor_size))
+    return loop
+
+
+__all__ = ["EVENT_LOOP_POLICIES", "get_event_loop_name", "new_event_loop"]
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+from multidict import CIMultiDict, MutableMultiMapping
+
+_marker = object()
+
+# Header names most requests carry, so that the decoded names can be shared
+# between requests instead of being allocated for every request.
+COMMON_HEADERS = (
+    'accept', 'accept-charset', 'accept-encoding', 'accept-language',
+    'authorization', 'cache-control', 'connection', 'content-encoding',
+    'content-length', 'content-type', 'cookie', 'dnt', 'expect',
+    'forwarded', 'host', 'if-match', 'if-modified-since', 'if-none-match',
+    'if-range', 'if-unmodified-since', 'keep-alive', 'origin', 'pragma',
+    'range', 'referer', 'sec-websocket-extensions', 'sec-websocket-key',
+    'sec-websocket-protocol', 'sec-websocket-version', 'te',
+    'transfer-encoding', 'upgrade', 'user-agent', 'via',
+    'x-forwarded-for', 'x-forwarded-host', 'x-forwarded-port',
+    'x-forwarded-proto', 'x-real-ip', 'x-request-id',
+)
+
+# raw lower case name -> decoded name
+_header_names = {name.encode(): name for name in COMMON_HEADERS}
+# name as looked up by the application -> raw lower case name
+_header_keys = {}
+for _name in COMMON_HEADERS:
+    _header_keys[_name] = _header_keys[_name.title()] = _name.encode()
+_HEADER_KEYS_MAX = 1024
+_accepted_encodings = {}
+_ACCEPTED_ENCODINGS_MAX = 256
+
+
+def _decode(value):
+    try:
+        return value.decode()
+    except UnicodeDecodeError:
+        return value.decode('latin_1')
+
+
+def _header_key(key):
+    raw = _header_keys.get(key)
+    if raw is None:
+        raw = key.lower().encode()
+        if len(_header_keys) < _HEADER_KEYS_MAX:
+            _header_keys[key] = raw
+    return raw
+
+
+def accepted_encodings(accept_encoding, encodings):
+    """Find which of the content codings a server can send are allowed by
+    an Accept-Encoding header. Results are cached, as clients send only a
+    handful of different headers.
+
+    :param accept_encoding: Accept-Encoding header value
+    :param encodings: tuple of content codings, such as `('br', 'gzip')`
+    :return: frozenset of the allowed codings
+    """
+    key = (accept_encoding, encodings)
+    allowed = _accepted_encodings.get(key)
+    if allowed is None:
+        accepted, rejected = set(), set()
+        for item in accept_encoding.split(','):
+            coding, _, params = item.partition(';')
+            coding = coding.strip().lower()
+            if coding == 'x-gzip':
+                coding = 'gzip'
+            quality = 1.0
+            for param in params.split(';'):
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        pass
+            (accepted if quality > 0 else rejected).add(coding)
+        allowed = frozenset(
+            encoding for encoding in encodings
+            if encoding in accepted or
+            ('*' in accepted and encoding not in rejected))
+        if len(_accepted_encodings) < _ACCEPTED_ENCODINGS_MAX:
+            _accepted_encodings[key] = allowed
+    return allowed
+
+
+class Headers(MutableMultiMapping):
+    """Case insensitive multi-dict of request headers, decoded on access.
+
+    The parser hands over the raw `(name, value)` byte pairs. Looking up a
+    header only decodes the values of that header; iterating, copying or
+    modifying the headers turns them into a regular
+    :class:`multidict.CIMultiDict`, which is then used for every operation.
+    Names are lower case, as they were with the `CIMultiDict` built by the
+    server before.
+    """
+
+    def __init__(self, raw=None):
+        self._raw = raw if raw is not None else []
+        self._index = None
+        self._decoded = {}
+        self._dict = None
+
+    def _values(self, key):
+        if self._dict is not None:
+            return self._dict.getall(key, ())
+        try:
+            raw_key = _header_key(key)
+        except AttributeError:
+            return ()
+        values = self._decoded.get(raw_key)
+        if values is None:
+            index = self._index
+            if index is None:
+                index = self._index = {}
+                for name, value in self._raw:
+                    name = name.lower()
+                    if name in index:
+                        index[name].append(value)
+                    else:
+                        index[name] = [value]
+            values = self._decoded[raw_key] = \
+                [_decode(value) for value in index.get(raw_key, ())]
+        return values
+
+    def _materialize(self):
+        if self._dict is None:
+            self._dict = CIMultiDict(
+                (_header_names.get(name.lower()) or
+                 _decode(name).casefold(), _decode(value))
+                for name, value in self._raw)
+            self._raw = self._index = self._decoded = None
+        return self._dict
+
+    # -------------------------------------------- #
+    # Lookups
+    # -------------------------------------------- #
+
+    def get(self, key, default=None):
+        values = self._values(key)
+        return values[0] if values else default
+
+    def getone(self, key, default=_marker):
+        values = self._values(key)
+        if values:
+            return values[0]
+        if default is not _marker:
+            return default
+        raise KeyError('Key not found: %r' % key)
+
+    def getall(self, key, default=_marker):
+        values = self._values(key)
+        if values:
+            return list(values)
+        if default is not _marker:
+            return default
+        raise KeyError('Key not found: %r' % key)
+
+    def __getitem__(self, key):
+        return self.getone(key)
+
+    def __contains__(self, key):
+        return bool(self._values(key))
+
+    def __len__(self):
+        if self._dict is None:
+            return len(self._raw)
+        return len(self._dict)
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def keys(self):
+        return self._materialize().keys()
+
+    def values(self):
+        return self._materialize().values()
+
+    def items(self):
+        return self._materialize().items()
+
+    def copy(self):
+        return self._materialize().copy()
+
+    def __eq__(self, other):
+        return self._materialize() == other
+
+    def __repr__(self):
+        return '<{}({!r})>'.format(type(self).__name__,
+                                   list(self._materialize().items()))
+
+    # -------------------------------------------- #
+    # Modifications
+    # -------------------------------------------- #
+
+    def add(self, key, value):
+        self._materialize().add(key, value)
+
+    def extend(self, *args, **kwargs):
+        self._materialize().extend(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        self._materialize().update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        return self._materialize().setdefault(key, default)
+
+    def popone(self, key, default=_marker):
+        if default is _marker:
+            return self._materialize().popone(key)
+        return self._materialize().popone(key, default)
+
+    pop = popone
+
+    def popall(self, key, default=_marker):
+        if default is _marker:
+            return self._materialize().popall(key)
+        return self._materialize().popall(key, default)
+
+    def popitem(self):
+        return self._materialize().popitem()
+
+    def clear(self):
+        self._materialize().clear()
+
+    def __setitem__(self, key, value):
+        self._materialize()[key] = value
+
+    def __delitem__(self, key):
+        del self._materialize()[key]
+
+
+__all__ = ["Headers", "COMMON_HEADERS", "accepted_encodings"]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec:
+    """Encoder and decoder used for JSON responses and request bodies.
+
+    :param name: name of the codec, as used by the `JSON_ENCODER` setting
+    :param dumps: function encoding an object to JSON `bytes`, passed the
+                  keyword arguments given to :func:`pynecktie.response.json`
+    :param loads: function decoding a JSON `bytes` object
+    """
+    __slots__ = ('name', 'dumps', 'loads')
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return '<JSONCodec {}>'.format(self.name)
+
+
+def _json_dumps(obj, **kwargs):
+    if kwargs.get('indent') is None:
+        kwargs.setdefault('separators', (',', ':'))
+    return json.dumps(obj, **kwargs).encode()
+
+
+def _json_loads(data):
+    # on Python 3.5 json.loads only supports str not bytes
+    return json.loads(data.decode())
+
+
+def _ujson_dumps(obj, **kwargs):
+    return ujson.dumps(obj, **kwargs).encode()
+
+
+def _orjson_dumps(obj, **kwargs):
+    # orjson takes none of the options of the json module, so calls with
+    # keyword arguments are encoded by the json module instead
+    if kwargs:
+        return _json_dumps(obj, **kwargs)
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+JSON_CODECS = {
+    'json': JSONCodec('json', _json_dumps, _json_loads),
+}
+if ujson is not None:
+    JSON_CODECS['ujson'] = JSONCodec('ujson', _ujson_dumps, ujson.loads)
+if orjson is not None:
+    JSON_CODECS['orjson'] = JSONCodec('orjson', _orjson_dumps, orjson.loads)
+
+
+def get_codec(encoder='auto'):
+    """Get the codec for a `JSON_ENCODER` setting.
+
+    :param encoder: `'auto'` for ujson if it is installed, else the json
+                    module, as `sanic.response.json_dumps` does, the name of
+                    a library (`'orjson'`, `'ujson'` or `'json'`), a
+                    :class:`JSONCodec`, or a function encoding an object to
+                    JSON `bytes`, which is paired with the `'auto'` decoder
+    :return: JSONCodec
+    """
+    if isinstance(encoder, JSONCodec):
+        return encoder
+    if callable(encoder):
+        return JSONCodec(getattr(encoder, '__name__', 'custom'), encoder,
+                         get_codec().loads)
+    if encoder == 'auto':
+        # orjson writes NaN as null, does not escape non-ASCII characters
+        # or '/' and rejects some keys, so it is only used when asked for
+        for name in ('ujson', 'json'):
+            if name in JSON_CODECS:
+                return JSON_CODECS[name]
+    try:
+        return JSON_CODECS[encoder]
+    except KeyError:
+        raise ValueError('JSON encoder {!r} is not available, expected '
+                         'one of: auto, {}'.format(
+                             encoder, ', '.join(sorted(JSON_CODECS))))
+
+
+# Codec of responses and requests not served by an application, the
+# application's own is set by its JSON_ENCODER setting
+default_codec = get_codec()
+
+
+def dumps(obj, **kwargs):
+    """Encode an object to JSON `bytes` with the default codec."""
+    return default_codec.dumps(obj, **kwargs)
+
+
+def loads(data):
+    """Decode JSON `bytes` with the default codec."""
+    return default_codec.loads(data)
+
+
+__all__ = ["JSONCodec", "JSON_CODECS", "get_codec", "default_codec", "dumps",
+           "loads"]
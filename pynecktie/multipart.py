@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from cgi import parse_header
+from collections import deque
+from tempfile import SpooledTemporaryFile
+
+from pynecktie.exceptions import InvalidUsage, PayloadTooLarge
+from pynecktie.request import File, RequestParameters
+
+# Uploads larger than this are moved from memory to a temporary file
+SPOOL_SIZE = 1024 * 1024
+# Largest header block of a single part
+MAX_HEADER_SIZE = 16384
+# Largest form field, other than a file, read by read_multipart
+MAX_FIELD_SIZE = 1024 * 1024
+
+# Events returned by MultipartParser.feed
+PART_HEADERS = 0
+PART_DATA = 1
+PART_END = 2
+BODY_END = 3
+
+_PREAMBLE = 0
+_DELIMITER = 1
+_HEADERS = 2
+_BODY = 3
+_EPILOGUE = 4
+
+
+class MultipartParser:
+    """Incremental parser of a multipart/form-data body.
+
+    Chunks of the body are passed to :meth:`feed` as they arrive, which
+    returns the events found so far as `(event, value)` tuples:
+    `PART_HEADERS` with a dict of the part's headers, `PART_DATA` with
+    bytes of the part's body, `PART_END` and `BODY_END`. Only a delimiter
+    length of data is held back between chunks, so memory use does not
+    grow with the size of the parts.
+
+    :param boundary: boundary parameter of the Content-Type header
+    :param max_header_size: largest header block of a part (bytes)
+    """
+    __slots__ = ('_delimiter', '_buffer', '_state', '_max_header_size')
+
+    def __init__(self, boundary, max_header_size=MAX_HEADER_SIZE):
+        if isinstance(boundary, str):
+            boundary = boundary.encode('utf-8')
+        self._delimiter = b'\r\n--' + boundary
+        # the first delimiter is not preceded by a line break
+        self._buffer = bytearray(b'\r\n')
+        self._state = _PREAMBLE
+        self._max_header_size = max_header_size
+
+    @property
+    def finished(self):
+        return self._state == _EPILOGUE
+
+    def feed(self, data):
+        """Parse the next chunk of the body.
+
+        :param data: bytes-like chunk
+        :return: list of events
+        :raises InvalidUsage: if the body is not valid multipart data
+        """
+        buffer = self._buffer
+        delimiter = self._delimiter
+        events = []
+        if self._state == _EPILOGUE:
+            return events
+        buffer.extend(data)
+        while True:
+            state = self._state
+            if state == _BODY or state == _PREAMBLE:
+                index = buffer.find(delimiter)
+                if index < 0:
+                    # keep what could be the start of a delimiter
+                    keep = len(buffer) - len(delimiter) + 1
+                    if keep > 0:
+                        if state == _BODY:
+                            events.append((PART_DATA, bytes(buffer[:keep])))
+                        del buffer[:keep]
+                    return events
+                if state == _BODY:
+                    if index:
+                        events.append((PART_DATA, bytes(buffer[:index])))
+                    events.append((PART_END, None))
+                del buffer[:index + len(delimiter)]
+                self._state = _DELIMITER
+            elif state == _DELIMITER:
+                if buffer[:2] == b'--':
+                    del buffer[:]
+                    self._state = _EPILOGUE
+                    events.append((BODY_END, None))
+                    return events
+                index = buffer.find(b'\r\n')
+                if index < 0:
+                    if len(buffer) > self._max_header_size:
+                        raise InvalidUsage('Invalid multipart boundary')
+                    return events
+                if buffer[:index].strip(b' \t'):
+                    raise InvalidUsage('Invalid multipart boundary')
+                # keep the line break, so that a part without headers
+                # ends its header block at once
+                del buffer[:index]
+                self._state = _HEADERS
+            elif state == _HEADERS:
+                index = buffer.find(b'\r\n\r\n')
+                if index < 0 and len(buffer) <= self._max_header_size:
+                    return events
+                if index < 0 or index > self._max_header_size:
+                    raise InvalidUsage('Multipart headers too large')
+                events.append((PART_HEADERS,
+                               _parse_headers(bytes(buffer[2:index]))))
+                del buffer[:index + 4]
+                self._state = _BODY
+
+    def close(self):
+        """Check that the whole body has been fed.
+
+        :raises InvalidUsage: if the body ended before the last delimiter
+        """
+        if self._state != _EPILOGUE:
+            raise InvalidUsage('Incomplete multipart body')
+
+
+def _parse_headers(data):
+    headers = {}
+    for line in data.split(b'\r\n'):
+        if not line:
+            continue
+        name, sep, value = line.partition(b':')
+        if not sep:
+            raise InvalidUsage('Invalid multipart header')
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            value = value.decode('latin_1')
+        headers[name.decode('latin_1').strip().lower()] = value.strip()
+    return headers
+
+
+class BodyPart:
+    """A part of a multipart body, read as it arrives.
+
+    Iterating over the part with `async for` gives the chunks of its body.
+    A part that is not read to the end is skipped when the next part is
+    requested from the :class:`MultipartReader`.
+    """
+    __slots__ = ('headers', 'name', 'filename', 'content_type', 'charset',
+                 '_reader', '_finished')
+
+    def __init__(self, reader, headers):
+        self.headers = headers
+        _, params = parse_header(
+            headers.get('content-disposition', ''))
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        content_type, params = parse_header(
+            headers.get('content-type', 'text/plain'))
+        self.content_type = content_type
+        self.charset = params.get('charset', 'utf-8')
+        self._reader = reader
+        self._finished = False
+
+    def __repr__(self):
+        return '<{} {!r} {!r}>'.format(type(self).__name__, self.name,
+                                       self.filename)
+
+    async def read_chunk(self):
+        """Read the next chunk of the body.
+
+        :return: bytes, empty at the end of the part
+        """
+        if self._finished:
+            return b''
+        event, value = await self._reader._next_event()
+        if event == PART_DATA:
+            return value
+        self._finished = True
+        return b''
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.read_chunk()
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+    async def read(self, max_size=None):
+        """Read the whole body into memory.
+
+        :param max_size: largest body to read (bytes), unlimited if None
+        :return: bytes
+        :raises PayloadTooLarge: if the body is larger than `max_size`
+        """
+        chunks = []
+        size = 0
+        while True:
+            chunk = await self.read_chunk()
+            if not chunk:
+                return b''.join(chunks)
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise PayloadTooLarge('Multipart field too large')
+            chunks.append(chunk)
+
+    async def text(self, max_size=None):
+        """Read the whole body and decode it with the part's charset.
+
+        :param max_size: largest body to read (bytes), unlimited if None
+        """
+        return (await self.read(max_size)).decode(self.charset)
+
+    async def spool(self, spool_size=SPOOL_SIZE):
+        """Read the body into a `SpooledTemporaryFile`, which is written to
+        disk once it holds more than `spool_size` bytes. Writes to disk are
+        done in the default executor.
+
+        :param spool_size: bytes to keep in memory
+        :return: File, with the file, rewound, as its body
+        """
+        spooled = SpooledTemporaryFile(max_size=spool_size)
+        loop = asyncio.get_event_loop()
+        written = 0
+        try:
+            while True:
+                chunk = await self.read_chunk()
+                if not chunk:
+                    break
+                written += len(chunk)
+                # the write that moves the file to disk and the ones after
+                # it are not done on the event loop
+                if written > spool_size:
+                    await loop.run_in_executor(None, spooled.write, chunk)
+                else:
+                    spooled.write(chunk)
+            spooled.seek(0)
+        except BaseException:
+            spooled.close()
+            raise
+        return File(type=self.content_type, body=spooled,
+                    name=self.filename)
+
+    async def release(self):
+        """Skip the rest of the body."""
+        while await self.read_chunk():
+            pass
+
+
+class MultipartReader:
+    """Reads a multipart/form-data request body part by part.
+
+    For a route registered with `stream=True`, the body is parsed from
+    `request.stream` as it is received, so only the chunk being parsed is
+    held in memory. For other routes, `request.body` is parsed.
+
+    Example usage::
+
+        @app.post('/upload', stream=True)
+        async def upload(request):
+            async for part in MultipartReader(request):
+                if part.filename:
+                    async for chunk in part:
+                        ...
+
+    :param request: Request with a multipart/form-data body
+    :param boundary: boundary of the parts, taken from the request's
+                     Content-Type header by default
+    :raises InvalidUsage: if the request is not multipart/form-data
+    """
+    __slots__ = ('_request', '_parser', '_events', '_part', '_eof')
+
+    def __init__(self, request, boundary=None):
+        if boundary is None:
+            content_type, params = parse_header(request.content_type)
+            boundary = params.get('boundary')
+            if not content_type.startswith('multipart/') or not boundary:
+                raise InvalidUsage('Expected a multipart/form-data body')
+        self._request = request
+        self._parser = MultipartParser(boundary)
+        self._events = deque()
+        self._part = None
+        self._eof = False
+
+    async def _next_event(self):
+        events = self._events
+        while not events:
+            if self._eof:
+                self._parser.close()
+                raise InvalidUsage('Incomplete multipart body')
+            stream = self._request.stream
+            if stream is None:
+                chunk = self._request.body
+                self._eof = True
+            else:
+                chunk = await stream.get()
+                if chunk is None:
+                    self._eof = True
+                    continue
+            events.extend(self._parser.feed(chunk))
+        return events.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        part = self._part
+        if part is not None:
+            await part.release()
+            self._part = None
+        event, value = await self._next_event()
+        if event == BODY_END:
+            raise StopAsyncIteration
+        self._part = BodyPart(self, value)
+        return self._part
+
+
+async def read_multipart(request, spool_size=SPOOL_SIZE,
+                         max_field_size=MAX_FIELD_SIZE):
+    """Read a multipart/form-data body into form fields and files, like
+    `request.form` and `request.files`, without holding the whole body in
+    memory. Files are spooled to disk past `spool_size` bytes.
+
+    :param request: Request with a multipart/form-data body
+    :param spool_size: bytes of each file to keep in memory
+    :param max_field_size: largest field other than a file (bytes)
+    :return: tuple of (fields, files) RequestParameters
+    :raises PayloadTooLarge: if a field is larger than `max_field_size`
+    """
+    fields = RequestParameters()
+    files = RequestParameters()
+    async for part in MultipartReader(request):
+        if part.name is None:
+            await part.release()
+        elif part.filename is not None:
+            files.setdefault(part.name, []).append(
+                await part.spool(spool_size))
+        else:
+            fields.setdefault(part.name, []).append(
+                await part.text(max_field_size))
+    return fields, files
+
+
+__all__ = ["MultipartParser", "MultipartReader", "BodyPart",
+           "read_multipart", "SPOOL_SIZE", "MAX_HEADER_SIZE",
+           "MAX_FIELD_SIZE", "PART_HEADERS", "PART_DATA", "PART_END",
+           "BODY_END"]
@@ -1,15 +1,346 @@
 # -*- coding: utf-8 -*-
-from sanic.request import Request as SanicRequest, RequestParameters as SanicRequestParameters
-from sanic.request import File, DEFAULT_HTTP_CONTENT_TYPE, parse_multipart_form
+import asyncio
+from cgi import parse_header
+from collections import deque
+from urllib.parse import parse_qs
 
+from httptools import parse_url
+from sanic.request import Request as SanicRequest, RequestParameters as SanicRequestParameters
+from sanic.request import File, DEFAULT_HTTP_CONTENT_TYPE
 
-class Request(SanicRequest):
-    pass
+from pynecktie import json_codec
+from pynecktie.exceptions import InvalidUsage
+from pynecktie.log import logger, error_logger
 
 
 class RequestParameters(SanicRequestParameters):
     pass
 
 
-__all__ = ["Request", "RequestParameters", "File", "DEFAULT_HTTP_CONTENT_TYPE",
-           "parse_multipart_form"]
+class RequestStream:
+    """Body of a request to a stream handler, as `request.stream`.
+
+    The server feeds the received chunks in, and stops reading from the
+    client while more than `high_water` bytes are buffered, until the
+    handler has read the buffer down to `low_water` bytes. A client
+    uploading faster than the handler reads thus holds up to about
+    `high_water` bytes in memory, instead of the whole body.
+
+    The body is read with :meth:`read` and :meth:`readexactly`, as from an
+    `asyncio.StreamReader`, by iterating with `async for`, or chunk by
+    chunk with :meth:`get`, which returns None at the end of the body like
+    the `asyncio.Queue` that was used before.
+
+    :param loop: event loop
+    :param high_water: buffered bytes at which reading is paused
+    :param low_water: buffered bytes at which reading is resumed
+    :param pause_reading: function called to pause reading
+    :param resume_reading: function called to resume reading
+    """
+    __slots__ = ('_loop', '_chunks', '_size', '_eof', '_waiter',
+                 'high_water', 'low_water', '_pause_reading',
+                 '_resume_reading', '_paused', '_discarded')
+
+    def __init__(self, loop=None, high_water=1048576, low_water=None,
+                 pause_reading=None, resume_reading=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._chunks = deque()
+        self._size = 0
+        self._eof = False
+        self._waiter = None
+        self.high_water = high_water
+        self.low_water = high_water // 4 if low_water is None else low_water
+        self._pause_reading = pause_reading
+        self._resume_reading = resume_reading
+        self._paused = False
+        self._discarded = False
+
+    def __len__(self):
+        """Number of bytes buffered."""
+        return self._size
+
+    def at_eof(self):
+        """Whether the whole body has been received and read."""
+        return self._eof and not self._chunks
+
+    # -------------------------------------------- #
+    # Fed by the server
+    # -------------------------------------------- #
+
+    def feed_data(self, data):
+        if not data or self._discarded:
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        self._wakeup()
+        if not self._paused and self._size > self.high_water and \
+                self._pause_reading is not None:
+            self._paused = True
+            self._pause_reading()
+
+    def feed_eof(self):
+        self._eof = True
+        self._wakeup()
+
+    def discard(self):
+        """Drop the buffered data and any that is still received, once
+        the handler has finished without reading the whole body."""
+        self._discarded = True
+        self._chunks.clear()
+        self._consumed(self._size)
+
+    def _wakeup(self):
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _consumed(self, size):
+        self._size -= size
+        if self._paused and self._size <= self.low_water:
+            self._paused = False
+            self._resume_reading()
+
+    async def _wait(self):
+        if self._waiter is not None:
+            raise RuntimeError('The request stream is already being read')
+        self._waiter = self._loop.create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+    # -------------------------------------------- #
+    # Read by the handler
+    # -------------------------------------------- #
+
+    async def get(self):
+        """Read the next chunk of the body as it was received.
+
+        :return: bytes, or None at the end of the body
+        """
+        while not self._chunks:
+            if self._eof:
+                return None
+            await self._wait()
+        chunk = self._chunks.popleft()
+        self._consumed(len(chunk))
+        return chunk
+
+    async def read(self, n=-1):
+        """Read up to `n` bytes, returning as soon as any are available.
+        With `n` of -1, read the rest of the body.
+
+        :param n: maximum number of bytes to read
+        :return: bytes, empty at the end of the body
+        """
+        if n < 0:
+            chunks = []
+            while True:
+                chunk = await self.get()
+                if chunk is None:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if n == 0:
+            return b''
+        while not self._chunks:
+            if self._eof:
+                return b''
+            await self._wait()
+        chunk = self._chunks[0]
+        if len(chunk) <= n:
+            self._chunks.popleft()
+        else:
+            self._chunks[0] = chunk[n:]
+            chunk = chunk[:n]
+        self._consumed(len(chunk))
+        return bytes(chunk)
+
+    async def readexactly(self, n):
+        """Read exactly `n` bytes.
+
+        :param n: number of bytes to read
+        :return: bytes
+        :raises asyncio.IncompleteReadError: if the body ends before
+        """
+        chunks = []
+        remaining = n
+        while remaining:
+            chunk = await self.read(remaining)
+            if not chunk:
+                partial = b''.join(chunks)
+                raise asyncio.IncompleteReadError(partial, n)
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.get()
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+
+class Request(SanicRequest):
+    """Properties of an HTTP request such as URL, headers, etc.
+
+    The query arguments, form fields, uploaded files, cookies and JSON body
+    are parsed the first time they are accessed, each on its own, and the
+    result is kept for later accesses. Requests have no `__dict__`, values
+    of the application's own are stored in the request as a dict.
+    """
+    __slots__ = ('_json_loaded',)
+
+    def __init__(self, url_bytes, headers, version, method, transport):
+        self.raw_url = url_bytes
+        self._parsed_url = parse_url(url_bytes)
+        self.app = None
+
+        self.headers = headers
+        self.version = version
+        self.method = method
+        self.transport = transport
+
+        # Parsed on first access
+        self.body = []
+        self.parsed_json = None
+        self._json_loaded = False
+        self.parsed_form = None
+        self.parsed_files = None
+        self.parsed_args = None
+        self.uri_template = None
+        self._cookies = None
+        self.stream = None
+
+    @property
+    def json(self):
+        if not self._json_loaded:
+            self.load_json()
+        return self.parsed_json
+
+    def load_json(self, loads=None):
+        """Decode the body with the codec set by the application's
+        `JSON_ENCODER`, or with `loads` when given."""
+        if loads is None:
+            codec = getattr(self.app, 'json_codec', None)
+            loads = (codec or json_codec.default_codec).loads
+        try:
+            self.parsed_json = loads(self.body)
+        except Exception:
+            if not self.body:
+                self._json_loaded = True
+                return None
+            raise InvalidUsage("Failed when parsing body as json")
+
+        self._json_loaded = True
+        return self.parsed_json
+
+    @property
+    def form(self):
+        if self.parsed_form is None:
+            self._parse_form()
+        return self.parsed_form
+
+    @property
+    def files(self):
+        if self.parsed_files is None:
+            self._parse_form()
+        return self.parsed_files
+
+    def _parse_form(self):
+        form = files = None
+        content_type, parameters = parse_header(self.content_type)
+        try:
+            if content_type == 'application/x-www-form-urlencoded':
+                form = RequestParameters(parse_qs(self.body.decode('utf-8')))
+            elif content_type == 'multipart/form-data':
+                boundary = parameters['boundary'].encode('utf-8')
+                form, files = parse_multipart_form(self.body, boundary)
+        except Exception:
+            error_logger.exception("Failed when parsing form")
+        self.parsed_form = form if form is not None else RequestParameters()
+        self.parsed_files = files if files is not None \
+            else RequestParameters()
+
+    @property
+    def args(self):
+        if self.parsed_args is None:
+            query = self._parsed_url.query
+            self.parsed_args = RequestParameters(
+                parse_qs(query.decode('utf-8')) if query else ())
+        return self.parsed_args
+
+
+def parse_multipart_form(body, boundary):
+    """Parse a request body and returns fields and files
+
+    Like `sanic.request.parse_multipart_form`, but the parts are sliced
+    from a memoryview of the body instead of splitting it, so every file is
+    copied once, into bytes, whether the body is bytes or a bytearray.
+
+    :param body: bytes-like request body
+    :param boundary: bytes multipart boundary
+    :return: fields (RequestParameters), files (RequestParameters)
+    """
+    files = RequestParameters()
+    fields = RequestParameters()
+
+    with memoryview(body) as view:
+        _parse_multipart_parts(body, view, boundary, fields, files)
+    return fields, files
+
+
+def _parse_multipart_parts(body, view, boundary, fields, files):
+    start = body.find(boundary)
+    while start >= 0:
+        start += len(boundary)
+        end = body.find(boundary, start)
+        if end < 0:
+            break
+        file_name = None
+        content_type = 'text/plain'
+        content_charset = 'utf-8'
+        field_name = None
+        line_index = start + 2
+        while True:
+            line_end_index = body.find(b'\r\n', line_index, end)
+            if line_end_index < 0:
+                line_end_index = end
+            form_line = str(view[line_index:line_end_index], 'utf-8')
+            line_index = line_end_index + 2
+            if not form_line:
+                break
+
+            colon_index = form_line.index(':')
+            form_header_field = form_line[0:colon_index].lower()
+            form_header_value, form_parameters = parse_header(
+                form_line[colon_index + 2:])
+
+            if form_header_field == 'content-disposition':
+                file_name = form_parameters.get('filename')
+                field_name = form_parameters.get('name')
+            elif form_header_field == 'content-type':
+                content_type = form_header_value
+                content_charset = form_parameters.get('charset', 'utf-8')
+
+        if field_name:
+            # the part ends with the line break and dashes of the boundary
+            post_data = view[line_index:end - 4]
+            if file_name:
+                files.setdefault(field_name, []).append(File(
+                    type=content_type, name=file_name, body=bytes(post_data)))
+            else:
+                fields.setdefault(field_name, []).append(
+                    str(post_data, content_charset))
+        else:
+            logger.debug('Form-data field does not have a \'name\' '
+                         'parameter in the Content-Disposition header')
+        start = end
+
+
+__all__ = ["Request", "RequestParameters", "RequestStream", "File",
+           "DEFAULT_HTTP_CONTENT_TYPE", "parse_multipart_form"]
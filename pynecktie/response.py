@@ -1,14 +1,115 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import os
+from email.utils import formatdate
+from mimetypes import guess_type
+from os import path
+from time import time
+from urllib.parse import quote_plus
+
+from aiofiles import open as open_async
 from sanic.response import BaseHTTPResponse as SanicBaseHTTPResponse, HTTPResponse as SanicHTTPResponse,\
     StreamingHTTPResponse as SanicStreamingHTTPResponse
-from sanic.response import text, raw, json, file, file_stream, html, redirect, stream, json_dumps
+from sanic.response import json_dumps
 from sanic import http
 from sanic.http import STATUS_CODES
 
+from pynecktie import json_codec
 from pynecktie.cookies import CookieJar
 
+# Bodies up to this size are copied behind the headers into one buffer,
+# larger bodies are handed to the transport as they are
+COALESCE_BODY_SIZE = 16384
+
+# -------------------------------------------- #
+# Pre-encoded header lines
+# -------------------------------------------- #
+
+# version -> status -> b'HTTP/1.1 200 OK\r\n'
+STATUS_LINES = {
+    version: {
+        status: b'HTTP/%b %d %b\r\n' % (version.encode(), status, reason)
+        for status, reason in STATUS_CODES.items()
+    } for version in ('1.0', '1.1')
+}
+CONNECTION_KEEP_ALIVE = b'Connection: keep-alive\r\n'
+CONNECTION_CLOSE = b'Connection: close\r\n'
+
+_keep_alive_headers = {}
+_content_type_headers = {}
+_HEADER_CACHE_MAX = 256
+_date_header = None
+# When _date_header was formatted
+_date_header_time = 0.0
+
+
+def _status_line(version, status):
+    try:
+        return STATUS_LINES[version][status]
+    except KeyError:
+        return b'HTTP/%b %d %b\r\n' % (
+            version.encode(), status,
+            STATUS_CODES.get(status, b'UNKNOWN RESPONSE'))
+
+
+def _keep_alive_header(timeout):
+    header = _keep_alive_headers.get(timeout)
+    if header is None:
+        header = b'Keep-Alive: %d\r\n' % timeout
+        if len(_keep_alive_headers) < _HEADER_CACHE_MAX:
+            _keep_alive_headers[timeout] = header
+    return header
+
+
+def _content_type_header(content_type):
+    header = _content_type_headers.get(content_type)
+    if header is None:
+        header = b'Content-Type: %b\r\n' % content_type.encode('utf-8')
+        if len(_content_type_headers) < _HEADER_CACHE_MAX:
+            _content_type_headers[content_type] = header
+    return header
+
+
+def update_date_header(now=None):
+    """Format the `Date` header sent with every response. The server calls
+    this once a second, from `update_current_time`.
+
+    :param now: timestamp, defaults to the current time
+    """
+    global _date_header, _date_header_time
+    _date_header_time = time()
+    _date_header = b'Date: %b\r\n' % formatdate(
+        _date_header_time if now is None else now, usegmt=True).encode()
+
+
+def _current_date_header():
+    # Formatted again when it was not updated for a second, as when the
+    # server is started by sanic's serve(), which does not call
+    # update_current_time
+    if time() - _date_header_time >= 1:
+        update_date_header()
+    return _date_header
+
+
+update_date_header()
+
 
 class BaseHTTPResponse(SanicBaseHTTPResponse):
+    # Codec of the application serving the response, set by the
+    # application before its response middleware runs, see json()
+    json_codec = None
+
+    def _parse_headers(self):
+        lines = []
+        for name, value in self.headers.items():
+            try:
+                lines.append(b'%b: %b\r\n' % (
+                    name.encode(), value.encode('utf-8')))
+            except AttributeError:
+                lines.append(b'%b: %b\r\n' % (
+                    str(name).encode(), str(value).encode('utf-8')))
+        return b''.join(lines)
+
     @property
     def cookies(self):
         if self._cookies is None:
@@ -16,20 +117,492 @@ class BaseHTTPResponse(SanicBaseHTTPResponse):
         return self._cookies
 
 
-class HTTPResponse(SanicHTTPResponse):
+class HTTPResponse(BaseHTTPResponse, SanicHTTPResponse):
+    def _output_head(self, version, keep_alive, keep_alive_timeout):
+        status = self.status
+        lines = [_status_line(version, status),
+                 CONNECTION_KEEP_ALIVE if keep_alive else CONNECTION_CLOSE]
+        if keep_alive and keep_alive_timeout is not None:
+            lines.append(_keep_alive_header(keep_alive_timeout))
+
+        body = b''
+        if status in (304, 412):
+            if http.has_message_body(status):
+                body = self.body
+            self.headers = http.remove_entity_headers(self.headers)
+        else:
+            headers = self.headers
+            if http.has_message_body(status):
+                body = self.body
+                if 'Content-Length' not in headers:
+                    lines.append(b'Content-Length: %d\r\n' % len(body))
+            if 'Content-Type' not in headers:
+                lines.append(_content_type_header(self.content_type))
+        headers = self.headers
+        if headers:
+            lines.append(self._parse_headers())
+        if 'Date' not in headers:
+            lines.append(_current_date_header())
+        lines.append(b'\r\n')
+        return b''.join(lines), body
+
+    def output(
+            self, version="1.1", keep_alive=False, keep_alive_timeout=None):
+        head, body = self._output_head(version, keep_alive,
+                                       keep_alive_timeout)
+        return head + body
+
+    def output_buffers(
+            self, version="1.1", keep_alive=False, keep_alive_timeout=None):
+        """Returns the response as a list of buffers for
+        `transport.writelines`, like :meth:`output` does as a single bytes
+        object. A large body is passed as a memoryview after the headers
+        instead of being copied behind them.
+
+        :param version: HTTP version of the request
+        :param keep_alive: whether the connection is kept open
+        :param keep_alive_timeout: Keep-Alive timeout to announce (sec)
+        :return: list of bytes-like objects
+        """
+        head, body = self._output_head(version, keep_alive,
+                                       keep_alive_timeout)
+        if len(body) <= COALESCE_BODY_SIZE:
+            return [head + body]
+        return [head, memoryview(body)]
+
+
+class StreamingHTTPResponse(BaseHTTPResponse, SanicStreamingHTTPResponse):
+    # Set by the compression middleware to compress the chunks as they are
+    # written, see pynecktie.compression
+    compressor = None
+
+    def write(self, data):
+        """Writes a chunk of data to the streaming response.
+
+        :param data: bytes-ish data to be written.
+        """
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = self._encode_body(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+            if not data:
+                return
+
+        self.transport.write(
+            b"%x\r\n%b\r\n" % (len(data), data))
+
+    async def stream(
+            self, version="1.1", keep_alive=False, keep_alive_timeout=None):
+        """Streams headers, runs the `streaming_fn` callback that writes
+        content to the response body, then finalizes the response body.
+        """
+        self.transport.write(self.get_headers(
+            version, keep_alive=keep_alive,
+            keep_alive_timeout=keep_alive_timeout))
+        await self.streaming_fn(self)
+        if self.compressor is not None:
+            data = self.compressor.finish()
+            if data:
+                self.transport.write(b"%x\r\n%b\r\n" % (len(data), data))
+        self.transport.write(b'0\r\n\r\n')
+
+    async def drain(self):
+        """Waits while the client is not reading the written chunks fast
+        enough, so that they do not pile up in the write buffer."""
+        drain = getattr(self.transport, 'drain', None)
+        if drain is not None:
+            await drain()
+
+    def get_headers(
+            self, version="1.1", keep_alive=False, keep_alive_timeout=None):
+        lines = [_status_line(version, self.status)]
+        if keep_alive and keep_alive_timeout is not None:
+            lines.append(_keep_alive_header(keep_alive_timeout))
+
+        self.headers['Transfer-Encoding'] = 'chunked'
+        self.headers.pop('Content-Length', None)
+        if 'Content-Type' not in self.headers:
+            lines.append(_content_type_header(self.content_type))
+        lines.append(self._parse_headers())
+        if 'Date' not in self.headers:
+            lines.append(_current_date_header())
+        lines.append(b'\r\n')
+        return b''.join(lines)
+
+
+class JSONHTTPResponse(HTTPResponse):
+    """Response of :func:`json`, whose body is encoded with the codec of the
+    application serving the response, which calls :meth:`encode` once the
+    handler has returned. Outside of an application the body is encoded
+    with the default codec when it is first read."""
+
+    def __init__(self, obj, dumps_kwargs, status=200, headers=None,
+                 content_type='application/json'):
+        self._obj = obj
+        self._dumps_kwargs = dumps_kwargs
+        super(JSONHTTPResponse, self).__init__(
+            body_bytes=None, status=status, headers=headers,
+            content_type=content_type)
+
     @property
-    def cookies(self):
-        if self._cookies is None:
-            self._cookies = CookieJar(self.headers)
-        return self._cookies
+    def body(self):
+        if self._body is None:
+            self.encode()
+        return self._body
 
+    @body.setter
+    def body(self, body):
+        self._body = body
 
-class StreamingHTTPResponse(SanicStreamingHTTPResponse):
-    pass
+    def encode(self):
+        """Encode the body, unless it is already encoded, with the codec
+        set on the response.
 
+        :raises TypeError: if the object cannot be encoded, or whatever
+            else the codec raises
+        """
+        if self._body is None:
+            codec = self.json_codec or json_codec.default_codec
+            self._body = codec.dumps(self._obj, **self._dumps_kwargs)
+            self._obj = None
 
-__all__ = ["BaseHTTPResponse", "HTTPResponse", "StreamingHTTPResponse",
-           "text", "raw", "json", "file", "file_stream", "html",
-           "redirect", "stream", "json_dumps", "STATUS_CODES"]
 
+# Raised by loop.sendfile when it cannot be used for a transport, Python 3.7+
+_SendfileNotAvailableError = getattr(
+    asyncio, 'SendfileNotAvailableError', NotImplementedError)
+
+
+class FileHTTPResponse(StreamingHTTPResponse):
+    """Streams `count` bytes of an open file from `offset`, with a
+    Content-Length instead of chunked encoding.
+
+    The file is sent with `loop.sendfile`, which has the kernel copy it to
+    the socket, when the event loop supports it for the connection and
+    `sendfile` is true. Otherwise, as for TLS connections, it is read in
+    chunks of `chunk_size` bytes in the default executor. The file is closed
+    once it has been sent.
+    """
+
+    def __init__(self, file, offset=0, count=None, status=200, headers=None,
+                 content_type='text/plain', chunk_size=65536, sendfile=True):
+        super(FileHTTPResponse, self).__init__(
+            None, status=status, headers=headers, content_type=content_type)
+        self.file = file
+        self.offset = offset
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        self.count = count
+        self.chunk_size = chunk_size
+        self.sendfile = sendfile
+
+    async def stream(
+            self, version="1.1", keep_alive=False, keep_alive_timeout=None):
+        try:
+            self.transport.write(self.get_headers(
+                version, keep_alive, keep_alive_timeout))
+            if self.count > 0 and not (self.sendfile and
+                                       await self._sendfile()):
+                await self._send_chunks()
+        finally:
+            self.file.close()
+
+    async def _sendfile(self):
+        sendfile = getattr(self.transport, 'sendfile', None)
+        if sendfile is None:
+            return False
+        try:
+            await sendfile(self.file, self.offset, self.count)
+        except (NotImplementedError, _SendfileNotAvailableError):
+            return False
+        return True
 
+    async def _send_chunks(self):
+        loop = asyncio.get_event_loop()
+        self.file.seek(self.offset)
+        remaining = self.count
+        while remaining > 0:
+            chunk = await loop.run_in_executor(
+                None, self.file.read, min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            self.transport.write(chunk)
+            await self.drain()
+
+    def get_headers(
+            self, version="1.1", keep_alive=False, keep_alive_timeout=None):
+        lines = [_status_line(version, self.status),
+                 CONNECTION_KEEP_ALIVE if keep_alive else CONNECTION_CLOSE]
+        if keep_alive and keep_alive_timeout is not None:
+            lines.append(_keep_alive_header(keep_alive_timeout))
+
+        self.headers['Content-Length'] = str(self.count)
+        if 'Content-Type' not in self.headers:
+            lines.append(_content_type_header(self.content_type))
+        lines.append(self._parse_headers())
+        if 'Date' not in self.headers:
+            lines.append(_current_date_header())
+        lines.append(b'\r\n')
+        return b''.join(lines)
+
+
+def json(body, status=200, headers=None,
+         content_type="application/json", dumps=None,
+         **kwargs):
+    """
+    Returns response object with body in json format.
+
+    :param body: Response data to be serialized.
+    :param status: Response code.
+    :param headers: Custom Headers.
+    :param dumps: Encoder to use instead of the one set by `JSON_ENCODER`,
+        returning `str` or `bytes`.
+    :param kwargs: Remaining arguments that are passed to the json encoder.
+    """
+    if dumps is None:
+        return JSONHTTPResponse(body, kwargs, headers=headers,
+                                status=status, content_type=content_type)
+    body = dumps(body, **kwargs)
+    if isinstance(body, str):
+        body = body.encode()
+    return HTTPResponse(body_bytes=body, headers=headers,
+                        status=status, content_type=content_type)
+
+
+def text(body, status=200, headers=None,
+         content_type="text/plain; charset=utf-8"):
+    """
+    Returns response object with body in text format.
+
+    :param body: Response data to be encoded.
+    :param status: Response code.
+    :param headers: Custom Headers.
+    :param content_type: the content type (string) of the response
+    """
+    return HTTPResponse(
+        body, status=status, headers=headers,
+        content_type=content_type)
+
+
+def raw(body, status=200, headers=None,
+        content_type="application/octet-stream"):
+    """
+    Returns response object without encoding the body.
+
+    :param body: Response data.
+    :param status: Response code.
+    :param headers: Custom Headers.
+    :param content_type: the content type (string) of the response.
+    """
+    return HTTPResponse(body_bytes=body, status=status, headers=headers,
+                        content_type=content_type)
+
+
+def html(body, status=200, headers=None):
+    """
+    Returns response object with body in html format.
+
+    :param body: Response data to be encoded.
+    :param status: Response code.
+    :param headers: Custom Headers.
+    """
+    return HTTPResponse(body, status=status, headers=headers,
+                        content_type="text/html; charset=utf-8")
+
+
+async def file(location, status=200, mime_type=None, headers=None,
+               filename=None, _range=None):
+    """Return a response object with file data.
+
+    :param location: Location of file on system.
+    :param mime_type: Specific mime_type.
+    :param headers: Custom Headers.
+    :param filename: Override filename.
+    :param _range:
+    """
+    headers = headers or {}
+    if filename:
+        headers.setdefault(
+            'Content-Disposition',
+            'attachment; filename="{}"'.format(filename))
+    filename = filename or path.split(location)[-1]
+
+    async with open_async(location, mode='rb') as _file:
+        if _range:
+            await _file.seek(_range.start)
+            out_stream = await _file.read(_range.size)
+            headers['Content-Range'] = 'bytes %s-%s/%s' % (
+                _range.start, _range.end, _range.total)
+        else:
+            out_stream = await _file.read()
+
+    mime_type = mime_type or guess_type(filename)[0] or 'text/plain'
+    return HTTPResponse(status=status,
+                        headers=headers,
+                        content_type=mime_type,
+                        body_bytes=out_stream)
+
+
+async def file_stream(location, status=200, chunk_size=4096, mime_type=None,
+                      headers=None, filename=None, _range=None,
+                      sendfile=True):
+    """Return a streaming response object with file data.
+
+    The file is sent with `loop.sendfile` where the event loop and the
+    connection allow it, and read in chunks otherwise.
+
+    :param location: Location of file on system.
+    :param chunk_size: The size of each chunk read, when not using sendfile
+    :param mime_type: Specific mime_type.
+    :param headers: Custom Headers.
+    :param filename: Override filename.
+    :param _range:
+    :param sendfile: False to always read the file in chunks.
+    """
+    headers = headers or {}
+    if filename:
+        headers.setdefault(
+            'Content-Disposition',
+            'attachment; filename="{}"'.format(filename))
+    filename = filename or path.split(location)[-1]
+
+    _file = open(location, mode='rb')
+    offset, count = 0, None
+    if _range:
+        offset, count = _range.start, _range.size
+        headers['Content-Range'] = 'bytes %s-%s/%s' % (
+            _range.start, _range.end, _range.total)
+        if status == 200:
+            status = 206
+
+    mime_type = mime_type or guess_type(filename)[0] or 'text/plain'
+    return FileHTTPResponse(_file, offset=offset, count=count,
+                            status=status,
+                            headers=headers,
+                            content_type=mime_type,
+                            chunk_size=chunk_size,
+                            sendfile=sendfile)
+
+
+def stream(
+        streaming_fn, status=200, headers=None,
+        content_type="text/plain; charset=utf-8"):
+    """Accepts an coroutine `streaming_fn` which can be used to
+    write chunks to a streaming response. Returns a `StreamingHTTPResponse`.
+
+    Example usage::
+
+        @app.route("/")
+        async def index(request):
+            async def streaming_fn(response):
+                await response.write('foo')
+                await response.write('bar')
+
+            return stream(streaming_fn, content_type='text/plain')
+
+    :param streaming_fn: A coroutine accepts a response and
+        writes content to that response.
+    :param mime_type: Specific mime_type.
+    :param headers: Custom Headers.
+    """
+    return StreamingHTTPResponse(
+        streaming_fn,
+        headers=headers,
+        content_type=content_type,
+        status=status
+    )
+
+
+def json_stream(iterable, status=200, headers=None, content_type=None,
+                ndjson=False, flush_size=65536, dumps=None, **kwargs):
+    """Returns a streaming response encoding the items of an iterable or
+    async iterable one by one, as a JSON array or as newline delimited JSON.
+
+    Encoded items are collected until `flush_size` bytes are buffered and
+    then written as one chunk. After each chunk the response waits for the
+    client to read, so only about one chunk is held in memory at a time.
+
+    :param iterable: Items to be serialized.
+    :param status: Response code.
+    :param headers: Custom Headers.
+    :param content_type: the content type (string) of the response,
+        `application/json` or `application/x-ndjson` by default.
+    :param ndjson: write one JSON document per line instead of an array.
+    :param flush_size: bytes to buffer before writing a chunk.
+    :param dumps: Encoder to use instead of the one set by `JSON_ENCODER`,
+        returning `bytes`.
+    :param kwargs: Remaining arguments that are passed to the json encoder.
+    """
+    separator = b'\n' if ndjson else b','
+
+    async def _streaming_fn(response):
+        encode = dumps or (
+            response.json_codec or json_codec.default_codec).dumps
+        buffer = bytearray() if ndjson else bytearray(b'[')
+        first = True
+
+        async def add(item):
+            nonlocal first
+            if first:
+                first = False
+            elif not ndjson:
+                buffer.extend(separator)
+            buffer.extend(encode(item, **kwargs))
+            if ndjson:
+                buffer.extend(separator)
+            if len(buffer) >= flush_size:
+                response.write(buffer)
+                buffer.clear()
+                await response.drain()
+
+        if hasattr(iterable, '__aiter__'):
+            async for item in iterable:
+                await add(item)
+        else:
+            for item in iterable:
+                await add(item)
+        if not ndjson:
+            buffer.extend(b']')
+        if buffer:
+            response.write(buffer)
+
+    if content_type is None:
+        content_type = 'application/x-ndjson' if ndjson else \
+            'application/json'
+    return StreamingHTTPResponse(
+        _streaming_fn,
+        headers=headers,
+        content_type=content_type,
+        status=status
+    )
+
+
+def redirect(to, headers=None, status=302,
+             content_type="text/html; charset=utf-8"):
+    """Abort execution and cause a 302 redirect (by default).
+
+    :param to: path or fully qualified URL to redirect to
+    :param headers: optional dict of headers to include in the new request
+    :param status: status code (int) of the new request, defaults to 302
+    :param content_type: the content type (string) of the response
+    :returns: the redirecting Response
+    """
+    headers = headers or {}
+
+    # URL Quote the URL before redirecting
+    safe_to = quote_plus(to, safe=":/#?&=@[]!$&'()*+,;")
+
+    # According to RFC 7231, a relative URI is now permitted.
+    headers['Location'] = safe_to
+
+    return HTTPResponse(
+        status=status,
+        headers=headers,
+        content_type=content_type)
+
+
+__all__ = ["BaseHTTPResponse", "HTTPResponse", "StreamingHTTPResponse",
+           "FileHTTPResponse", "JSONHTTPResponse",
+           "text", "raw", "json", "json_stream", "file", "file_stream", "html",
+           "redirect", "stream", "json_dumps", "STATUS_CODES", "STATUS_LINES",
+           "COALESCE_BODY_SIZE", "update_date_header"]
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
-from functools import lru_cache
+import re
+from array import array
+from collections import OrderedDict, namedtuple
+from itertools import chain
 
 from sanic.router import Router as SanicRouter,\
     RouteExists as SanicRouteExists,\
@@ -10,11 +13,252 @@ from sanic.router import Route, Parameter, REGEX_TYPES,\
 from pynecktie.exceptions import MethodNotSupported, NotFound
 
 
+RouteCacheInfo = namedtuple(
+    'RouteCacheInfo',
+    ['hits', 'misses', 'evictions', 'rejections', 'maxsize', 'currsize'])
+
+
+class RouteCache:
+    """Bounded LRU cache of route lookups with a TinyLFU admission policy.
+
+    Every lookup is counted in a small count-min frequency sketch. When the
+    cache is full, a new entry only replaces the least recently used one if
+    it has been requested more often, so a stream of unique URLs (such as
+    `/user/<id>` lookups) cannot flush out the frequently used entries.
+    The counters are halved periodically so that the frequencies age.
+    """
+    __slots__ = ('maxsize', 'hits', 'misses', 'evictions', 'rejections',
+                 '_data', '_sketch', '_mask', '_additions', '_sample_size')
+
+    def __init__(self, maxsize=ROUTER_CACHE_SIZE):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self._data = OrderedDict()
+        self.resize(maxsize)
+
+    def resize(self, maxsize):
+        """Set the maximum number of entries and reset the sketch.
+
+        :param maxsize: maximum number of cached lookups, 0 disables caching
+        """
+        self.maxsize = max(int(maxsize or 0), 0)
+        # Four rows indexed by 16 bit slices of the key hash, sized so that
+        # the counters stay sparse between two agings
+        width = 64
+        while width < self.maxsize * 16 and width < 1 << 16:
+            width <<= 1
+        self._sketch = array('B', bytes(width))
+        self._mask = width - 1
+        self._additions = 0
+        self._sample_size = width
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def info(self):
+        """Report cache statistics.
+
+        :return: RouteCacheInfo
+        """
+        return RouteCacheInfo(self.hits, self.misses, self.evictions,
+                              self.rejections, self.maxsize, len(self._data))
+
+    def _frequency(self, hashed):
+        sketch = self._sketch
+        mask = self._mask
+        return min(sketch[hashed & mask], sketch[(hashed >> 16) & mask],
+                   sketch[(hashed >> 32) & mask],
+                   sketch[(hashed >> 48) & mask])
+
+    def _increment(self, hashed):
+        sketch = self._sketch
+        mask = self._mask
+        for shift in (0, 16, 32, 48):
+            index = (hashed >> shift) & mask
+            if sketch[index] < 15:
+                sketch[index] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            # Age the frequencies so that formerly popular entries
+            # can be replaced
+            self._sketch = array('B', (count >> 1 for count in sketch))
+            self._additions //= 2
+
+    def get(self, key):
+        """Get a cached lookup, recording the access.
+
+        :param key: hashable lookup key
+        :return: cached value, or None
+        """
+        if not self.maxsize:
+            return None
+        self._increment(hash(key))
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Cache a lookup, subject to the admission policy.
+
+        :param key: hashable lookup key
+        :param value: value to cache
+        """
+        if not self.maxsize:
+            return
+        data = self._data
+        if len(data) >= self.maxsize:
+            victim = next(iter(data))
+            if self._frequency(hash(key)) <= \
+                    self._frequency(hash(victim)):
+                self.rejections += 1
+                return
+            del data[victim]
+            self.evictions += 1
+        data[key] = value
+
+
 class Router(SanicRouter):
-    @lru_cache(maxsize=ROUTER_CACHE_SIZE)
+    def __init__(self):
+        super(Router, self).__init__()
+        self.cache = RouteCache()
+        self.frozen = False
+        # (pattern string, parameters) -> dynamic Route, so that checking
+        # a new route for duplicates does not scan all the routes
+        self._dynamic_index = {}
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise RuntimeError('The route table is frozen, routes cannot be '
+                               'added or removed once the app is running')
+
+    def _add(self, uri, methods, handler, host=None, name=None):
+        self._check_frozen()
+        try:
+            super(Router, self)._add(uri, methods, handler, host=host,
+                                     name=name)
+        except SanicRouteExists as e:
+            if isinstance(e, RouteExists):
+                raise
+            raise RouteExists(*e.args) from None
+        if host is None or isinstance(host, str):
+            route = self.routes_all.get((host or '') + uri)
+            if route is not None and route.parameters:
+                key = (route.pattern.pattern, tuple(route.parameters))
+                self._dynamic_index[key] = route
+        self.cache.clear()
+
+    def check_dynamic_route_exists(self, pattern, routes_to_check,
+                                   parameters):
+        """Find the dynamic route registered with the same pattern and
+        parameters as a new one, through the index rather than comparing
+        the new route with every route in `routes_to_check`.
+
+        :return: index in `routes_to_check` and Route, or -1 and None
+        """
+        route = self._dynamic_index.get((pattern.pattern, tuple(parameters)))
+        if route is not None:
+            for ndx, _route in enumerate(routes_to_check):
+                if _route is route:
+                    return ndx, route
+        return -1, None
+
+    def remove(self, uri, clean_cache=True, host=None):
+        self._check_frozen()
+        super(Router, self).remove(uri, clean_cache=False, host=host)
+        self._dynamic_index = {
+            (route.pattern.pattern, tuple(route.parameters)): route
+            for route in self.routes_all.values() if route.parameters}
+        if clean_cache:
+            self.cache.clear()
+
+    def validate(self):
+        """Check the route table for dynamic routes which can never be
+        matched, because an earlier route has the same pattern (with
+        differently named parameters) and accepts the same methods.
+
+        :raises RouteExists: for the first conflicting route
+        """
+        seen = {}
+        for routes in chain(self.routes_dynamic.values(),
+                            (self.routes_always_check,)):
+            for route in routes:
+                earlier = seen.setdefault(route.pattern.pattern, [])
+                for other in earlier:
+                    if not route.methods or not other.methods:
+                        raise RouteExists(
+                            'Route {} conflicts with {}'.format(
+                                route.uri, other.uri))
+                    duplicated = route.methods.intersection(other.methods)
+                    if duplicated:
+                        raise RouteExists(
+                            'Route {} conflicts with {} [{}]'.format(
+                                route.uri, other.uri,
+                                ','.join(sorted(duplicated))))
+                earlier.append(route)
+
+    def freeze(self):
+        """Validate the route table and prepare it for serving, after which
+        routes can no longer be added or removed. Called by the app before
+        it starts serving (and before forking workers, so that they share
+        the prepared table). Freezing a frozen router does nothing.
+
+        :raises RouteExists: if two routes conflict, see `validate`
+        """
+        if self.frozen:
+            return
+        self.validate()
+        self.frozen = True
+
+    def unfreeze(self):
+        """Allow routes to be added and removed again, called by the app
+        once it has stopped serving."""
+        self.frozen = False
+
+    def get(self, request):
+        """Get a request handler based on the URL of the request, or raises an
+        error
+
+        :param request: Request object
+        :return: handler, arguments, keyword arguments
+        """
+        # No virtual hosts specified; default behavior
+        if not self.hosts:
+            return self._cached_get(request.path, request.method, '')
+        # virtual hosts specified; try to match route to the host header
+        try:
+            return self._cached_get(request.path, request.method,
+                                    request.headers.get("Host", ''))
+        # try default hosts
+        except NotFound:
+            return self._cached_get(request.path, request.method, '')
+
+    def _cached_get(self, url, method, host):
+        """Look up a route through the router cache.
+
+        :param url: request URL
+        :param method: request method
+        :param host: request host, or ''
+        :return: handler, arguments, keyword arguments
+        """
+        key = (url, method, host)
+        route = self.cache.get(key)
+        if route is None:
+            route = self._get(url, method, host)
+            self.cache.put(key, route)
+        return route
+
     def _get(self, url, method, host):
         """Get a request handler based on the URL of the request, or raises an
-        error.  Internal method for caching.
+        error.  Internal method, see `_cached_get` for the cached lookup.
 
         :param url: request URL
         :param method: request method
@@ -23,13 +267,9 @@ class Router(SanicRouter):
         url = host + url
         # Check against known static routes
         route = self.routes_static.get(url)
-        method_not_supported = MethodNotSupported(
-            'Method {} not allowed for URL {}'.format(method, url),
-            method=method,
-            allowed_methods=self.get_supported_methods(url))
         if route:
             if route.methods and method not in route.methods:
-                raise method_not_supported
+                raise self._method_not_supported(method, url)
             match = route.pattern.match(url)
         else:
             route_found = False
@@ -51,7 +291,7 @@ class Router(SanicRouter):
                 else:
                     # Route was found but the methods didn't match
                     if route_found:
-                        raise method_not_supported
+                        raise self._method_not_supported(method, url)
                     raise NotFound('Requested URL {} not found'.format(url))
 
         kwargs = {p.name: p.cast(value)
@@ -62,6 +302,20 @@ class Router(SanicRouter):
             route_handler = route_handler.handlers[method]
         return route_handler, [], kwargs, route.uri
 
+    def _method_not_supported(self, method, url):
+        """Build the 405 exception for a URL. Only called on the error path,
+        so the message formatting and the `Allow` header lookup are not
+        paid for on every successful route match.
+
+        :param method: request method
+        :param url: request URL (including host)
+        :return: MethodNotSupported exception instance
+        """
+        return MethodNotSupported(
+            'Method {} not allowed for URL {}'.format(method, url),
+            method=method,
+            allowed_methods=self.get_supported_methods(url))
+
     def is_stream_handler(self, request):
         """ Handler for request is stream or not.
         :param request: Request object
@@ -77,6 +331,242 @@ class Router(SanicRouter):
         return hasattr(handler, 'is_stream')
 
 
+class _TrieNode:
+    """A single path segment in the `TrieRouter` segment trie."""
+    __slots__ = ('static', 'dynamic', 'routes')
+
+    def __init__(self):
+        # literal segment -> _TrieNode
+        self.static = {}
+        # list of (segment regex or None, _TrieNode), None means the
+        # default `string` parameter which matches any non-empty segment
+        self.dynamic = []
+        # list of (order, Route) ending at this node
+        self.routes = []
+
+
+class TrieRouter(Router):
+    """Router that resolves dynamic routes through a segment trie.
+
+    Registration is unchanged (see :class:`Router`), but instead of
+    testing every route in the `url_hash` bucket with its regex, dynamic
+    routes are compiled into a trie keyed on the `/` separated segments of
+    their URI. Literal segments are dictionary lookups and parameter
+    segments are typed nodes matching a single segment, so a lookup costs
+    O(path depth) rather than O(routes). Routes whose parameters can span
+    several segments (e.g. `<name:path>`) are still checked by regex,
+    in the same order as :class:`Router` checks them.
+
+    Usage:
+
+    .. code-block:: python
+
+        app = Necktie(router=TrieRouter())
+    """
+    _default_segment_pattern = '({})'.format(REGEX_TYPES['string'][1])
+    # Patterns of the parameter types which never match a `/`
+    _segment_patterns = frozenset(
+        pattern for name, (_, pattern) in REGEX_TYPES.items()
+        if name != 'path')
+    _regex_special = frozenset('.^$*+?{}[]\\|()')
+
+    def __init__(self):
+        super(TrieRouter, self).__init__()
+        self._trie = None
+        self._trie_fallback = []
+
+    def _add(self, uri, methods, handler, host=None, name=None):
+        super(TrieRouter, self)._add(uri, methods, handler, host=host,
+                                     name=name)
+        self._trie = None
+
+    def remove(self, uri, clean_cache=True, host=None):
+        super(TrieRouter, self).remove(uri, clean_cache=clean_cache,
+                                       host=host)
+        self._trie = None
+
+    def freeze(self):
+        """Validate the route table and build the trie, see
+        :meth:`Router.freeze`."""
+        if self.frozen:
+            return
+        super(TrieRouter, self).freeze()
+        self._build_trie()
+
+    def _compile_segment(self, segment):
+        """Compile a URI segment containing parameters into the regex used
+        to match a single URL segment.
+
+        :param segment: URI segment, e.g. `<id:int>` or `<name>.json`
+        :return: compiled regex, or None for a plain `string` parameter
+        """
+        def add_parameter(match):
+            _, _, pattern = self.parse_parameter_string(match.group(1))
+            return '({})'.format(pattern)
+
+        pattern_string = re.sub(self.parameter_pattern, add_parameter,
+                                segment)
+        if pattern_string == self._default_segment_pattern:
+            return None
+        return re.compile(r'^{}$'.format(pattern_string))
+
+    def _segment_safe(self, route):
+        """Whether every parameter of a route matches within one segment,
+        so that the route can be placed in the trie. Only the built-in
+        parameter types other than `path` are known not to match a `/`,
+        any custom regex (e.g. `<rest:.+>`) may.
+
+        :param route: Route object
+        :return: bool
+        """
+        for parameter in self.parameter_pattern.findall(route.uri):
+            _, _, pattern = self.parse_parameter_string(parameter)
+            if pattern not in self._segment_patterns:
+                return False
+        return True
+
+    def _insert(self, root, route, order, compiled):
+        """Add a route to the trie below `root`, sharing the compiled
+        segment regexes (and so the parameter nodes) through `compiled`."""
+        node = root
+        for segment in route.uri.split('/'):
+            if '<' not in segment and \
+                    self._regex_special.isdisjoint(segment):
+                child = node.static.get(segment)
+                if child is None:
+                    child = node.static[segment] = _TrieNode()
+            else:
+                if segment not in compiled:
+                    compiled[segment] = self._compile_segment(segment)
+                regex = compiled[segment]
+                for _regex, child in node.dynamic:
+                    if _regex is regex:
+                        break
+                else:
+                    child = _TrieNode()
+                    node.dynamic.append((regex, child))
+            node = child
+        node.routes.append((order, route))
+
+    def _build_trie(self):
+        """Compile the registered dynamic routes into the segment trie.
+
+        :class:`Router` tests the `url_hash` bucket first and the
+        `routes_always_check` list second, each in list order, and the
+        first route matching the URL and method wins. That position is
+        kept as the order of each route in the trie so lookups resolve to
+        the same route. Routes which cannot be matched segment by segment
+        are kept aside in `_trie_fallback`, sorted by their order, with the
+        `url_hash` of the URLs they are tested against (None for the
+        routes which are always checked).
+        """
+        root = _TrieNode()
+        compiled = {}
+        fallback = []
+        routes = [((0, index), route, key)
+                  for key, bucket in self.routes_dynamic.items()
+                  for index, route in enumerate(bucket)]
+        routes.extend(((1, index), route, None)
+                      for index, route in enumerate(self.routes_always_check))
+        for order, route, key in routes:
+            if self._segment_safe(route):
+                self._insert(root, route, order, compiled)
+            else:
+                fallback.append((order, route, key))
+        fallback.sort(key=lambda entry: entry[0])
+        self._trie_fallback = fallback
+        self._trie = root
+        return root
+
+    @staticmethod
+    def _match_trie(node, segments, index, values, method, result):
+        """Walk the trie depth first, collecting every matching route.
+
+        `result` is a list of [route_found, order, route, values] holding
+        the first registered route that matched and accepts `method`.
+        """
+        if index == len(segments):
+            for order, route in node.routes:
+                result[0] = True
+                if method in route.methods and \
+                        (result[2] is None or order < result[1]):
+                    result[1:] = [order, route, list(values)]
+            return
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            TrieRouter._match_trie(child, segments, index + 1, values,
+                                   method, result)
+        for regex, child in node.dynamic:
+            if regex is None:
+                if not segment:
+                    continue
+                values.append(segment)
+                TrieRouter._match_trie(child, segments, index + 1, values,
+                                       method, result)
+                values.pop()
+            else:
+                match = regex.match(segment)
+                if match is None:
+                    continue
+                groups = match.groups(1)
+                values.extend(groups)
+                TrieRouter._match_trie(child, segments, index + 1, values,
+                                       method, result)
+                del values[len(values) - len(groups):]
+
+    def _get(self, url, method, host):
+        """Get a request handler based on the URL of the request, or raises an
+        error.  Internal method, see `_cached_get` for the cached lookup.
+
+        :param url: request URL
+        :param method: request method
+        :return: handler, arguments, keyword arguments
+        """
+        url = host + url
+        # Check against known static routes
+        route = self.routes_static.get(url)
+        if route:
+            if route.methods and method not in route.methods:
+                raise self._method_not_supported(method, url)
+            values = ()
+        else:
+            trie = self._trie
+            if trie is None:
+                trie = self._build_trie()
+            result = [False, None, None, None]
+            self._match_trie(trie, url.split('/'), 0, [], method, result)
+            route_found, order, route, values = result
+            # Lastly, check against the regex routes that cannot be placed
+            # in the trie and would have been tried before its match
+            key = url_hash(url)
+            for _order, _route, _key in self._trie_fallback:
+                if route is not None and _order > order:
+                    break
+                if _key is not None and _key != key:
+                    # Router only tests the bucket of the URL
+                    continue
+                match = _route.pattern.match(url)
+                route_found |= match is not None
+                # Do early method checking
+                if match and method in _route.methods:
+                    route, values = _route, match.groups(1)
+                    break
+            if route is None:
+                # Route was found but the methods didn't match
+                if route_found:
+                    raise self._method_not_supported(method, url)
+                raise NotFound('Requested URL {} not found'.format(url))
+
+        kwargs = {p.name: p.cast(value)
+                  for value, p
+                  in zip(values, route.parameters)}
+        route_handler = route.handler
+        if hasattr(route_handler, 'handlers'):
+            route_handler = route_handler.handlers[method]
+        return route_handler, [], kwargs, route.uri
+
+
 class RouteExists(SanicRouteExists):
     pass
 
@@ -85,6 +575,6 @@ class RouteDoesNotExist(SanicRouteDoesNotExist):
     pass
 
 
-__all__ = ["Router", "RouteExists", "RouteDoesNotExist",
-           "Route", "Parameter", "REGEX_TYPES",
-           "ROUTER_CACHE_SIZE", "url_hash"]
+__all__ = ["Router", "TrieRouter", "RouteCache", "RouteCacheInfo",
+           "RouteExists", "RouteDoesNotExist", "Route", "Parameter",
+           "REGEX_TYPES", "ROUTER_CACHE_SIZE", "url_hash"]
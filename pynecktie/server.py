@@ -1,34 +1,318 @@
 # -*- coding: utf-8 -*-
+import gc
+import json
+import os
+import sys
 import traceback
+from collections import deque
+from functools import partial
+from itertools import islice
+from math import ceil
+from multiprocessing import Process, current_process
+from multiprocessing.sharedctypes import RawArray
+from signal import SIGTERM, SIGINT, SIG_IGN, SIG_DFL, signal as signal_func, \
+    Signals
+from socket import socket, SOL_SOCKET, SO_REUSEADDR
+from time import time, sleep
 
 import asyncio
 from httptools import HttpRequestParser
-from httptools.parser.errors import HttpParserError
+from httptools.parser.errors import HttpParserError, HttpParserUpgrade
 from sanic.server import HttpProtocol as SanicHttpProtocol,\
     Signal as SanicSignal
-from sanic.server import serve as sanic_serve, serve_multiple as sanic_serve_multiple,\
-    trigger_events, update_current_time
+from sanic.server import trigger_events
 from sanic import server
 from multidict import CIMultiDict
+from pynecktie.event_loop import get_event_loop_name, new_event_loop
 from pynecktie.exceptions import ServerError, RequestTimeout, ServiceUnavailable, PayloadTooLarge, InvalidUsage
-from pynecktie.log import logger
-from pynecktie.request import Request
+from pynecktie.headers import Headers
+from pynecktie.log import logger, error_logger
+from pynecktie.request import Request, RequestStream
+from pynecktie.response import HTTPResponse, update_date_header
+
+try:
+    from socket import SO_REUSEPORT
+except ImportError:  # Windows
+    SO_REUSEPORT = None
+
+try:
+    from signal import SIGHUP, SIGKILL
+except ImportError:  # Windows
+    SIGHUP = None
+    SIGKILL = SIGTERM
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError):
+    _PAGE_SIZE = 4096
+
+# Indexes of the status a worker publishes for the WorkerManager
+WORKER_READY = 0
+WORKER_REQUESTS = 1
+
+# Environment variable in which a master re-executing itself on SIGHUP
+# passes its listening sockets and workers on, see WorkerManager.reload
+REEXEC_ENV = 'NECKTIE_REEXEC'
 
 
 class Signal(SanicSignal):
     pass
 
 
+class WorkerMetrics:
+    """Counters of the traffic handled by one worker process.
+
+    Updating a counter is a single attribute store on a slotted object, and
+    a metrics endpoint running on the worker's event loop can read them
+    without any locking.
+    """
+    __slots__ = ('requests', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def snapshot(self):
+        """Copy of the counters, e.g. to serialize as JSON.
+
+        :return: dict
+        """
+        return {'requests': self.requests,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out}
+
+
+worker_metrics = WorkerMetrics()
+
+
+class TimerWheel:
+    """Hashed timer wheel for the per-connection timeouts.
+
+    Offers the `call_later` API of the event loop, but with a resolution of
+    one tick: timers are kept in `size` buckets and `tick`, called once a
+    second by `update_current_time`, runs the timers due in the current
+    bucket. Scheduling and cancelling are set operations, so thousands of
+    idle keep-alive connections do not churn the event loop's timer heap.
+    Timers may fire up to one tick late, which the timeout callbacks of
+    :class:`HttpProtocol` allow for by re-checking the elapsed time.
+    """
+    __slots__ = ('ticks', '_slots')
+
+    def __init__(self, size=64):
+        self.ticks = 0
+        self._slots = [set() for _ in range(size)]
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def call_later(self, delay, callback, *args):
+        """Arrange for `callback(*args)` to be called after `delay` seconds,
+        rounded up to whole ticks.
+
+        :return: Timer, which can be cancelled
+        """
+        deadline = self.ticks + max(int(ceil(delay)), 1)
+        slot = self._slots[deadline % len(self._slots)]
+        timer = Timer(slot, deadline, callback, args)
+        slot.add(timer)
+        return timer
+
+    def tick(self):
+        """Advance the wheel by one tick and run the timers that are due."""
+        self.ticks += 1
+        slot = self._slots[self.ticks % len(self._slots)]
+        if not slot:
+            return
+        ticks = self.ticks
+        for timer in [timer for timer in slot if timer.deadline <= ticks]:
+            slot.discard(timer)
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                error_logger.exception('Exception in timer callback %r',
+                                       timer.callback)
+
+
+class Timer:
+    """Handle of a callback scheduled on a :class:`TimerWheel`."""
+    __slots__ = ('slot', 'deadline', 'callback', 'args')
+
+    def __init__(self, slot, deadline, callback, args):
+        self.slot = slot
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        self.slot.discard(self)
+
+
+class _MeteredTransport:
+    """Transport proxy counting the bytes written by a streaming response,
+    which also lets the response wait for the client to read and send files
+    with sendfile(2)."""
+    __slots__ = ('transport', 'metrics', 'drain', 'loop')
+
+    def __init__(self, transport, metrics, drain, loop):
+        self.transport = transport
+        self.metrics = metrics
+        self.drain = drain
+        self.loop = loop
+
+    def write(self, data):
+        self.metrics.bytes_out += len(data)
+        self.transport.write(data)
+
+    async def sendfile(self, file, offset, count):
+        """Send `count` bytes of `file` from `offset` with sendfile(2).
+
+        Uses `loop.sendfile` where the event loop implements it, and calls
+        `os.sendfile` on the socket otherwise, as for uvloop.
+
+        :raise NotImplementedError: if the connection does not allow it,
+            as for TLS connections, before anything is sent
+        """
+        transport = self.transport
+        sock = transport.get_extra_info('socket')
+        if sock is None or not hasattr(os, 'sendfile') or \
+                transport.get_extra_info('sslcontext') is not None:
+            raise NotImplementedError('sendfile is not available')
+        # loop.sendfile is new in Python 3.7, uvloop does not implement it
+        loop_sendfile = getattr(self.loop, 'sendfile', None)
+        if loop_sendfile is not None:
+            try:
+                sent = await loop_sendfile(transport, file, offset, count,
+                                           fallback=False)
+            except NotImplementedError:
+                pass
+            else:
+                self.metrics.bytes_out += sent
+                return
+
+        # Everything written through the transport goes out first
+        if transport.get_write_buffer_size():
+            low, high = transport.get_write_buffer_limits()
+            transport.set_write_buffer_limits(high=0, low=0)
+            try:
+                await self.drain()
+            finally:
+                transport.set_write_buffer_limits(high=high, low=low)
+
+        # The socket is registered with the loop by the transport, so wait
+        # for it to be writable through a duplicate of its file descriptor
+        fd = os.dup(sock.fileno())
+        try:
+            while count > 0:
+                try:
+                    sent = os.sendfile(fd, file.fileno(), offset, count)
+                except (BlockingIOError, InterruptedError):
+                    writable = self.loop.create_future()
+                    self.loop.add_writer(fd, writable.set_result, None)
+                    try:
+                        await writable
+                    finally:
+                        self.loop.remove_writer(fd)
+                    continue
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+                self.metrics.bytes_out += sent
+        finally:
+            os.close(fd)
+
+    def __getattr__(self, item):
+        return getattr(self.transport, item)
+
+
+class _PipelinedRequest:
+    """A request received while an earlier request on the same connection
+    is still being handled."""
+    __slots__ = ('request', 'keep_alive', 'task', 'response', 'turn')
+
+    def __init__(self, request, keep_alive):
+        self.request = request
+        self.keep_alive = keep_alive
+        # handler task, when the request is handled ahead of its turn
+        self.task = None
+        # response written by the handler before its turn
+        self.response = None
+        # future a streaming response waits on for its turn
+        self.turn = None
+
+
 class HttpProtocol(SanicHttpProtocol):
-    __slots__ = tuple()
+    """HTTP/1.1 protocol with request pipelining.
+
+    Requests the client sends without waiting for the response of the
+    previous one are parsed as they arrive and queued. By default they are
+    handled one after another; with `pipeline_concurrency` above 1 up to
+    that many handlers run at the same time. Responses are always written
+    in request order, and responses that are ready together are written
+    with a single `transport.writelines` call.
+
+    The body of a request to a stream handler is buffered in a
+    :class:`RequestStream`, and reading from the client is paused while it
+    holds more than `stream_high_water` bytes, until the handler has read
+    it down to `stream_low_water` bytes.
+    """
+    __slots__ = ('metrics', '_timers', '_message', '_message_keep_alive',
+                 '_request_keep_alive', '_pipeline', '_pipeline_concurrency',
+                 '_output', '_reading_paused', '_writing_paused',
+                 '_drain_waiter', '_stream_high_water', '_stream_low_water',
+                 '_body', '_body_view', '_body_size', '_body_length',
+                 '_body_preallocate_max', '_rejected', '_upgrade')
+
+    # Stop reading from a client which has this many requests queued
+    pipeline_limit = 64
+    # Reasons for which reading is paused, as flags of _reading_paused
+    PAUSED_PIPELINE = 1
+    PAUSED_STREAM = 2
 
     def __init__(self, *, loop, request_handler, error_handler,
                  signal=None, connections=set(), request_timeout=60,
                  response_timeout=60, keep_alive_timeout=5,
                  request_max_size=None, request_class=None, access_log=True,
                  keep_alive=True, is_request_stream=False, router=None,
-                 state=None, debug=False, **kwargs):
+                 state=None, debug=False, metrics=None, timer_wheel=None,
+                 pipeline_concurrency=1, stream_high_water=1048576,
+                 stream_low_water=262144, body_preallocate_max=67108864,
+                 **kwargs):
         signal = signal or Signal()
+        self.metrics = metrics or worker_metrics
+        # Timeouts are scheduled on the timer wheel of the server when there
+        # is one, otherwise directly on the event loop
+        self._timers = loop if timer_wheel is None else timer_wheel
+        # Request being parsed, which may be behind the handled request
+        self._message = None
+        self._message_keep_alive = True
+        self._request_keep_alive = False
+        self._pipeline = deque()
+        self._pipeline_concurrency = max(pipeline_concurrency, 1)
+        # Responses waiting to be written together
+        self._output = None
+        self._reading_paused = 0
+        self._writing_paused = False
+        self._drain_waiter = None
+        self._stream_high_water = stream_high_water
+        self._stream_low_water = stream_low_water
+        # Body of the request being parsed
+        self._body = None
+        self._body_view = None
+        self._body_size = 0
+        self._body_length = None
+        # Largest buffer allocated up front from the Content-Length of a
+        # body, larger bodies grow the buffer as they arrive
+        self._body_preallocate_max = body_preallocate_max
+        # Set once the request is rejected, after which nothing is parsed
+        self._rejected = False
+        # Data received after a request to switch protocols, which is no
+        # longer HTTP
+        self._upgrade = None
         request_class = request_class or Request
         super(HttpProtocol, self).\
             __init__(loop=loop, request_handler=request_handler,
@@ -40,6 +324,55 @@ class HttpProtocol(SanicHttpProtocol):
                      is_request_stream=is_request_stream,
                      router=router, state=state, debug=debug, **kwargs)
 
+    @property
+    def keep_alive(self):
+        return (
+            self._keep_alive and
+            not self.signal.stopped and
+            self._request_keep_alive)
+
+    # -------------------------------------------- #
+    # Connection
+    # -------------------------------------------- #
+
+    def connection_made(self, transport):
+        self.connections.add(self)
+        self._request_timeout_handler = self._timers.call_later(
+            self.request_timeout, self.request_timeout_callback)
+        self.transport = transport
+        self._last_request_time = server.current_time
+
+    def connection_lost(self, exc):
+        super(HttpProtocol, self).connection_lost(exc)
+        self._output = None
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(ConnectionResetError('Connection lost'))
+        for entry in self._pipeline:
+            if entry.task is not None:
+                entry.task.cancel()
+        self._pipeline.clear()
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def drain(self):
+        """Wait until the write buffer of the transport is below its
+        low-water mark again, when the client does not read fast enough."""
+        if self.transport is None:
+            raise ConnectionResetError('Connection lost')
+        if not self._writing_paused:
+            return
+        if self._drain_waiter is None:
+            self._drain_waiter = self.loop.create_future()
+        await asyncio.shield(self._drain_waiter)
+
     def request_timeout_callback(self):
         # See the docstring in the RequestTimeout exception, to see
         # exactly what this timeout is checking for.
@@ -48,10 +381,8 @@ class HttpProtocol(SanicHttpProtocol):
         time_elapsed = server.current_time - self._last_request_time
         if time_elapsed < self.request_timeout:
             time_left = self.request_timeout - time_elapsed
-            self._request_timeout_handler = (
-                self.loop.call_later(time_left,
-                                     self.request_timeout_callback)
-            )
+            self._request_timeout_handler = self._timers.call_later(
+                time_left, self.request_timeout_callback)
         else:
             if self._request_stream_task:
                 self._request_stream_task.cancel()
@@ -68,10 +399,8 @@ class HttpProtocol(SanicHttpProtocol):
         time_elapsed = server.current_time - self._last_request_time
         if time_elapsed < self.response_timeout:
             time_left = self.response_timeout - time_elapsed
-            self._response_timeout_handler = (
-                self.loop.call_later(time_left,
-                                     self.response_timeout_callback)
-            )
+            self._response_timeout_handler = self._timers.call_later(
+                time_left, self.response_timeout_callback)
         else:
             if self._request_stream_task:
                 self._request_stream_task.cancel()
@@ -89,77 +418,297 @@ class HttpProtocol(SanicHttpProtocol):
         time_elapsed = server.current_time - self._last_response_time
         if time_elapsed < self.keep_alive_timeout:
             time_left = self.keep_alive_timeout - time_elapsed
-            self._keep_alive_timeout_handler = (
-                self.loop.call_later(time_left,
-                                     self.keep_alive_timeout_callback)
-            )
+            self._keep_alive_timeout_handler = self._timers.call_later(
+                time_left, self.keep_alive_timeout_callback)
         else:
             logger.debug('KeepAlive Timeout. Closing connection.')
             self.transport.close()
             self.transport = None
 
     def data_received(self, data):
+        if self._rejected:
+            # The error has been written and the connection is closing
+            return
+        if self._upgrade is not None:
+            self._upgrade.extend(data)
+            return
         # Check for the request itself getting too large and exceeding
         # memory limits
-        self._total_request_size += len(data)
+        size = len(data)
+        self.metrics.bytes_in += size
+        self._total_request_size += size
         if self._total_request_size > self.request_max_size:
-            exception = PayloadTooLarge('Payload Too Large')
-            self.write_error(exception)
+            self.reject(PayloadTooLarge('Payload Too Large'))
+            return
 
-        # Create parser if this is the first time we're receiving data
+        # Create parser if this is the first time we're receiving data,
+        # it is kept for every request on the connection
         if self.parser is None:
-            assert self.request is None
-            self.headers = []
             self.parser = HttpRequestParser(self)
 
-        # requests count
-        self.state['requests_count'] = self.state['requests_count'] + 1
-
         # Parse request chunk or close connection
         try:
             self.parser.feed_data(data)
+        except HttpParserUpgrade as upgrade:
+            self.upgrade_received(data[upgrade.args[0]:])
+            return
         except HttpParserError:
+            if self._rejected:
+                # parsing was stopped by rejecting the request
+                return
+            if not self._message_keep_alive and self.headers is None:
+                # The client pipelined more data after a request closing
+                # the connection, which is discarded
+                return
             message = 'Bad Request'
             if self._debug:
                 message += '\n' + traceback.format_exc()
             exception = InvalidUsage(message)
             self.write_error(exception)
+            return
+
+        if len(self._pipeline) >= self.pipeline_limit:
+            self.pause_reading(self.PAUSED_PIPELINE)
+
+    def upgrade_received(self, data):
+        """Called once a request asking to switch protocols (with an
+        `Upgrade` header) has been received and dispatched, with the data
+        received after it. Nothing more is parsed as HTTP: the data is kept
+        in `_upgrade` for a subclass switching protocols, such as
+        :class:`~pynecktie.websocket.WebSocketProtocol`. This protocol does
+        not switch, the connection is closed after the response.
+
+        :param data: bytes received after the request
+        """
+        self._upgrade = bytearray(data)
+        self._message_keep_alive = False
+        if self._pipeline:
+            self._pipeline[-1].keep_alive = False
+        else:
+            self._request_keep_alive = False
+
+    def pause_reading(self, reason):
+        """Stop reading from the client until :meth:`resume_reading` is
+        called for the same reason.
+
+        :param reason: PAUSED_PIPELINE or PAUSED_STREAM
+        """
+        if not self._reading_paused and self.transport is not None:
+            self.transport.pause_reading()
+        self._reading_paused |= reason
+
+    def resume_reading(self, reason):
+        """Read from the client again, unless reading is still paused for
+        another reason.
+
+        :param reason: PAUSED_PIPELINE or PAUSED_STREAM
+        """
+        if not self._reading_paused & reason:
+            return
+        self._reading_paused &= ~reason
+        if not self._reading_paused and self.transport is not None and \
+                not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def on_message_begin(self):
+        self.url = None
+        self.headers = []
+        self._body_length = None
 
     def on_header(self, name, value):
         self._header_fragment += name
 
         if value is not None:
-            if self._header_fragment == b'Content-Length' \
-                    and int(value) > self.request_max_size:
-                exception = PayloadTooLarge('Payload Too Large')
-                self.write_error(exception)
-            try:
-                value = value.decode()
-            except UnicodeDecodeError:
-                value = value.decode('latin_1')
-            self.headers.append(
-                    (self._header_fragment.decode().casefold(), value))
+            if self._header_fragment.lower() == b'content-length':
+                self._body_length = int(value)
+                if self._body_length > self.request_max_size:
+                    exception = PayloadTooLarge('Payload Too Large')
+                    self.reject(exception)
+                    # stops the parser, see data_received
+                    raise exception
+            # Names and values are decoded by Headers when accessed
+            self.headers.append((self._header_fragment, value))
             self._header_fragment = b''
 
     def on_headers_complete(self):
-        self.request = self.request_class(
+        self._message = self.request_class(
             url_bytes=self.url,
-            headers=CIMultiDict(self.headers),
+            headers=Headers(self.headers),
             version=self.parser.get_http_version(),
             method=self.parser.get_method().decode(),
             transport=self.transport
         )
+        self._message_keep_alive = self.parser.should_keep_alive()
+        if self.request is None:
+            self.request = self._message
+            self._request_keep_alive = self._message_keep_alive
         # Remove any existing KeepAlive handler here,
         # It will be recreated if required on the new request.
         if self._keep_alive_timeout_handler:
             self._keep_alive_timeout_handler.cancel()
             self._keep_alive_timeout_handler = None
+        self._is_stream_handler = False
         if self.is_request_stream:
             self._is_stream_handler = self.router.is_stream_handler(
-                self.request)
+                self._message)
             if self._is_stream_handler:
-                self.request.stream = asyncio.Queue()
-                self.execute_request_handler()
+                self._message.stream = RequestStream(
+                    self.loop, self._stream_high_water,
+                    self._stream_low_water,
+                    partial(self.pause_reading, self.PAUSED_STREAM),
+                    partial(self.resume_reading, self.PAUSED_STREAM))
+                self._dispatch(self._message, self._message_keep_alive)
+
+    def on_body(self, body):
+        if self._is_stream_handler:
+            self._message.stream.feed_data(body)
+            return
+        buffer = self._body
+        if buffer is None:
+            length = self._body_length
+            if length is None or len(body) >= length:
+                # a body received in one chunk is used as it is
+                self._body = body
+                return
+            # Chunks of a body with a Content-Length are copied into a
+            # buffer of its size, which becomes the body without a join.
+            # Only the first `body_preallocate_max` bytes are allocated up
+            # front, so that a client announcing a large body cannot make
+            # the server reserve more memory than that without sending it.
+            buffer = self._body = bytearray(
+                min(length, self._body_preallocate_max))
+            self._body_view = memoryview(buffer)
+            self._body_size = 0
+        elif type(buffer) is bytes:
+            # the next chunk of a body without a Content-Length
+            buffer = self._body = bytearray(buffer)
+        view = self._body_view
+        if view is not None:
+            start = self._body_size
+            end = self._body_size = start + len(body)
+            if end <= len(view):
+                view[start:end] = body
+                return
+            # The rest of a larger body, like a body without a
+            # Content-Length, extends the buffer, which overallocates
+            # geometrically
+            self._body_view = None
+            view.release()
+            del buffer[start:]
+        buffer.extend(body)
+
+    def on_message_complete(self):
+        # Entire request (headers and whole body) is received.
+        # We can cancel and remove the request timeout handler now.
+        if self._request_timeout_handler:
+            self._request_timeout_handler.cancel()
+            self._request_timeout_handler = None
+        # requests count
+        self.metrics.requests += 1
+        self.state['requests_count'] += 1
+        request, self._message = self._message, None
+        # Nothing is being parsed until the next message begins
+        self.url = self.headers = None
+        if self._is_stream_handler:
+            request.stream.feed_eof()
+            return
+        body, self._body = self._body, None
+        if self._body_view is not None:
+            # release the buffer, so that the handler may resize it
+            self._body_view.release()
+            self._body_view = None
+        request.body = body if body is not None else b''
+        self._dispatch(request, self._message_keep_alive)
+
+    # -------------------------------------------- #
+    # Pipelining
+    # -------------------------------------------- #
+
+    def _dispatch(self, request, keep_alive):
+        """Handle the request now, or queue it behind the handled one."""
+        if self.request is None or self.request is request:
+            self.request = request
+            self._request_keep_alive = keep_alive
+            self.execute_request_handler()
+        else:
+            self._pipeline.append(_PipelinedRequest(request, keep_alive))
+            self._start_pipelined()
+
+    def _start_pipelined(self):
+        """Start handlers of queued requests, up to the concurrency limit."""
+        for entry in islice(self._pipeline, self._pipeline_concurrency - 1):
+            if entry.task is None:
+                entry.task = self.loop.create_task(
+                    self.request_handler(
+                        entry.request,
+                        partial(self._write_pipelined, entry),
+                        partial(self._stream_pipelined, entry)))
+
+    def _write_pipelined(self, entry, response):
+        if entry.request is self.request:
+            self.write_response(response)
+        else:
+            entry.response = response
+
+    async def _stream_pipelined(self, entry, response):
+        if entry.request is not self.request:
+            entry.turn = self.loop.create_future()
+            await entry.turn
+        await self.stream_response(response)
+
+    def _next_request(self):
+        """Make the next queued request the handled one."""
+        if len(self._pipeline) <= self.pipeline_limit // 2:
+            self.resume_reading(self.PAUSED_PIPELINE)
+        if not self._pipeline:
+            return
+        if self._keep_alive_timeout_handler:
+            self._keep_alive_timeout_handler.cancel()
+            self._keep_alive_timeout_handler = None
+        entry = self._pipeline.popleft()
+        self.request = entry.request
+        self._request_keep_alive = entry.keep_alive
+        if entry.task is None:
+            self.execute_request_handler()
+        else:
+            self._request_handler_task = entry.task
+            self._last_request_time = server.current_time
+            if entry.response is not None:
+                self.write_response(entry.response)
+                return
+            self._response_timeout_handler = self._timers.call_later(
+                self.response_timeout, self.response_timeout_callback)
+            if entry.turn is not None:
+                entry.turn.set_result(None)
+        self._start_pipelined()
+
+    def _write(self, buffers):
+        """Write the buffers of a response, batching them with the responses
+        of pipelined requests that are ready in the same loop iteration."""
+        if self._output is not None:
+            self._output.extend(buffers)
+        elif self._pipeline:
+            self._output = list(buffers)
+            self.loop.call_soon(self._flush)
+        elif len(buffers) == 1:
+            self.transport.write(buffers[0])
+        else:
+            self.transport.writelines(buffers)
+
+    def _flush(self):
+        output, self._output = self._output, None
+        if output and self.transport is not None:
+            self.transport.writelines(output)
+
+    def execute_request_handler(self):
+        self._response_timeout_handler = self._timers.call_later(
+            self.response_timeout, self.response_timeout_callback)
+        self._last_request_time = server.current_time
+        self._request_handler_task = self.loop.create_task(
+            self.request_handler(
+                self.request,
+                self.write_response,
+                self.stream_response))
 
     def write_response(self, response):
         """
@@ -170,10 +719,16 @@ class HttpProtocol(SanicHttpProtocol):
             self._response_timeout_handler = None
         try:
             keep_alive = self.keep_alive
-            self.transport.write(
-                response.output(
+            if isinstance(response, HTTPResponse):
+                buffers = response.output_buffers(
                     self.request.version, keep_alive,
-                    self.keep_alive_timeout))
+                    self.keep_alive_timeout)
+            else:
+                buffers = [response.output(
+                    self.request.version, keep_alive,
+                    self.keep_alive_timeout)]
+            self._write(buffers)
+            self.metrics.bytes_out += sum(map(len, buffers))
             self.log_response(response)
         except AttributeError:
             logger.error('Invalid response object for url %s, '
@@ -191,10 +746,11 @@ class HttpProtocol(SanicHttpProtocol):
                     repr(e)))
         finally:
             if not keep_alive:
+                self._flush()
                 self.transport.close()
                 self.transport = None
             else:
-                self._keep_alive_timeout_handler = self.loop.call_later(
+                self._keep_alive_timeout_handler = self._timers.call_later(
                     self.keep_alive_timeout,
                     self.keep_alive_timeout_callback)
                 self._last_response_time = server.current_time
@@ -209,9 +765,12 @@ class HttpProtocol(SanicHttpProtocol):
         if self._response_timeout_handler:
             self._response_timeout_handler.cancel()
             self._response_timeout_handler = None
+        # Earlier responses go out before the streamed one
+        self._flush()
         try:
             keep_alive = self.keep_alive
-            response.transport = self.transport
+            response.transport = _MeteredTransport(
+                self.transport, self.metrics, self.drain, self.loop)
             await response.stream(
                 self.request.version, keep_alive, self.keep_alive_timeout)
             self.log_response(response)
@@ -231,15 +790,29 @@ class HttpProtocol(SanicHttpProtocol):
                     repr(e)))
         finally:
             if not keep_alive:
+                self._flush()
                 self.transport.close()
                 self.transport = None
             else:
-                self._keep_alive_timeout_handler = self.loop.call_later(
+                self._keep_alive_timeout_handler = self._timers.call_later(
                     self.keep_alive_timeout,
                     self.keep_alive_timeout_callback)
                 self._last_response_time = server.current_time
                 self.cleanup()
 
+    def reject(self, exception):
+        """Write an error response for the request being received, and stop
+        parsing the data received after it.
+
+        :param exception: exception to respond with
+        """
+        self._rejected = True
+        self.write_error(exception)
+
+    def write_error(self, exception):
+        self._flush()
+        super(HttpProtocol, self).write_error(exception)
+
     def bail_out(self, message, from_error=False):
         if from_error or self.transport.is_closing():
             logger.error("Transport closed @ %s and exception "
@@ -251,6 +824,50 @@ class HttpProtocol(SanicHttpProtocol):
             self.write_error(exception)
             logger.error(message)
 
+    def cleanup(self):
+        """This is called when KeepAlive feature is used, it resets the
+        connection for the next request, which may already be queued."""
+        stream = getattr(self.request, 'stream', None)
+        if isinstance(stream, RequestStream):
+            # The rest of a body the handler did not read is dropped
+            stream.discard()
+        self.request = None
+        self._request_handler_task = None
+        self._request_stream_task = None
+        self._total_request_size = 0
+        self._next_request()
+
+    def close_if_idle(self):
+        """Close the connection if a request is not being sent or received
+
+        :return: boolean - True if closed, false if staying open
+        """
+        if self.parser is None:
+            # Accepted just before the server stopped listening, the first
+            # request is still on its way and is answered with a close
+            return False
+        if self.request is None and self.headers is None:
+            self.transport.close()
+            return True
+        return False
+
+
+def update_current_time(loop, timer_wheel=None):
+    """Cache the current time, since it is needed at the end of every
+    keep-alive request to update the request timeout time, refresh the
+    `Date` header of responses and tick the timer wheel of the server.
+
+    :param loop:
+    :param timer_wheel: TimerWheel to tick every second
+    :return:
+    """
+    server.current_time = time()
+    update_date_header(server.current_time)
+    loop.call_later(1, partial(update_current_time, loop, timer_wheel))
+    if timer_wheel is not None:
+        timer_wheel.tick()
+
+
 def serve(host, port, request_handler, error_handler, *args, before_start=None,
           after_start=None, before_stop=None, after_stop=None, debug=False,
           request_timeout=60, response_timeout=60, keep_alive_timeout=5,
@@ -261,29 +878,783 @@ def serve(host, port, request_handler, error_handler, *args, before_start=None,
           access_log=True, keep_alive=True, is_request_stream=False,
           router=None, websocket_max_size=None, websocket_max_queue=None,
           websocket_read_limit=2 ** 16, websocket_write_limit=2 ** 16,
-          state=None, graceful_shutdown_timeout=15.0, **kwargs):
-    return sanic_serve(host, port, request_handler, error_handler, *args,
-                       before_start=before_start, after_start=after_start, before_stop=before_stop,
-                       after_stop=after_stop, debug=debug, request_timeout=request_timeout,
-                       response_timeout=response_timeout, keep_alive_timeout=keep_alive_timeout,
-                       ssl=ssl, sock=sock, request_max_size=request_max_size, reuse_port=reuse_port,
-                       loop=loop, protocol=protocol, backlog=backlog,
-                       register_sys_signals=register_sys_signals, run_multiple=run_multiple,
-                       run_async=run_async, connections=connections, signal=signal,
-                       request_class=request_class, access_log=access_log, keep_alive=keep_alive,
-                       is_request_stream=is_request_stream, router=router,
-                       websocket_max_size=websocket_max_size,
-                       websocket_max_queue=websocket_max_queue,
-                       websocket_read_limit=websocket_read_limit,
-                       websocket_write_limit=websocket_write_limit, state=state,
-                       graceful_shutdown_timeout=graceful_shutdown_timeout, **kwargs)
-
-
-def serve_multiple(server_settings, workers):
+          state=None, graceful_shutdown_timeout=15.0, event_loop='auto',
+          loop_executor_size=None, slow_callback_duration=None, **kwargs):
+    """Start asynchronous HTTP Server on an individual process.
+
+    :param host: Address to host on
+    :param port: Port to host on
+    :param request_handler: Necktie request handler with middleware
+    :param error_handler: Necktie error handler with middleware
+    :param before_start: function to be executed before the server starts
+                         listening. Takes arguments `app` instance and `loop`
+    :param after_start: function to be executed after the server starts
+                        listening. Takes  arguments `app` instance and `loop`
+    :param before_stop: function to be executed when a stop signal is
+                        received before it is respected. Takes arguments
+                        `app` instance and `loop`
+    :param after_stop: function to be executed when a stop signal is
+                       received after it is respected. Takes arguments
+                       `app` instance and `loop`
+    :param debug: enables debug output (slows server)
+    :param request_timeout: time in seconds
+    :param response_timeout: time in seconds
+    :param keep_alive_timeout: time in seconds
+    :param ssl: SSLContext
+    :param sock: Socket for the server to accept connections from
+    :param request_max_size: size in bytes, `None` for no limit
+    :param reuse_port: `True` for multiple workers
+    :param loop: asyncio compatible event loop
+    :param protocol: subclass of asyncio protocol class
+    :param request_class: Request class to use
+    :param access_log: disable/enable access log
+    :param websocket_max_size: enforces the maximum size for
+                               incoming messages in bytes.
+    :param websocket_max_queue: sets the maximum length of the queue
+                                that holds incoming messages.
+    :param websocket_read_limit: sets the high-water limit of the buffer for
+                                 incoming bytes, the low-water limit is half
+                                 the high-water limit.
+    :param websocket_write_limit: sets the high-water limit of the buffer for
+                                  outgoing bytes, the low-water limit is a
+                                  quarter of the high-water limit.
+    :param is_request_stream: disable/enable Request.stream
+    :param router: Router object
+    :param event_loop: event loop implementation, `'auto'`, `'uvloop'` or
+                       `'asyncio'`
+    :param loop_executor_size: threads of the loop's default executor
+    :param slow_callback_duration: callbacks running longer than this are
+                                   logged in debug mode (seconds)
+    :param kwargs: extra keyword arguments passed to the protocol
+    :return: Nothing
+    """
+    if not run_async:
+        # create new event_loop after fork
+        loop = new_event_loop(event_loop, executor_size=loop_executor_size,
+                              debug=debug,
+                              slow_callback_duration=slow_callback_duration)
+    elif debug:
+        loop.set_debug(debug)
+
+    connections = connections if connections is not None else set()
+    timer_wheel = TimerWheel()
+    server_protocol = partial(
+        protocol,
+        loop=loop,
+        connections=connections,
+        signal=signal,
+        request_handler=request_handler,
+        error_handler=error_handler,
+        request_timeout=request_timeout,
+        response_timeout=response_timeout,
+        keep_alive_timeout=keep_alive_timeout,
+        request_max_size=request_max_size,
+        request_class=request_class,
+        access_log=access_log,
+        keep_alive=keep_alive,
+        is_request_stream=is_request_stream,
+        router=router,
+        websocket_max_size=websocket_max_size,
+        websocket_max_queue=websocket_max_queue,
+        websocket_read_limit=websocket_read_limit,
+        websocket_write_limit=websocket_write_limit,
+        state=state,
+        debug=debug,
+        timer_wheel=timer_wheel,
+        **kwargs
+    )
+
+    server_coroutine = loop.create_server(
+        server_protocol,
+        host,
+        port,
+        ssl=ssl,
+        reuse_port=reuse_port,
+        sock=sock,
+        backlog=backlog
+    )
+
+    # Instead of pulling time at the end of every request,
+    # pull it once per second, which also ticks the timer wheel
+    loop.call_soon(partial(update_current_time, loop, timer_wheel))
+
+    if run_async:
+        return server_coroutine
+
+    trigger_events(before_start, loop)
+
+    try:
+        http_server = loop.run_until_complete(server_coroutine)
+    except BaseException:
+        logger.exception("Unable to start server")
+        return
+
+    trigger_events(after_start, loop)
+
+    # Ignore SIGINT when run_multiple
+    if run_multiple:
+        signal_func(SIGINT, SIG_IGN)
+
+    # Register signals for graceful termination
+    if register_sys_signals:
+        _signals = (SIGTERM,) if run_multiple else (SIGINT, SIGTERM)
+        for _signal in _signals:
+            try:
+                loop.add_signal_handler(_signal, loop.stop)
+            except NotImplementedError:
+                logger.warning('pyNecktie tried to use '
+                               'loop.add_signal_handler but it is not '
+                               'implemented on this platform.')
+    pid = os.getpid()
+    try:
+        logger.info('Starting worker [%s] with the %s event loop', pid,
+                    get_event_loop_name(event_loop))
+        loop.run_forever()
+    finally:
+        logger.info("Stopping worker [%s]", pid)
+
+        # Run the on_stop function if provided
+        trigger_events(before_stop, loop)
+
+        # Wait for event loop to finish and all connections to drain
+        http_server.close()
+        loop.run_until_complete(http_server.wait_closed())
+
+        # Complete all tasks on the loop
+        signal.stopped = True
+        for connection in connections:
+            connection.close_if_idle()
+
+        # Gracefully shutdown timeout.
+        # We should provide graceful_shutdown_timeout,
+        # instead of letting connection hangs forever.
+        # Let's roughly calculate time.
+        start_shutdown = 0
+        while connections and (start_shutdown < graceful_shutdown_timeout):
+            loop.run_until_complete(asyncio.sleep(0.1))
+            start_shutdown = start_shutdown + 0.1
+
+        # Force close non-idle connection after waiting for
+        # graceful_shutdown_timeout
+        coros = []
+        for conn in connections:
+            if hasattr(conn, "websocket") and conn.websocket:
+                coros.append(
+                    conn.websocket.close_connection()
+                )
+            else:
+                conn.close()
+
+        _shutdown = asyncio.gather(*coros)
+        loop.run_until_complete(_shutdown)
+
+        trigger_events(after_stop, loop)
+
+        loop.close()
+
+
+def freeze_objects():
+    """Collect the garbage, then move every object left to the permanent
+    generation of the garbage collector with `gc.freeze()`, so that later
+    collections, in this process and in the processes forked from it, skip
+    them and do not write to their memory.
+
+    :return: False if `gc.freeze()` is not available, before Python 3.7
+    """
+    if not hasattr(gc, 'freeze'):
+        logger.warning('Freezing objects needs Python 3.7')
+        return False
+    gc.collect()
+    gc.freeze()
+    return True
+
+
+def worker_cpus(index, cpu_affinity):
+    """CPUs to pin a worker to.
+
+    :param index: number of the worker, from 0
+    :param cpu_affinity: `True` to pin each worker to one of the CPUs the
+                         process may run on, in turn, or a sequence giving
+                         a CPU number or a set of CPU numbers for every
+                         worker, repeated if there are more workers
+    :return: set of CPU numbers, or None to leave the worker unpinned
+    """
+    if not cpu_affinity:
+        return None
+    if cpu_affinity is True:
+        if hasattr(os, 'sched_getaffinity'):
+            cpu_affinity = sorted(os.sched_getaffinity(0))
+        else:
+            cpu_affinity = range(os.cpu_count() or 1)
+    cpus = cpu_affinity[index % len(cpu_affinity)]
+    return {cpus} if isinstance(cpus, int) else set(cpus)
+
+
+def _report_status(status, master, loop):
+    """Publish the worker's state to the master, once a second, and stop
+    the worker if the master is gone."""
+    if os.getppid() != master:
+        logger.error('Worker [%s] lost its master, stopping', os.getpid())
+        loop.stop()
+        return
+    status[WORKER_READY] = 1
+    status[WORKER_REQUESTS] = worker_metrics.requests
+    loop.call_later(1, _report_status, status, master, loop)
+
+
+def serve_worker(server_settings, cpus=None, status=None):
+    """Pin the process to `cpus`, where supported, then serve.
+
+    :param server_settings: kw arguments to be passed to the serve function
+    :param cpus: set of CPU numbers, or None
+    :param status: shared array the worker's state is published in for the
+                   :class:`WorkerManager`, or None
+    """
+    if cpus is not None:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+            logger.info('Worker [%s] pinned to CPU %s', os.getpid(),
+                        ','.join(str(cpu) for cpu in sorted(cpus)))
+        else:
+            logger.warning('CPU affinity is not supported on this platform')
+    if status is not None:
+        # the signal handlers of the master are inherited by the fork
+        signal_func(SIGINT, SIG_IGN)
+        signal_func(SIGTERM, SIG_DFL)
+        if SIGHUP is not None:
+            signal_func(SIGHUP, SIG_IGN)
+        worker_metrics.reset()
+        server_settings = dict(server_settings)
+        server_settings['after_start'] = list(
+            server_settings.get('after_start') or ()) + [
+            partial(_report_status, status, os.getppid())]
+    serve(**server_settings)
+
+
+def process_rss(pid):
+    """Resident memory of a process (bytes), from /proc.
+
+    :return: int, or None where /proc is not available
+    """
+    try:
+        with open('/proc/{}/statm'.format(pid)) as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def bind_socket(host, port, reuse_port=False, family=None):
+    """Bind a listening socket for the workers, which listen on it.
+
+    :param host: address to bind
+    :param port: port to bind
+    :param reuse_port: set `SO_REUSEPORT`, so that several sockets can be
+                       bound to the same address
+    :param family: address family, defaults to IPv4
+    :return: socket
+    """
+    sock = socket() if family is None else socket(family)
+    sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _reexec_argv():
+    """Command line running the program of this process again, or None
+    if this process is not running a program (such as a process started
+    by multiprocessing, or an interactive interpreter)."""
+    if current_process().name != 'MainProcess':
+        return None
+    if not getattr(sys.modules['__main__'], '__file__', None):
+        return None
+    # sys.orig_argv (Python 3.10) keeps `-m` and the interpreter options
+    argv = getattr(sys, 'orig_argv', None)
+    return [sys.executable] + (argv[1:] if argv else sys.argv)
+
+
+def _inherited_state():
+    """Listening sockets and worker pids passed on by the master this
+    process was re-executed from, see :meth:`WorkerManager.reload`.
+
+    :return: list of sockets, list of pids
+    """
+    value = os.environ.pop(REEXEC_ENV, None)
+    if not value:
+        return [], []
+    state = json.loads(value)
+    return ([socket(fileno=fd) for fd in state['sockets']],
+            state['workers'])
+
+
+class _InheritedProcess:
+    """Worker started by the master this process was re-executed from,
+    which is still a child of this process, with the part of the
+    `multiprocessing.Process` interface the :class:`WorkerManager` uses."""
+    __slots__ = ('pid', 'exitcode')
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.exitcode = None
+
+    def is_alive(self):
+        if self.exitcode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = self.pid, 0
+            if pid:
+                self.exitcode = status >> 8 if os.WIFEXITED(status) \
+                    else -os.WTERMSIG(status)
+        return self.exitcode is None
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time() + timeout
+        while self.is_alive() and (deadline is None or time() < deadline):
+            sleep(0.05)
+
+    def terminate(self):
+        try:
+            os.kill(self.pid, SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+class Worker:
+    """A worker process started by the :class:`WorkerManager`."""
+    __slots__ = ('index', 'process', 'status', 'started', 'stopping')
+
+    def __init__(self, index, process, status):
+        self.index = index
+        self.process = process
+        # READY and REQUESTS, written by the worker
+        self.status = status
+        self.started = time()
+        self.stopping = None
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def ready(self):
+        return bool(self.status[WORKER_READY])
+
+    @property
+    def requests(self):
+        return self.status[WORKER_REQUESTS]
+
+    def stop(self):
+        """Ask the worker to stop accepting connections and drain."""
+        if self.stopping is None:
+            self.stopping = time()
+            try:
+                os.kill(self.pid, SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+class WorkerManager:
+    """Master process of the workers started by :func:`serve_multiple`.
+
+    Workers which die are restarted, a worker which has handled
+    `max_requests` requests or uses more than `max_memory` bytes of resident
+    memory is recycled, and `SIGHUP` reloads the application (see
+    :meth:`reload`). Workers are replaced one at a time: the new worker is
+    started first, and the old one is only asked to stop, draining its
+    connections for up to `graceful_shutdown_timeout` seconds, once the new
+    one accepts connections, so no connection is refused while workers are
+    replaced. A worker which fails to start is started again after a delay
+    doubling from `restart_delay` to `max_restart_delay` seconds. `SIGINT`
+    and `SIGTERM` stop all the workers.
+
+    :param server_settings: kw arguments to be passed to the serve function
+    :param workers: number of workers to run
+    :param cpu_affinity: CPUs to pin the workers to, see :func:`worker_cpus`
+    :param max_requests: requests after which a worker is recycled, 0 for
+                         no limit
+    :param max_memory: resident memory (bytes) above which a worker is
+                       recycled, 0 for no limit
+    :param preload: freeze the objects of this process with `gc.freeze()`
+                    before forking the first worker, so that the workers'
+                    garbage collections do not write to them and their
+                    memory stays shared copy-on-write
+    :param interval: seconds between checks of the workers
+    :param sockets: a `SO_REUSEPORT` socket for every worker, which its
+                    replacements inherit, or None when the workers share
+                    the socket of `server_settings`
+    :param inherited: pids of the workers of the master this process was
+                      re-executed from, stopped once the workers of this
+                      process are ready
+    """
+
+    # A worker dying sooner than this after its start is restarted after
+    # a delay, doubling with every failure up to max_restart_delay, so that
+    # a failing application does not fork in a loop
+    restart_delay = 1.0
+    max_restart_delay = 30.0
+
+    def __init__(self, server_settings, workers, cpu_affinity=None,
+                 max_requests=0, max_memory=0, preload=False,
+                 interval=0.25, sockets=None, inherited=()):
+        self.server_settings = server_settings
+        self.size = workers
+        self.cpu_affinity = cpu_affinity
+        self.max_requests = max_requests
+        self.max_memory = max_memory
+        self.preload = preload
+        self.interval = interval
+        self.sockets = sockets
+        self.graceful_shutdown_timeout = server_settings.get(
+            'graceful_shutdown_timeout', 15.0)
+        self.workers = {}
+        self._retiring = []
+        self._replacements = {}
+        self._pending = deque()
+        self._restarts = {}
+        self._failures = {}
+        self._retry_at = {}
+        self._inherited = [Worker(None, _InheritedProcess(pid), None)
+                           for pid in inherited]
+        self._reexec = False
+        self._stopping = False
+
+    # -------------------------------------------- #
+    # Workers
+    # -------------------------------------------- #
+
+    def spawn(self, index):
+        """Start a worker.
+
+        :param index: number of the worker, from 0, which selects its CPUs
+                      and its socket
+        :return: Worker
+        """
+        status = RawArray('q', 2)
+        server_settings = self.server_settings
+        if self.sockets is not None:
+            server_settings = dict(server_settings,
+                                   sock=self.sockets[index])
+        process = Process(target=serve_worker, args=(
+            server_settings, worker_cpus(index, self.cpu_affinity),
+            status))
+        process.daemon = True
+        process.start()
+        return Worker(index, process, status)
+
+    def reload(self):
+        """Reload the application.
+
+        The master executes its program again, with the same command line,
+        so that the new code is imported. The listening sockets and the
+        workers are passed on to the new program, whose :func:`serve_multiple`
+        starts new workers and stops the old ones once the new ones accept
+        connections. When this process does not run a program of its own
+        (see :func:`_reexec_argv`), the workers are replaced one at a time
+        with forks of the code already loaded instead.
+        """
+        if _reexec_argv() is not None:
+            self._reexec = True
+            return
+        logger.warning('The master is not the main program and cannot '
+                       'reload the code, replacing the workers')
+        logger.info('Reloading %s workers', len(self.workers))
+        for index in sorted(self.workers):
+            if index not in self._pending:
+                self._pending.append(index)
+
+    def stop(self):
+        """Stop all the workers, and return from :meth:`run`."""
+        self._stopping = True
+
+    def _signal(self, signal, frame):
+        if signal == SIGHUP:
+            logger.info("Received signal %s. Reloading.", Signals(signal).name)
+            self.reload()
+        else:
+            logger.info("Received signal %s. Shutting down.",
+                        Signals(signal).name)
+            self.stop()
+
+    def run(self):
+        """Start the workers and supervise them until stopped, or until
+        every worker has exited by itself."""
+        signal_func(SIGINT, self._signal)
+        signal_func(SIGTERM, self._signal)
+        if SIGHUP is not None:
+            signal_func(SIGHUP, self._signal)
+        if self.max_memory and process_rss(os.getpid()) is None:
+            logger.warning('Recycling workers by memory needs /proc')
+        if self.preload:
+            # once, so that all the workers share the same frozen objects
+            self.preload = freeze_objects()
+        for index in range(self.size):
+            self.workers[index] = self.spawn(index)
+        try:
+            while not self._stopping and (
+                    self.workers or self._restarts or self._retiring or
+                    self._inherited):
+                if self._reexec:
+                    self._reexec_master()
+                self.check()
+                sleep(self.interval)
+        finally:
+            self._shutdown()
+
+    def check(self):
+        """Restart, recycle and replace workers as needed."""
+        now = time()
+        for index, worker in list(self.workers.items()):
+            if worker.process.is_alive():
+                continue
+            worker.process.join()
+            del self.workers[index]
+            replacement = self._replacements.pop(index, None)
+            if replacement is not None:
+                # the worker being replaced is gone, its replacement is
+                # taking over already
+                logger.error('Worker [%s] died with exit code %s',
+                             worker.pid, worker.process.exitcode)
+                self.workers[index] = replacement
+                continue
+            if self.sockets is not None:
+                # connections waiting on the socket of the dead worker go
+                # to the other workers' sockets until it is restarted
+                self._rebind(index)
+            if worker.process.exitcode == 0:
+                logger.info('Worker [%s] exited', worker.pid)
+                continue
+            if not worker.ready or now - worker.started < self.restart_delay:
+                delay = self._backoff(index)
+            else:
+                delay = 0
+            logger.error('Worker [%s] died with exit code %s, restarting '
+                         'in %.1fs', worker.pid, worker.process.exitcode,
+                         delay)
+            self._restarts[index] = now + delay
+        for index, at in list(self._restarts.items()):
+            if at <= now:
+                del self._restarts[index]
+                self.workers[index] = self.spawn(index)
+
+        for index, worker in self.workers.items():
+            if worker.ready and now - worker.started >= self.restart_delay:
+                self._failures.pop(index, None)
+            if index in self._pending or index in self._replacements:
+                continue
+            if self.max_requests and worker.requests >= self.max_requests:
+                logger.info('Recycling worker [%s] after %s requests',
+                            worker.pid, worker.requests)
+                self._pending.append(index)
+                continue
+            rss = process_rss(worker.pid) if self.max_memory else None
+            if rss is not None and rss > self.max_memory:
+                logger.info('Recycling worker [%s] using %s bytes',
+                            worker.pid, rss)
+                self._pending.append(index)
+
+        if self._inherited and len(self.workers) == self.size and \
+                all(worker.ready for worker in self.workers.values()):
+            logger.info('Stopping the %s workers of the previous master',
+                        len(self._inherited))
+            for worker in self._inherited:
+                worker.stop()
+            self._retiring.extend(self._inherited)
+            self._inherited = []
+
+        self._replace(now)
+        self._reap_retiring(now)
+
+    def _backoff(self, index):
+        """Count a failed start of a worker.
+
+        :return: seconds to wait before starting it again
+        """
+        failures = self._failures[index] = self._failures.get(index, 0) + 1
+        return min(self.restart_delay * 2 ** (failures - 1),
+                   self.max_restart_delay)
+
+    def _rebind(self, index):
+        """Replace the `SO_REUSEPORT` socket of a worker with a new one."""
+        sock = self.sockets[index]
+        address = sock.getsockname()
+        sock.close()
+        self.sockets[index] = bind_socket(*address[:2], reuse_port=True,
+                                          family=sock.family)
+
+    def _replace(self, now):
+        for index, replacement in list(self._replacements.items()):
+            if replacement.ready:
+                del self._replacements[index]
+                self._failures.pop(index, None)
+                old = self.workers[index]
+                self.workers[index] = replacement
+                old.stop()
+                self._retiring.append(old)
+            elif not replacement.process.is_alive():
+                replacement.process.join()
+                del self._replacements[index]
+                delay = self._backoff(index)
+                logger.error('Replacement of worker [%s] failed with exit '
+                             'code %s, retrying in %.1fs',
+                             self.workers[index].pid,
+                             replacement.process.exitcode, delay)
+                self._retry_at[index] = now + delay
+                self._pending.append(index)
+        # one worker is replaced at a time
+        while self._pending and not self._replacements:
+            for index in self._pending:
+                if self._retry_at.get(index, 0) <= now:
+                    break
+            else:
+                break
+            self._pending.remove(index)
+            self._retry_at.pop(index, None)
+            if index in self.workers:
+                self._replacements[index] = self.spawn(index)
+
+    def _reap_retiring(self, now):
+        timeout = self.graceful_shutdown_timeout + 5
+        for worker in list(self._retiring):
+            if not worker.process.is_alive():
+                worker.process.join()
+                self._retiring.remove(worker)
+            elif now - worker.stopping > timeout:
+                logger.warning('Worker [%s] did not stop, killing it',
+                               worker.pid)
+                os.kill(worker.pid, SIGKILL)
+
+    def _reexec_master(self):
+        """Execute the program of this process again, passing the listening
+        sockets and the workers on, see :meth:`reload`."""
+        self._reexec = False
+        argv = _reexec_argv()
+        if self.sockets is not None:
+            sockets = self.sockets
+        elif self.server_settings.get('sock') is not None:
+            sockets = [self.server_settings['sock']]
+        else:
+            sockets = []
+        workers = list(self.workers.values()) + \
+            list(self._replacements.values()) + self._retiring + \
+            self._inherited
+        for sock in sockets:
+            sock.set_inheritable(True)
+        env = dict(os.environ)
+        env[REEXEC_ENV] = json.dumps({
+            'sockets': [sock.fileno() for sock in sockets],
+            'workers': [worker.pid for worker in workers]})
+        logger.info('Executing %s to reload the application',
+                    ' '.join(argv))
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        try:
+            os.execve(argv[0], argv, env)
+        except OSError:
+            logger.exception('Reloading the application failed')
+
+    def _shutdown(self):
+        workers = list(self.workers.values()) + \
+            list(self._replacements.values()) + self._retiring + \
+            self._inherited
+        for worker in workers:
+            worker.stop()
+        deadline = time() + self.graceful_shutdown_timeout + 5
+        for worker in workers:
+            worker.process.join(max(0, deadline - time()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        self.workers.clear()
+        self._replacements.clear()
+        self._retiring = []
+        self._inherited = []
+
+
+def serve_multiple(server_settings, workers, reuse_port=False,
+                   cpu_affinity=None, max_requests=0, max_memory=0,
+                   preload=False):
+    """Start multiple server processes simultaneously, supervised by a
+    :class:`WorkerManager`.  Stop on interrupt and terminate signals, and
+    drain connections when complete.
+
+    By default the socket is bound in this process and inherited by the
+    workers, which all wake up for every new connection. With `reuse_port`
+    a socket is bound with `SO_REUSEPORT` for every worker, and the kernel
+    spreads the connections evenly across them. The sockets are kept open
+    in this process, so that the replacement of a worker takes over the
+    connections waiting on its socket.
+
+    When this process was re-executed by the :class:`WorkerManager` of a
+    previous program to reload it, the sockets of that program are used,
+    and its workers are stopped once the new ones are ready.
+
+    :param server_settings: kw arguments to be passed to the serve function
+    :param workers: number of workers to launch
+    :param reuse_port: bind a socket with `SO_REUSEPORT` for every worker
+    :param cpu_affinity: CPUs to pin the workers to, see :func:`worker_cpus`
+    :param max_requests: requests after which a worker is recycled
+    :param max_memory: resident memory (bytes) above which a worker is
+                       recycled
+    :param preload: freeze the objects of this process before forking, see
+                    :class:`WorkerManager`
+    :return:
+    """
     server_settings.setdefault('protocol', HttpProtocol)
     server_settings.setdefault('signal', Signal())
-    return sanic_serve_multiple(server_settings, workers)
+    server_settings['reuse_port'] = True
+    server_settings['run_multiple'] = True
+
+    inherited_sockets, inherited_workers = _inherited_state()
+    sockets = None
+    if reuse_port:
+        if SO_REUSEPORT is None:
+            raise RuntimeError('SO_REUSEPORT is not supported on this '
+                               'platform')
+        if server_settings.get('sock') is not None:
+            raise ValueError('reuse_port binds a socket for every worker, '
+                             'it cannot be used with sock')
+        sockets = inherited_sockets[:workers]
+        for sock in inherited_sockets[workers:]:
+            sock.close()
+        while len(sockets) < workers:
+            sockets.append(bind_socket(server_settings['host'],
+                                       server_settings['port'],
+                                       reuse_port=True))
+        server_settings['host'] = None
+        server_settings['port'] = None
+    else:
+        # Handling when custom socket is not provided.
+        if server_settings.get('sock') is None:
+            if inherited_sockets:
+                server_settings['sock'] = inherited_sockets.pop(0)
+            else:
+                server_settings['sock'] = bind_socket(
+                    server_settings['host'], server_settings['port'])
+            server_settings['host'] = None
+            server_settings['port'] = None
+        for sock in inherited_sockets:
+            sock.close()
+
+    manager = WorkerManager(server_settings, workers,
+                            cpu_affinity=cpu_affinity,
+                            max_requests=max_requests,
+                            max_memory=max_memory, preload=preload,
+                            sockets=sockets, inherited=inherited_workers)
+    try:
+        manager.run()
+    finally:
+        if server_settings.get('sock') is not None:
+            server_settings['sock'].close()
+        for sock in manager.sockets or ():
+            sock.close()
 
 
-__all__ = ["CIMultiDict", "Signal", "HttpProtocol",
-           "serve", "serve_multiple", "trigger_events", "update_current_time"]
+__all__ = ["CIMultiDict", "Signal", "HttpProtocol", "WorkerMetrics",
+           "worker_metrics", "TimerWheel", "Timer", "serve",
+           "serve_multiple", "serve_worker", "worker_cpus", "bind_socket",
+           "freeze_objects",
+           "Worker", "WorkerManager", "process_rss",
+           "trigger_events", "update_current_time"]
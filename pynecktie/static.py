@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+from collections import OrderedDict, namedtuple
+from mimetypes import guess_type
+from os import path
+from re import sub
+from stat import S_ISREG
+from time import strftime, gmtime, monotonic
+from urllib.parse import unquote
+
+from aiofiles.os import stat
+# ContentRangeHandler raises the upstream exceptions
+from sanic.exceptions import ContentRangeError, HeaderNotFound
+
+from pynecktie.exceptions import FileNotFound, InvalidUsage
+from pynecktie.handlers import ContentRangeHandler
+from pynecktie.headers import accepted_encodings
+from pynecktie.response import file, file_stream, HTTPResponse
+
+StaticCacheInfo = namedtuple(
+    'StaticCacheInfo',
+    ['hits', 'misses', 'evictions', 'maxsize', 'currsize', 'entries'])
+
+# Content codings of the precompressed siblings of a file, in order of
+# preference, with their file name suffixes
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+_SUFFIXES = dict(PRECOMPRESSED)
+_SUFFIXES[None] = ''
+# Bytes charged for every cached file, so that the entries of files which
+# are too large to keep in memory are bounded too
+_ENTRY_OVERHEAD = 512
+_ENCODINGS = tuple(encoding for encoding, _ in PRECOMPRESSED)
+
+
+def _signature(file_path):
+    """Modification time and size of a file and of its precompressed
+    siblings, which changes whenever one of them does."""
+    stats = os.stat(file_path)
+    if not S_ISREG(stats.st_mode):
+        raise FileNotFoundError(file_path)
+    signature = [(None, stats.st_mtime_ns, stats.st_size)]
+    for encoding, suffix in PRECOMPRESSED:
+        try:
+            stats = os.stat(file_path + suffix)
+        except OSError:
+            continue
+        if S_ISREG(stats.st_mode):
+            signature.append((encoding, stats.st_mtime_ns, stats.st_size))
+    return tuple(signature)
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class _Variant:
+    """The file itself, or one of its precompressed siblings."""
+    __slots__ = ('encoding', 'path', 'size', 'etag', 'body')
+
+    def __init__(self, encoding, path, size, etag, body):
+        self.encoding = encoding
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.body = body
+
+
+class _CacheEntry:
+    __slots__ = ('signature', 'checked', 'content_type', 'last_modified',
+                 'variants', 'cost')
+
+    def __init__(self, file_path, signature, max_file_size):
+        self.signature = signature
+        self.checked = monotonic()
+        self.content_type = guess_type(file_path)[0] or 'text/plain'
+        self.last_modified = strftime('%a, %d %b %Y %H:%M:%S GMT',
+                                      gmtime(signature[0][1] // 10 ** 9))
+        self.variants = []
+        self.cost = _ENTRY_OVERHEAD
+        for encoding, mtime, size in signature:
+            variant_path = file_path + _SUFFIXES[encoding]
+            body = None
+            if size <= max_file_size:
+                with open(variant_path, 'rb') as variant_file:
+                    body = variant_file.read()
+                self.cost += len(body)
+            etag = '"{:x}-{:x}{}"'.format(
+                mtime, size, '-' + encoding if encoding else '')
+            self.variants.append(
+                _Variant(encoding, variant_path, size, etag, body))
+
+    def select(self, accept_encoding):
+        """Pick the variant to send for an Accept-Encoding header.
+
+        :param accept_encoding: header value, or None
+        :return: _Variant
+        """
+        if accept_encoding and len(self.variants) > 1:
+            accepted = accepted_encodings(accept_encoding, _ENCODINGS)
+            for variant in self.variants[1:]:
+                if variant.encoding in accepted:
+                    return variant
+        return self.variants[0]
+
+
+class StaticCache:
+    """LRU cache of static files, bounded by the bytes kept in memory.
+
+    Files up to `max_file_size` bytes are kept in memory, together with
+    their `.br` and `.gz` siblings. For every file the cache also keeps the
+    `ETag` and `Last-Modified` values, so that conditional requests are
+    answered without touching the disk. Files are checked for changes by
+    their modification time and size at most once every `check_interval`
+    seconds.
+
+    :param max_size: bytes to keep in memory, 0 disables the cache
+    :param max_file_size: largest file kept in memory, larger files are
+                          sent from disk
+    :param check_interval: seconds between checks of a file for changes
+    """
+    __slots__ = ('maxsize', 'max_file_size', 'check_interval', 'currsize',
+                 'hits', 'misses', 'evictions', '_data')
+
+    def __init__(self, max_size=64 * 1024 * 1024,
+                 max_file_size=1024 * 1024, check_interval=1.0):
+        self.check_interval = check_interval
+        self.currsize = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self.resize(max_size, max_file_size)
+
+    def resize(self, max_size, max_file_size=None):
+        """Set the bytes to keep in memory, evicting files over it.
+
+        :param max_size: bytes to keep in memory, 0 disables the cache
+        :param max_file_size: largest file kept in memory
+        """
+        self.maxsize = max(int(max_size or 0), 0)
+        if max_file_size is not None:
+            self.max_file_size = max_file_size
+        self._evict(0)
+
+    def clear(self):
+        self._data.clear()
+        self.currsize = 0
+
+    def info(self):
+        """Report cache statistics.
+
+        :return: StaticCacheInfo
+        """
+        return StaticCacheInfo(self.hits, self.misses, self.evictions,
+                               self.maxsize, self.currsize, len(self._data))
+
+    def _evict(self, cost):
+        data = self._data
+        while data and self.currsize + cost > self.maxsize:
+            _, entry = data.popitem(last=False)
+            self.currsize -= entry.cost
+            self.evictions += 1
+
+    def _remove(self, file_path):
+        entry = self._data.pop(file_path, None)
+        if entry is not None:
+            self.currsize -= entry.cost
+
+    async def get(self, file_path):
+        """Get the cache entry of a file, loading it on a miss or when it
+        has changed since it was cached.
+
+        :param file_path: absolute path of the file
+        :return: _CacheEntry
+        :raises OSError: if the file can not be read
+        """
+        loop = asyncio.get_event_loop()
+        entry = self._data.get(file_path)
+        if entry is not None:
+            now = monotonic()
+            if now - entry.checked < self.check_interval:
+                self.hits += 1
+                self._data.move_to_end(file_path)
+                return entry
+            entry.checked = now
+            try:
+                signature = await loop.run_in_executor(
+                    None, _signature, file_path)
+            except OSError:
+                self._remove(file_path)
+                raise
+            if signature == entry.signature:
+                self.hits += 1
+                if file_path in self._data:
+                    self._data.move_to_end(file_path)
+                return entry
+        self.misses += 1
+        entry = await loop.run_in_executor(
+            None, self._load, file_path)
+        self._remove(file_path)
+        if entry.cost <= self.maxsize:
+            self._evict(entry.cost)
+            self._data[file_path] = entry
+            self.currsize += entry.cost
+        return entry
+
+    def _load(self, file_path):
+        return _CacheEntry(file_path, _signature(file_path),
+                           self.max_file_size)
+
+
+async def _cached_response(request, cache, file_path, use_modified_since,
+                           use_content_range, content_type, use_sendfile):
+    entry = await cache.get(file_path)
+    variant = entry.select(request.headers.get('Accept-Encoding'))
+    headers = {'ETag': variant.etag}
+    if use_modified_since:
+        headers['Last-Modified'] = entry.last_modified
+    if len(entry.variants) > 1:
+        headers['Vary'] = 'Accept-Encoding'
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, variant.etag):
+            return HTTPResponse(status=304, headers=headers)
+    elif use_modified_since and \
+            request.headers.get('If-Modified-Since') == entry.last_modified:
+        return HTTPResponse(status=304, headers=headers)
+    if variant.encoding:
+        headers['Content-Encoding'] = variant.encoding
+    if use_content_range:
+        headers['Accept-Ranges'] = 'bytes'
+    content_type = content_type or entry.content_type
+    if request.method == 'HEAD':
+        headers['Content-Length'] = str(variant.size)
+        return HTTPResponse(headers=headers, content_type=content_type)
+    if variant.body is not None:
+        return HTTPResponse(headers=headers, content_type=content_type,
+                            body_bytes=variant.body)
+    return await file_stream(variant.path, headers=headers,
+                             mime_type=content_type, sendfile=use_sendfile)
+
+
+def register(app, uri, file_or_directory, pattern,
+             use_modified_since, use_content_range,
+             stream_large_files, name='static', host=None,
+             strict_slashes=None, content_type=None, use_sendfile=True,
+             cache=None):
+    """
+    Register a static directory handler with Necktie by adding a route to the
+    router and registering a handler.
+
+    :param app: Necktie
+    :param file_or_directory: File or directory path to serve from
+    :param uri: URL to serve from
+    :param pattern: regular expression used to match files in the URL
+    :param use_modified_since: If true, send file modified time, and return
+                               not modified if the browser's matches the
+                               server's
+    :param use_content_range: If true, process header for range requests
+                              and sends the file part that is requested
+    :param stream_large_files: If true, use the file_stream() handler rather
+                              than the file() handler to send the file
+                              If this is an integer, this represents the
+                              threshold size to switch to file_stream()
+    :param name: user defined name used for url_for
+    :param content_type: user defined content type for header
+    :param use_sendfile: If true, send every file with file_stream(), which
+                         uses sendfile where the connection allows it
+    :param cache: StaticCache to serve the files from, except for range
+                  requests
+    """
+    # If we're not trying to match a file directly,
+    # serve from the folder
+    if not path.isfile(file_or_directory):
+        uri += '<file_uri:' + pattern + '>'
+
+    async def _handler(request, file_uri=None):
+        # Using this to determine if the URL is trying to break out of the path
+        # served.  os.path.realpath seems to be very slow
+        if file_uri and '../' in file_uri:
+            raise InvalidUsage("Invalid URL")
+        # Merge served directory and requested file if provided
+        # Strip all / that in the beginning of the URL to help prevent python
+        # from herping a derp and treating the uri as an absolute path
+        root_path = file_path = file_or_directory
+        if file_uri:
+            file_path = path.join(
+                file_or_directory, sub('^[/]*', '', file_uri))
+
+        # URL decode the path sent by the browser otherwise we won't be able to
+        # match filenames which got encoded (filenames with spaces etc)
+        file_path = path.abspath(unquote(file_path))
+        if not file_path.startswith(path.abspath(unquote(root_path))):
+            raise FileNotFound('File not found',
+                               path=file_or_directory,
+                               relative_url=file_uri)
+        try:
+            if cache is not None and not (use_content_range and
+                                          'Range' in request.headers):
+                return await _cached_response(
+                    request, cache, file_path, use_modified_since,
+                    use_content_range, content_type, use_sendfile)
+            headers = {}
+            # Check if the client has been sent this file before
+            # and it has not been modified since
+            stats = None
+            if use_modified_since:
+                stats = await stat(file_path)
+                modified_since = strftime(
+                    '%a, %d %b %Y %H:%M:%S GMT', gmtime(stats.st_mtime))
+                if request.headers.get('If-Modified-Since') == modified_since:
+                    return HTTPResponse(status=304)
+                headers['Last-Modified'] = modified_since
+            _range = None
+            if use_content_range:
+                _range = None
+                if not stats:
+                    stats = await stat(file_path)
+                headers['Accept-Ranges'] = 'bytes'
+                headers['Content-Length'] = str(stats.st_size)
+                if request.method != 'HEAD':
+                    try:
+                        _range = ContentRangeHandler(request, stats)
+                    except HeaderNotFound:
+                        pass
+                    else:
+                        del headers['Content-Length']
+                        for key, value in _range.headers.items():
+                            headers[key] = value
+            headers['Content-Type'] = content_type \
+                or guess_type(file_path)[0] or 'text/plain'
+            if request.method == 'HEAD':
+                return HTTPResponse(headers=headers)
+            else:
+                if use_sendfile:
+                    return await file_stream(file_path, headers=headers,
+                                             _range=_range)
+                if stream_large_files:
+                    if isinstance(stream_large_files, int):
+                        threshold = stream_large_files
+                    else:
+                        threshold = 1024 * 1024
+
+                    if not stats:
+                        stats = await stat(file_path)
+                    if stats.st_size >= threshold:
+                        return await file_stream(file_path, headers=headers,
+                                                 _range=_range,
+                                                 sendfile=False)
+                return await file(file_path, headers=headers, _range=_range)
+        except ContentRangeError:
+            raise
+        except Exception:
+            raise FileNotFound('File not found',
+                               path=file_or_directory,
+                               relative_url=file_uri)
+
+    # special prefix for static files
+    if not name.startswith('_static_'):
+        name = '_static_{}'.format(name)
+
+    app.route(uri, methods=['GET', 'HEAD'], name=name, host=host,
+              strict_slashes=strict_slashes)(_handler)
+
+
+__all__ = ["register", "StaticCache", "StaticCacheInfo",
+           "PRECOMPRESSED"]
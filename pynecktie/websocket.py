@@ -1,25 +1,131 @@
 # -*- coding: utf-8 -*-
+from websockets import handshake, WebSocketCommonProtocol, InvalidHandshake
+from websockets import ConnectionClosed  # noqa
 
-from sanic.websocket import WebSocketProtocol as SanicWebsocketProtocol
-from pynecktie.request import Request
-from pynecktie.server import Signal
+from pynecktie.exceptions import InvalidUsage
+from pynecktie.server import HttpProtocol
 
 
-class WebSocketProtocol(SanicWebsocketProtocol):
+class WebSocketProtocol(HttpProtocol):
+    """:class:`~pynecktie.server.HttpProtocol` switching to the websocket
+    protocol for websocket routes.
+
+    Until a connection is upgraded, its requests are handled as by
+    :class:`~pynecktie.server.HttpProtocol`, with pipelining, lazy headers,
+    the timer wheel, request stream backpressure and worker metrics. Frames
+    the client sends right after its upgrade request are kept until the
+    handshake, and passed on to the websocket.
+    """
+    __slots__ = ('websocket', 'websocket_timeout', 'websocket_max_size',
+                 'websocket_max_queue', 'websocket_read_limit',
+                 'websocket_write_limit')
+
     def __init__(self, *args, websocket_timeout=10,
                  websocket_max_size=None,
                  websocket_max_queue=None,
                  websocket_read_limit=2 ** 16,
                  websocket_write_limit=2 ** 16, **kwargs):
-        kwargs.setdefault("signal", Signal())
-        kwargs.setdefault("requequest_class", Request)
-        super(WebSocketProtocol, self).__init__(*args,
-            websocket_timeout=websocket_timeout,
-            websocket_max_size=websocket_max_size,
-            websocket_max_queue=websocket_max_queue,
-            websocket_read_limit=websocket_read_limit,
-            websocket_write_limit=websocket_write_limit,
-            **kwargs)
+        super(WebSocketProtocol, self).__init__(*args, **kwargs)
+        self.websocket = None
+        self.websocket_timeout = websocket_timeout
+        self.websocket_max_size = websocket_max_size
+        self.websocket_max_queue = websocket_max_queue
+        self.websocket_read_limit = websocket_read_limit
+        self.websocket_write_limit = websocket_write_limit
+
+    # timeouts make no sense for websocket routes
+    def request_timeout_callback(self):
+        if self.websocket is None:
+            super(WebSocketProtocol, self).request_timeout_callback()
+
+    def response_timeout_callback(self):
+        if self.websocket is None:
+            super(WebSocketProtocol, self).response_timeout_callback()
+
+    def keep_alive_timeout_callback(self):
+        if self.websocket is None:
+            super(WebSocketProtocol, self).keep_alive_timeout_callback()
+
+    def connection_lost(self, exc):
+        if self.websocket is not None:
+            self.websocket.connection_lost(exc)
+        super(WebSocketProtocol, self).connection_lost(exc)
+
+    def pause_writing(self):
+        super(WebSocketProtocol, self).pause_writing()
+        if self.websocket is not None:
+            self.websocket.pause_writing()
+
+    def resume_writing(self):
+        super(WebSocketProtocol, self).resume_writing()
+        if self.websocket is not None:
+            self.websocket.resume_writing()
+
+    def data_received(self, data):
+        if self.websocket is not None:
+            # pass the data to the websocket protocol
+            self.websocket.data_received(data)
+        else:
+            super(WebSocketProtocol, self).data_received(data)
+
+    def write_response(self, response):
+        if self.websocket is not None:
+            # websocket requests do not write a response
+            self.transport.close()
+        else:
+            super(WebSocketProtocol, self).write_response(response)
+
+    async def websocket_handshake(self, request, subprotocols=None):
+        # let the websockets package do the handshake with the client
+        headers = []
+
+        def get_header(k):
+            return request.headers.get(k, '')
+
+        def set_header(k, v):
+            headers.append((k, v))
+
+        try:
+            key = handshake.check_request(get_header)
+            handshake.build_response(set_header, key)
+        except InvalidHandshake:
+            raise InvalidUsage('Invalid websocket request')
+
+        subprotocol = None
+        if subprotocols and 'Sec-Websocket-Protocol' in request.headers:
+            # select a subprotocol
+            client_subprotocols = [p.strip() for p in request.headers[
+                'Sec-Websocket-Protocol'].split(',')]
+            for p in client_subprotocols:
+                if p in subprotocols:
+                    subprotocol = p
+                    set_header('Sec-Websocket-Protocol', subprotocol)
+                    break
+
+        # write the 101 response back to the client, after the responses
+        # of the requests pipelined before it
+        rv = b'HTTP/1.1 101 Switching Protocols\r\n'
+        for k, v in headers:
+            rv += k.encode('utf-8') + b': ' + v.encode('utf-8') + b'\r\n'
+        rv += b'\r\n'
+        self._flush()
+        request.transport.write(rv)
+
+        # hook up the websocket protocol
+        self.websocket = WebSocketCommonProtocol(
+            timeout=self.websocket_timeout,
+            max_size=self.websocket_max_size,
+            max_queue=self.websocket_max_queue,
+            read_limit=self.websocket_read_limit,
+            write_limit=self.websocket_write_limit
+        )
+        self.websocket.subprotocol = subprotocol
+        self.websocket.connection_made(request.transport)
+        self.websocket.connection_open()
+        received, self._upgrade = self._upgrade, None
+        if received:
+            self.websocket.data_received(bytes(received))
+        return self.websocket
 
 
 __all__ = ["WebSocketProtocol"]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Request body accumulation benchmark.
+
+Feeds a body to `HttpProtocol.on_body` in 64 KB chunks, as the server
+receives it, and completes the request. This is compared with keeping the
+chunks in a list and joining them at the end, as the server used to do.
+For each body size it prints the time per body and the peak memory
+allocated while receiving it, as a multiple of the body size.
+
+Usage::
+
+    python tests/performance/bench_body.py [iterations]
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from pynecktie.server import HttpProtocol
+
+CHUNK_SIZE = 65536
+SIZES = (1024 * 1024, 10 * 1024 * 1024, 50 * 1024 * 1024)
+
+
+class _Request:
+    body = None
+    stream = None
+
+
+def received(chunks):
+    # a new bytes object for every chunk, as read from the socket
+    for chunk in chunks:
+        yield memoryview(chunk).tobytes()
+
+
+def join_body(chunks, length):
+    body = []
+    for chunk in received(chunks):
+        body.append(chunk)
+    return b''.join(body)
+
+
+def preallocated_body(protocol, chunks, length):
+    request = protocol._message = _Request()
+    protocol.on_message_begin()
+    protocol._body_length = length
+    for chunk in received(chunks):
+        protocol.on_body(chunk)
+    protocol.on_message_complete()
+    return request.body
+
+
+def chunks_of(size):
+    data = b'x' * CHUNK_SIZE
+    return [data] * (size // CHUNK_SIZE)
+
+
+def run(accumulate, size, iterations):
+    chunks = chunks_of(size)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        accumulate(chunks, size)
+    elapsed = (time.perf_counter() - start) / iterations * 1000
+
+    tracemalloc.start()
+    try:
+        body = accumulate(chunks, size)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert len(body) == size
+    return elapsed, peak / size
+
+
+def main(iterations=10):
+    loop = asyncio.new_event_loop()
+    protocol = HttpProtocol(loop=loop, request_handler=None,
+                            error_handler=None)
+    protocol._is_stream_handler = False
+    protocol._dispatch = lambda request, keep_alive: None
+
+    def preallocated(chunks, length):
+        return preallocated_body(protocol, chunks, length)
+
+    print('{:<14} {:>8} {:>12} {:>12}'.format(
+        'body', 'size', 'time', 'peak/size'))
+    for size in SIZES:
+        for name, accumulate in (('list+join', join_body),
+                                 ('preallocated', preallocated)):
+            elapsed, ratio = run(accumulate, size, iterations)
+            print('{:<14} {:>6}MB {:>10.2f}ms {:>12.2f}'.format(
+                name, size // (1024 * 1024), elapsed, ratio))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Event loop benchmark.
+
+Runs the same application in a child process once for every installed
+event loop implementation, set with `EVENT_LOOP`, and sends it requests
+over 50 keep-alive connections. Prints the requests per second and the
+mean latency for a plain text and a JSON route.
+
+Usage::
+
+    python tests/performance/bench_event_loop.py [requests]
+"""
+import asyncio
+import socket
+import sys
+import time
+from multiprocessing import Process
+
+from pynecktie import Necktie
+from pynecktie.event_loop import EVENT_LOOP_POLICIES
+from pynecktie.response import json, text
+
+HOST = '127.0.0.1'
+PORT = 42103
+CONNECTIONS = 50
+
+
+def serve(event_loop):
+    app = Necktie('bench_event_loop', configure_logging=False)
+    app.config.EVENT_LOOP = event_loop
+
+    @app.route('/text')
+    async def plain(request):
+        return text('Hello, world!')
+
+    @app.route('/json')
+    async def items(request):
+        return json({'items': [{'id': index, 'name': 'item'}
+                               for index in range(10)]})
+
+    app.run(host=HOST, port=PORT, access_log=False)
+
+
+def wait_for_server():
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, PORT)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('The server did not start')
+
+
+async def client(path, count, latencies):
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    request = 'GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(
+        path, HOST).encode()
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = int(head.lower().split(b'content-length:')[1]
+                         .split(b'\r\n')[0])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def clients(path, requests, latencies):
+    await asyncio.gather(*(client(path, requests // CONNECTIONS, latencies)
+                           for _ in range(CONNECTIONS)))
+
+
+def load(path, requests):
+    latencies = []
+    loop = asyncio.new_event_loop()
+    start = time.perf_counter()
+    try:
+        loop.run_until_complete(clients(path, requests, latencies))
+    finally:
+        loop.close()
+    elapsed = time.perf_counter() - start
+    return (len(latencies) / elapsed,
+            sum(latencies) / len(latencies) * 1000)
+
+
+def main(requests=20000):
+    print('{:<10} {:<8} {:>12} {:>12}'.format(
+        'loop', 'route', 'requests/s', 'latency'))
+    for event_loop in sorted(EVENT_LOOP_POLICIES):
+        server = Process(target=serve, args=(event_loop,))
+        server.start()
+        try:
+            wait_for_server()
+            # warm up
+            load('/text', CONNECTIONS * 10)
+            for path in ('/text', '/json'):
+                rate, latency = load(path, requests)
+                print('{:<10} {:<8} {:>12.0f} {:>10.2f}ms'.format(
+                    event_loop, path, rate, latency))
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
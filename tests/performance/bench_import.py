@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Import time benchmark.
+
+Imports `pynecktie` and some of its modules in new interpreters with
+`python -X importtime`, and prints the median cumulative import time, the
+share of it spent in pynecktie's own modules, and the number of modules
+imported. `import sanic` is measured as well: any module of the upstream
+framework imports all of it, which is the floor for everything but the
+bare package.
+
+Usage::
+
+    python tests/performance/bench_import.py [iterations]
+"""
+import os
+import subprocess
+import sys
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+STATEMENTS = (
+    'import pynecktie',
+    'import sanic',
+    'import pynecktie.response',
+    'from pynecktie import Blueprint',
+    'from pynecktie import Necktie',
+    'from pynecktie import Necktie; Necktie("app").test_client',
+)
+
+
+def import_time(statement):
+    """Total and pynecktie import time (us), and modules imported"""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=ROOT, stderr=subprocess.PIPE, check=True).stderr.decode()
+    total = own = modules = 0
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[12:].split('|')
+        modules += 1
+        if name.strip().startswith('pynecktie'):
+            own += int(self_time)
+        if not name.startswith('  '):
+            # a module imported by the statement itself
+            total += int(cumulative)
+    return total, own, modules
+
+
+def main(iterations=10):
+    print('{:<58} {:>10} {:>10} {:>8}'.format(
+        'statement', 'total', 'pynecktie', 'modules'))
+    for statement in STATEMENTS:
+        results = [import_time(statement) for _ in range(iterations)]
+        total = median(result[0] for result in results) / 1000
+        own = median(result[1] for result in results) / 1000
+        print('{:<58} {:>8.1f}ms {:>8.1f}ms {:>8}'.format(
+            statement, total, own, results[0][2]))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
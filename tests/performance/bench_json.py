@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+JSON codec benchmark.
+
+Encodes payloads of about 100 B, 10 KB, 1 MB and 5 MB with every installed
+codec of `pynecktie.json_codec`, as `json()` responses do, and decodes them
+again as `request.json` does. The upstream column is the `str` returning
+encoder of `sanic.response.json_dumps` followed by `str.encode`, which is
+what building a JSON response cost before.
+
+Usage::
+
+    python tests/performance/bench_json.py [iterations]
+"""
+import sys
+import time
+
+from sanic.response import json_dumps
+
+from pynecktie.json_codec import JSON_CODECS
+
+
+def payload(items):
+    return {
+        'count': items,
+        'items': [{'id': i, 'name': 'item {}'.format(i), 'price': i * 1.25,
+                   'tags': ['a', 'b'], 'active': i % 2 == 0}
+                  for i in range(items)],
+    }
+
+
+PAYLOADS = (('100B', 1), ('10KB', 100), ('1MB', 10000), ('5MB', 50000))
+
+
+def measure(function, argument, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return (time.perf_counter() - start) / iterations * 1000000
+
+
+def main(iterations=10000):
+    names = sorted(JSON_CODECS)
+    print('{:<6} {:<7} {:>12}'.format('size', 'op', 'upstream') +
+          ''.join(' {:>12}'.format(name) for name in names))
+    for size, items in PAYLOADS:
+        data = payload(items)
+        encoded = JSON_CODECS['json'].dumps(data)
+        count = max(iterations // max(items, 1), 3)
+        encode = [measure(lambda obj: json_dumps(obj).encode(), data, count)]
+        encode += [measure(JSON_CODECS[name].dumps, data, count)
+                   for name in names]
+        decode = [None]
+        decode += [measure(JSON_CODECS[name].loads, encoded, count)
+                   for name in names]
+        for op, timings in (('encode', encode), ('decode', decode)):
+            print('{:<6} {:<7}'.format(size, op) + ''.join(
+                ' {:>12}'.format('-') if t is None else
+                ' {:>10.1f}us'.format(t) for t in timings))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Middleware chain overhead benchmark.
+
+Runs `handle_request` directly (no network) with 0, 5 and 20 request and
+response middlewares, half of them plain functions and half coroutines,
+comparing the frozen chain of `Necktie.handle_request` with the upstream
+implementation that inspects every middleware result on every request.
+
+Usage::
+
+    python tests/performance/bench_middleware.py [iterations]
+"""
+import asyncio
+import sys
+import time
+
+from sanic.app import Sanic
+
+from pynecktie import Necktie
+from pynecktie.request import Request
+from pynecktie.response import text
+
+
+class UpstreamNecktie(Necktie):
+    handle_request = Sanic.handle_request
+    _run_request_middleware = Sanic._run_request_middleware
+    _run_response_middleware = Sanic._run_response_middleware
+
+
+def build_app(app_class, count):
+    app = app_class('bench_middleware_{}'.format(count))
+
+    for i in range(count):
+        if i % 2:
+            async def request_middleware(request):
+                pass
+
+            async def response_middleware(request, response):
+                pass
+        else:
+            def request_middleware(request):
+                pass
+
+            def response_middleware(request, response):
+                pass
+        app.register_middleware(request_middleware, 'request')
+        app.register_middleware(response_middleware, 'response')
+
+    @app.route('/')
+    def handler(request):
+        return text('OK')
+
+    return app
+
+
+async def run(app, iterations):
+    def write(response):
+        pass
+
+    async def stream(response):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        request = Request(b'/', {}, '1.1', 'GET', None)
+        await app.handle_request(request, write, stream)
+    return (time.perf_counter() - start) / iterations * 1000000
+
+
+def main(iterations=20000):
+    loop = asyncio.new_event_loop()
+    print('{:<12} {:>12} {:>12}'.format('middlewares', 'upstream', 'frozen'))
+    for count in (0, 5, 20):
+        timings = [
+            loop.run_until_complete(
+                run(build_app(app_class, count), iterations))
+            for app_class in (UpstreamNecktie, Necktie)]
+        print('{:<12} {:>10.2f}us {:>10.2f}us'.format(count, *timings))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
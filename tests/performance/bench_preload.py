@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Preload benchmark.
+
+Runs four workers of an application holding a million small objects, built
+before the fork, as large route tables or template caches are, once as is
+and once with `preload=True`. Every worker runs a full garbage collection
+after it starts, as long-running workers eventually do. Prints the private
+(unshared) memory and the proportional set size of each worker, from
+`/proc/<pid>/smaps_rollup`, which needs Linux 4.14.
+
+Usage::
+
+    python tests/performance/bench_preload.py [objects]
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from multiprocessing import Process
+
+from pynecktie import Necktie
+from pynecktie.response import text
+
+HOST = '127.0.0.1'
+PORT = 42105
+WORKERS = 4
+
+
+def serve(objects, preload):
+    app = Necktie('bench_preload', configure_logging=False)
+
+    @app.listener('before_fork')
+    def build(app, loop):
+        # dicts holding a list stay tracked by the garbage collector
+        app.config.TABLE = [{'id': index, 'tags': ['item', index]}
+                            for index in range(objects)]
+
+    @app.listener('after_server_start')
+    def collect(app, loop):
+        gc.collect()
+
+    @app.route('/')
+    async def handler(request):
+        return text(str(os.getpid()))
+
+    app.run(host=HOST, port=PORT, workers=WORKERS, preload=preload,
+            access_log=False)
+
+
+def worker_pid():
+    with socket.create_connection((HOST, PORT), timeout=5) as sock:
+        sock.sendall(b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = b''
+        while True:
+            received = sock.recv(4096)
+            if not received:
+                break
+            response += received
+    return int(response.split(b'\r\n\r\n', 1)[1])
+
+
+def worker_pids():
+    pids = set()
+    deadline = time.monotonic() + 60
+    while len(pids) < WORKERS and time.monotonic() < deadline:
+        try:
+            pids.add(worker_pid())
+        except OSError:
+            time.sleep(0.1)
+    return sorted(pids)
+
+
+def memory(pid):
+    """Private memory and PSS of a process (MB)"""
+    values = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as smaps:
+        for line in smaps:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                values[name] = int(value.split()[0])
+    private = values['Private_Clean'] + values['Private_Dirty']
+    return private / 1024, values['Pss'] / 1024
+
+
+def main(objects=1000000):
+    print('{:<10} {:>8} {:>12} {:>12}'.format(
+        'preload', 'worker', 'private', 'pss'))
+    for preload in (False, True):
+        server = Process(target=serve, args=(objects, preload))
+        server.start()
+        try:
+            pids = worker_pids()
+            # let the collections after the start finish
+            time.sleep(2)
+            totals = [0, 0]
+            for index, pid in enumerate(pids):
+                private, pss = memory(pid)
+                totals[0] += private
+                totals[1] += pss
+                print('{:<10} {:>8} {:>10.1f}MB {:>10.1f}MB'.format(
+                    str(preload), index, private, pss))
+            print('{:<10} {:>8} {:>10.1f}MB {:>10.1f}MB'.format(
+                str(preload), 'total', *totals))
+        finally:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Request construction benchmark.
+
+Builds requests the way the server does, from the URL and the raw header
+pairs of a typical browser request, with the upstream
+`sanic.request.Request`, with a bare subclass of it as
+`pynecktie.request.Request` used to be, which gives every request a
+`__dict__`, and with `pynecktie.request.Request`. For each it prints the
+time, the number of memory blocks and the bytes allocated per request,
+right after construction and after reading the query arguments.
+
+Usage::
+
+    python tests/performance/bench_request.py [iterations]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from sanic.request import Request as UpstreamRequest
+
+from pynecktie.headers import Headers
+from pynecktie.request import Request
+
+URL = b'/api/items?page=2&sort=name'
+HEADERS = (
+    (b'Host', b'example.com'),
+    (b'User-Agent', b'Mozilla/5.0 (X11; Linux x86_64) Firefox/60.0'),
+    (b'Accept', b'application/json'),
+    (b'Accept-Language', b'en-US,en;q=0.5'),
+    (b'Accept-Encoding', b'gzip, deflate, br'),
+    (b'Cookie', b'session=0123456789abcdef; theme=dark'),
+    (b'Connection', b'keep-alive'),
+)
+
+
+class SubclassRequest(UpstreamRequest):
+    pass
+
+
+def build(request_class, access_args):
+    request = request_class(URL, Headers(list(HEADERS)), '1.1', 'GET', None)
+    if access_args:
+        request.args
+    return request
+
+
+def run(request_class, iterations, access_args=False):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        build(request_class, access_args)
+    elapsed = (time.perf_counter() - start) / iterations * 1000000
+
+    # keep the requests alive to count the memory they hold on to
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        blocks = sys.getallocatedblocks()
+        size = tracemalloc.get_traced_memory()[0]
+        requests = [None] * iterations
+        for index in range(iterations):
+            requests[index] = build(request_class, access_args)
+        blocks = sys.getallocatedblocks() - blocks
+        size = tracemalloc.get_traced_memory()[0] - size
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    del requests
+    return elapsed, blocks / iterations, size / iterations
+
+
+def main(iterations=100000):
+    print('{:<20} {:>12} {:>12} {:>12}'.format(
+        'request', 'time', 'blocks', 'bytes'))
+    for name, request_class in (('upstream', UpstreamRequest),
+                                ('subclass', SubclassRequest),
+                                ('pynecktie', Request)):
+        for access_args in (False, True):
+            timings = run(request_class, iterations, access_args)
+            label = name + (' +args' if access_args else '')
+            print('{:<20} {:>10.2f}us {:>12.1f} {:>12.0f}'.format(
+                label, *timings))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
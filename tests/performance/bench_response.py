@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Response serialisation benchmark.
+
+Measures `output()` for a small text response, a small json response with
+a custom header, a 304 response and a 1 MB body, comparing the upstream
+`sanic.response.HTTPResponse` with `pynecktie.response.HTTPResponse`,
+which joins pre-encoded status lines and headers. The 1 MB body is also
+measured with `output_buffers()`, which does not copy the body.
+
+Usage::
+
+    python tests/performance/bench_response.py [iterations]
+"""
+import sys
+import time
+
+from sanic.response import HTTPResponse as UpstreamHTTPResponse
+
+from pynecktie.response import HTTPResponse
+
+CASES = (
+    ('text', dict(body='Hello, world!',
+                  content_type='text/plain; charset=utf-8')),
+    ('json+header', dict(body='{"hello":"world","items":[1,2,3]}',
+                         headers={'X-Request-Id': 'abcdef0123456789'},
+                         content_type='application/json')),
+    ('304', dict(status=304, headers={'ETag': '"abc"'})),
+    ('1MB body', dict(body_bytes=b'x' * 2 ** 20,
+                      content_type='application/octet-stream')),
+)
+
+
+def run(response_class, kwargs, iterations, method='output'):
+    response = response_class(**kwargs)
+    output = getattr(response, method)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        output('1.1', True, 5)
+    return (time.perf_counter() - start) / iterations * 1000000
+
+
+def main(iterations=100000):
+    print('{:<14} {:>12} {:>12} {:>12}'.format(
+        'response', 'upstream', 'output', 'buffers'))
+    for name, kwargs in CASES:
+        count = iterations if 'body_bytes' not in kwargs else \
+            max(iterations // 100, 1)
+        timings = [run(UpstreamHTTPResponse, kwargs, count),
+                   run(HTTPResponse, kwargs, count),
+                   run(HTTPResponse, kwargs, count, 'output_buffers')]
+        print('{:<14} {:>10.2f}us {:>10.2f}us {:>10.2f}us'.format(
+            name, *timings))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
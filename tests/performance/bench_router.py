@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Router lookup micro-benchmark.
+
+Measures the cost of a single uncached `Router._get` call for static,
+dynamic and missing routes, which is what every request pays when the
+route cache misses (e.g. high-cardinality URLs).
+
+Usage::
+
+    python tests/performance/bench_router.py [iterations]
+"""
+import sys
+import timeit
+
+from pynecktie.exceptions import MethodNotSupported, NotFound
+from pynecktie.router import Router
+
+
+def handler(request, *args, **kwargs):
+    pass
+
+
+def build_router(routes=100):
+    router = Router()
+    for i in range(routes):
+        router.add('/static/{}'.format(i), ['GET'], handler)
+        router.add('/user/{}/<id:int>'.format(i), ['GET'], handler)
+        router.add('/file/{}/<name:path>'.format(i), ['GET'], handler)
+    return router
+
+
+def lookup(get, url, method):
+    try:
+        get(url, method, '')
+    except (NotFound, MethodNotSupported):
+        pass
+
+
+def main(iterations=20000):
+    router = build_router()
+    # Call `_get` rather than `get` so that the route cache does not hide
+    # the lookup cost.
+    get = router._get
+    cases = (
+        ('static', '/static/50', 'GET'),
+        ('static (405)', '/static/50', 'POST'),
+        ('dynamic', '/user/50/1234', 'GET'),
+        ('dynamic (405)', '/user/50/1234', 'POST'),
+        ('unhashable', '/file/50/a/b/c.txt', 'GET'),
+        ('missing', '/nothing/here', 'GET'),
+    )
+    print('{:<16} {:>12}'.format('route', 'usec/lookup'))
+    for label, url, method in cases:
+        elapsed = timeit.timeit(lambda: lookup(get, url, method),
+                                number=iterations)
+        print('{:<16} {:>12.3f}'.format(
+            label, elapsed / iterations * 1000000))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
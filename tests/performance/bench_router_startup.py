@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Router startup benchmark.
+
+Registers a few thousand routes, most of them with parameters, as a large
+API does, on the upstream router and on pynecktie's routers, then freezes
+the route table as the app does before it starts serving. Prints the median
+time to register the routes, to freeze the table and to answer the first
+lookup of a dynamic route, which for the `TrieRouter` no longer includes
+building the trie.
+
+Usage::
+
+    python tests/performance/bench_router_startup.py [routes]
+"""
+import sys
+import time
+from statistics import median
+
+from sanic.router import Router as SanicRouter
+
+from pynecktie.router import Router, TrieRouter
+
+ROUTERS = (
+    ('sanic', SanicRouter),
+    ('Router', Router),
+    ('TrieRouter', TrieRouter),
+)
+
+
+def handler(request, **kwargs):
+    pass
+
+
+def uris(count):
+    for index in range(count):
+        if index % 5 == 0:
+            yield '/api/static{}'.format(index)
+        elif index % 5 == 1:
+            yield '/api/resource{}/<id:int>'.format(index)
+        elif index % 5 == 2:
+            yield '/api/resource{}/<id:int>/<action>'.format(index)
+        elif index % 5 == 3:
+            yield '/api/<version>/resource{}/<id:uuid>'.format(index)
+        else:
+            yield '/api/files{}/<name:path>'.format(index)
+
+
+def run(router_class, routes):
+    router = router_class()
+    start = time.perf_counter()
+    for uri in routes:
+        router.add(uri, ['GET'], handler)
+    registered = time.perf_counter()
+    if hasattr(router, 'freeze'):
+        router.freeze()
+    frozen = time.perf_counter()
+    router._get('/api/resource{}/1'.format(len(routes) - 4), 'GET', '')
+    looked_up = time.perf_counter()
+    return registered - start, frozen - registered, looked_up - frozen
+
+
+def main(count=3000, iterations=5):
+    routes = list(uris(count))
+    print('{} routes'.format(count))
+    print('{:<12} {:>12} {:>12} {:>14}'.format(
+        'router', 'register', 'freeze', 'first lookup'))
+    for name, router_class in ROUTERS:
+        results = [run(router_class, routes) for _ in range(iterations)]
+        print('{:<12} {:>10.1f}ms {:>10.1f}ms {:>12.2f}ms'.format(
+            name, *(median(result[column] for result in results) * 1000
+                    for column in range(3))))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
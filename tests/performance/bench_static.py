@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Static file benchmark.
+
+Serves 4 KB, 1 MB and 1 GB files with `app.static()` from a server in a
+child process, once with sendfile and once with `use_sendfile=False`, which
+reads the files in chunks, and downloads them over a plain socket. Prints
+the mean time per download and the CPU time the server spent on it. The
+1 GB file is sparse, so it is read from the page cache rather than disk.
+
+Usage::
+
+    python tests/performance/bench_static.py [iterations]
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from multiprocessing import Process
+
+from pynecktie import Necktie
+from pynecktie.response import text
+
+HOST = '127.0.0.1'
+PORT = 42102
+
+# name, size and the share of the iterations that download it
+FILES = (
+    ('4KB', 4 * 1024, 1),
+    ('1MB', 1024 * 1024, 10),
+    ('1GB', 1024 * 1024 * 1024, 1000),
+)
+
+
+def serve(directory):
+    app = Necktie('bench_static')
+    app.static('/sendfile', directory, name='sendfile')
+    app.static('/chunks', directory, name='chunks', use_sendfile=False,
+               stream_large_files=True)
+
+    @app.route('/cpu')
+    async def cpu(request):
+        return text(repr(time.process_time()))
+
+    app.run(host=HOST, port=PORT, access_log=False)
+
+
+def get(path):
+    """Download `path` and return the body size."""
+    with socket.create_connection((HOST, PORT)) as sock:
+        sock.sendall('GET {} HTTP/1.1\r\nHost: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(path, HOST).encode())
+        buffer = bytearray(1024 * 1024)
+        head = b''
+        while b'\r\n\r\n' not in head:
+            received = sock.recv(65536)
+            if not received:
+                raise ConnectionError('No response for {}'.format(path))
+            head += received
+        head, body = head.split(b'\r\n\r\n', 1)
+        size = len(body)
+        while True:
+            received = sock.recv_into(buffer)
+            if not received:
+                return size
+            size += received
+
+
+def server_cpu():
+    with socket.create_connection((HOST, PORT)) as sock:
+        sock.sendall(b'GET /cpu HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = b''
+        while True:
+            received = sock.recv(4096)
+            if not received:
+                break
+            response += received
+    return float(response.split(b'\r\n\r\n', 1)[1])
+
+
+def wait_for_server(timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return server_cpu()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run(path, size, count):
+    cpu = server_cpu()
+    start = time.perf_counter()
+    for _ in range(count):
+        assert get(path) == size
+    elapsed = (time.perf_counter() - start) / count
+    return elapsed * 1000, (server_cpu() - cpu) / count * 1000
+
+
+def main(iterations=100):
+    directory = tempfile.mkdtemp()
+    try:
+        for name, size, _ in FILES:
+            with open(os.path.join(directory, name), 'wb') as file:
+                file.truncate(size)
+        server = Process(target=serve, args=(directory,))
+        server.start()
+        try:
+            wait_for_server()
+            print('{:<6} {:>14} {:>14} {:>14} {:>14}'.format(
+                'file', 'sendfile', 'sendfile cpu', 'chunks',
+                'chunks cpu'))
+            for name, size, share in FILES:
+                count = max(iterations // share, 1)
+                timings = run('/sendfile/' + name, size, count) + \
+                    run('/chunks/' + name, size, count)
+                print('{:<6} {:>12.2f}ms {:>12.2f}ms {:>12.2f}ms '
+                      '{:>12.2f}ms'.format(name, *timings))
+        finally:
+            server.terminate()
+            server.join()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
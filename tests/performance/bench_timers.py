@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Idle connection timeout benchmark.
+
+Simulates 10k, 50k and 100k idle keep-alive connections, each holding a
+keep-alive timeout, and measures arming the timeouts, re-arming them all
+(as every connection serving a request does) and spinning the event loop
+while they are pending. Compares scheduling on the event loop with
+`loop.call_later` against the server's `TimerWheel`. No sockets are
+opened, so the numbers isolate the cost of the timers themselves.
+
+Usage::
+
+    python tests/performance/bench_timers.py [spins]
+"""
+import asyncio
+import sys
+import time
+
+from pynecktie.server import TimerWheel
+
+
+def callback():
+    pass
+
+
+def measure(loop, timers, connections, spins):
+    start = time.perf_counter()
+    handles = [timers.call_later(5, callback) for _ in range(connections)]
+    armed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i, handle in enumerate(handles):
+        handle.cancel()
+        handles[i] = timers.call_later(5, callback)
+    rearmed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(spins):
+        loop.run_until_complete(asyncio.sleep(0))
+    spun = (time.perf_counter() - start) / spins
+
+    for handle in handles:
+        handle.cancel()
+    return armed * 1000, rearmed * 1000, spun * 1000000
+
+
+def main(spins=1000):
+    print('{:<12} {:<6} {:>10} {:>10} {:>12}'.format(
+        'connections', 'timers', 'arm', 're-arm', 'loop spin'))
+    for connections in (10000, 50000, 100000):
+        for name in ('loop', 'wheel'):
+            loop = asyncio.new_event_loop()
+            timers = loop if name == 'loop' else TimerWheel()
+            print('{:<12} {:<6} {:>8.1f}ms {:>8.1f}ms {:>10.1f}us'.format(
+                connections, name,
+                *measure(loop, timers, connections, spins)))
+            loop.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Router vs TrieRouter lookup benchmark.
+
+Registers 10, 100 and 1000 parameterised routes on both routers and
+times uncached lookups of the first, middle and last registered route.
+
+Usage::
+
+    python tests/performance/bench_trie_router.py [iterations]
+"""
+import sys
+import timeit
+
+from pynecktie.router import Router, TrieRouter
+
+
+def handler(request, *args, **kwargs):
+    pass
+
+
+def build_router(router_class, routes):
+    router = router_class()
+    for i in range(routes):
+        router.add('/api/resource{}/<id:int>'.format(i), ['GET'], handler)
+        router.add('/api/resource{}/<id:int>/<action>'.format(i), ['GET'],
+                   handler)
+    return router
+
+
+def main(iterations=2000):
+    print('{:<8} {:<12} {:>12} {:>12}'.format(
+        'routes', 'url', 'Router', 'TrieRouter'))
+    for routes in (10, 100, 1000):
+        routers = [build_router(router_class, routes // 2)
+                   for router_class in (Router, TrieRouter)]
+        for position in (0, routes // 4, routes // 2 - 1):
+            url = '/api/resource{}/42/edit'.format(position)
+            timings = []
+            for router in routers:
+                # Bypass the route cache to time the lookup itself.
+                get = router._get
+                get(url, 'GET', '')
+                elapsed = timeit.timeit(lambda: get(url, 'GET', ''),
+                                        number=iterations)
+                timings.append(elapsed / iterations * 1000000)
+            print('{:<8} {:<12} {:>10.2f}us {:>10.2f}us'.format(
+                routes, '#{}'.format(position * 2 + 1), *timings))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
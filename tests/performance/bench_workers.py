@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-worker benchmark.
+
+Runs the application with one worker per CPU, and at least two, first
+sharing a socket bound in the main process, then with `reuse_port=True`,
+where each worker accepts from a `SO_REUSEPORT` socket of its own, and then
+with the workers also pinned to a CPU each. Requests are sent over 64
+concurrent clients, on a new connection each, so every request goes through
+an accept. For every worker it prints the share of the requests it answered
+and their median and 99th percentile latency, which show how evenly the
+connections are spread.
+
+Usage::
+
+    python tests/performance/bench_workers.py [requests]
+"""
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+from collections import defaultdict
+from multiprocessing import Process
+
+from pynecktie import Necktie
+from pynecktie.response import text
+
+HOST = '127.0.0.1'
+PORT = 42104
+CLIENTS = 64
+
+MODES = (
+    ('shared', {}),
+    ('reuse_port', {'reuse_port': True}),
+    ('reuse_port+cpu', {'reuse_port': True, 'cpu_affinity': True}),
+)
+
+
+def serve(workers, options):
+    app = Necktie('bench_workers', configure_logging=False)
+
+    @app.route('/')
+    async def handler(request):
+        # a little work per request, so that busy workers fall behind
+        sum(range(2000))
+        return text(str(os.getpid()))
+
+    app.run(host=HOST, port=PORT, workers=workers, access_log=False,
+            **options)
+
+
+def wait_for_server():
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, PORT)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('The server did not start')
+
+
+async def client(count, latencies):
+    request = 'GET / HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n' \
+              '\r\n'.format(HOST).encode()
+    for _ in range(count):
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+        writer.write(request)
+        response = await reader.read()
+        writer.close()
+        pid = int(response.split(b'\r\n\r\n', 1)[1])
+        latencies[pid].append(time.perf_counter() - start)
+
+
+async def clients(requests, latencies):
+    await asyncio.gather(*(client(requests // CLIENTS, latencies)
+                           for _ in range(CLIENTS)))
+
+
+def load(requests):
+    latencies = defaultdict(list)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(clients(requests, latencies))
+    finally:
+        loop.close()
+    return latencies
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def main(requests=20000):
+    if hasattr(os, 'sched_getaffinity'):
+        workers = max(2, len(os.sched_getaffinity(0)))
+    else:
+        workers = max(2, os.cpu_count() or 1)
+    print('{} workers, {} requests'.format(workers, requests))
+    print('{:<16} {:>8} {:>8} {:>10} {:>10}'.format(
+        'mode', 'worker', 'share', 'p50', 'p99'))
+    for name, options in MODES:
+        server = Process(target=serve, args=(workers, options))
+        server.start()
+        try:
+            wait_for_server()
+            load(CLIENTS * 10)
+            latencies = load(requests)
+        finally:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join()
+        total = sum(len(values) for values in latencies.values())
+        for index, pid in enumerate(sorted(latencies)):
+            values = sorted(latencies[pid])
+            print('{:<16} {:>8} {:>7.1f}% {:>8.2f}ms {:>8.2f}ms'.format(
+                name, index, len(values) / total * 100,
+                percentile(values, 0.5), percentile(values, 0.99)))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,165 @@
+import gzip
+import zlib
+
+import pytest
+
+from pynecktie import Necktie
+from pynecktie.compression import Compress
+from pynecktie.response import json_stream, raw, stream, text
+
+BODY = 'Necktie compresses this text. ' * 100
+
+
+def compressed_app(**options):
+    app = Necktie('test_compression')
+    Compress(app, **options)
+
+    @app.route('/text')
+    async def text_route(request):
+        return text(BODY, headers={'ETag': '"abc"'})
+
+    @app.route('/small')
+    async def small_route(request):
+        return text('small')
+
+    @app.route('/png')
+    async def png_route(request):
+        return raw(BODY.encode(), content_type='image/png')
+
+    @app.route('/partial')
+    async def partial_route(request):
+        return raw(BODY.encode(), status=206, content_type='text/plain',
+                   headers={'Content-Range': 'bytes 0-{}/{}'.format(
+                       len(BODY) - 1, len(BODY) * 2)})
+
+    @app.route('/encoded')
+    async def encoded_route(request):
+        return raw(gzip.compress(BODY.encode()), content_type='text/plain',
+                   headers={'Content-Encoding': 'gzip'})
+
+    @app.route('/stream')
+    async def stream_route(request):
+        async def streaming_fn(response):
+            for _ in range(100):
+                response.write('Necktie compresses this text. ')
+        return stream(streaming_fn)
+
+    @app.route('/json_stream')
+    async def json_stream_route(request):
+        return json_stream(range(1000), flush_size=100)
+
+    return app
+
+
+# ------------------------------------------------------------ #
+#  HTTPResponse
+# ------------------------------------------------------------ #
+
+@pytest.mark.parametrize('accept_encoding,encoding', [
+    ('gzip, deflate', 'gzip'),
+    ('deflate', 'deflate'),
+    ('gzip;q=0, deflate', 'deflate'),
+])
+def test_compress_response(accept_encoding, encoding):
+    app = compressed_app()
+
+    request, response = app.test_client.get(
+        '/text', headers={'Accept-Encoding': accept_encoding})
+    assert response.status == 200
+    assert response.text == BODY
+    assert response.headers['Content-Encoding'] == encoding
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == 'W/"abc"'
+    assert int(response.headers['Content-Length']) < len(BODY)
+
+
+def test_compress_executor():
+    app = compressed_app(executor_size=0)
+
+    request, response = app.test_client.get(
+        '/text', headers={'Accept-Encoding': 'gzip'})
+    assert response.text == BODY
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_compress_identity():
+    app = compressed_app()
+
+    request, response = app.test_client.get(
+        '/text', headers={'Accept-Encoding': 'identity'})
+    assert response.text == BODY
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == '"abc"'
+
+
+@pytest.mark.parametrize('uri', ['/small', '/png'])
+def test_compress_skipped(uri):
+    app = compressed_app()
+
+    request, response = app.test_client.get(
+        uri, headers={'Accept-Encoding': 'gzip'})
+    assert response.status == 200
+    assert 'Content-Encoding' not in response.headers
+    assert 'Vary' not in response.headers
+
+
+def test_compress_skipped_partial():
+    app = compressed_app()
+
+    request, response = app.test_client.get(
+        '/partial', headers={'Accept-Encoding': 'gzip'})
+    assert response.status == 206
+    assert response.text == BODY
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compress_already_encoded():
+    app = compressed_app()
+
+    request, response = app.test_client.get(
+        '/encoded', headers={'Accept-Encoding': 'gzip'})
+    assert response.text == BODY
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_compress_levels():
+    compress = Compress(level=1)
+    data = BODY.encode()
+    assert gzip.decompress(compress.compress('gzip', data)) == data
+    assert zlib.decompress(compress.compress('deflate', data)) == data
+    assert len(compress.compress('gzip', data)) >= \
+        len(Compress(level=9).compress('gzip', data))
+
+
+# ------------------------------------------------------------ #
+#  StreamingHTTPResponse
+# ------------------------------------------------------------ #
+
+def test_compress_stream():
+    app = compressed_app()
+
+    request, response = app.test_client.get(
+        '/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.text == BODY
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Transfer-Encoding'] == 'chunked'
+
+
+def test_compress_json_stream():
+    app = compressed_app()
+
+    request, response = app.test_client.get(
+        '/json_stream', headers={'Accept-Encoding': 'deflate'})
+    assert response.json == list(range(1000))
+    assert response.headers['Content-Encoding'] == 'deflate'
+
+
+def test_compressor_flushes_chunks():
+    compressor = Compress().compressor('gzip')
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # every chunk can be decoded as soon as it is received
+    for chunk in (b'first ', b'second ', b'third'):
+        assert decompressor.decompress(compressor.compress(chunk)) == chunk
+    decompressor.decompress(compressor.finish())
+    assert decompressor.eof
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from pynecktie import Necktie
+from pynecktie.event_loop import EVENT_LOOP_POLICIES, get_event_loop_name, \
+    new_event_loop
+from pynecktie.response import text
+
+
+@pytest.fixture
+def restore_policy():
+    policy = asyncio.get_event_loop_policy()
+    yield
+    asyncio.set_event_loop_policy(policy)
+
+
+def test_get_event_loop_name_auto():
+    expected = 'uvloop' if 'uvloop' in EVENT_LOOP_POLICIES else 'asyncio'
+    assert get_event_loop_name('auto') == expected
+    assert get_event_loop_name('asyncio') == 'asyncio'
+
+
+def test_get_event_loop_name_unknown():
+    with pytest.raises(ValueError):
+        get_event_loop_name('tokio')
+
+
+@pytest.mark.parametrize('name', sorted(EVENT_LOOP_POLICIES))
+def test_new_event_loop(name, restore_policy):
+    loop = new_event_loop(name, executor_size=2, debug=False,
+                          slow_callback_duration=0.5)
+    try:
+        assert asyncio.get_event_loop_policy().__class__ is \
+            EVENT_LOOP_POLICIES[name]
+        assert type(loop).__module__.split('.')[0] == name
+        assert loop.get_debug() is False
+        assert loop.slow_callback_duration == 0.5
+        assert loop.run_until_complete(
+            loop.run_in_executor(None, sum, [1, 2])) == 3
+    finally:
+        loop.close()
+
+
+def test_new_event_loop_debug_from_setting(monkeypatch, restore_policy):
+    # PYTHONASYNCIODEBUG does not turn on debug mode for the server
+    monkeypatch.setenv('PYTHONASYNCIODEBUG', '1')
+    loop = new_event_loop('asyncio')
+    assert loop.get_debug() is False
+    loop.close()
+
+
+def test_app_event_loop_setting(restore_policy):
+    app = Necktie('test_app_event_loop_setting')
+    app.config.EVENT_LOOP = 'asyncio'
+    loops = []
+
+    @app.route('/')
+    async def handler(request):
+        loops.append(asyncio.get_event_loop())
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+    assert response.status == 200
+    assert isinstance(loops[0], asyncio.SelectorEventLoop)
+
+
+def test_app_event_loop_unknown():
+    app = Necktie('test_app_event_loop_unknown')
+    app.config.EVENT_LOOP = 'tokio'
+    with pytest.raises(ValueError):
+        app.run()
@@ -0,0 +1,91 @@
+import pytest
+from multidict import CIMultiDict, MultiMapping
+
+from pynecktie import Necktie
+from pynecktie.headers import Headers, accepted_encodings
+from pynecktie.response import json
+
+
+RAW_HEADERS = [
+    (b'Host', b'example.com'),
+    (b'Accept', b'text/html'),
+    (b'X-Custom', b'one'),
+    (b'x-custom', b'two'),
+    (b'X-Latin', 'caf\xe9'.encode('latin_1')),
+]
+
+
+def test_headers_lookup():
+    headers = Headers(list(RAW_HEADERS))
+
+    assert isinstance(headers, MultiMapping)
+    assert headers['host'] == 'example.com'
+    assert headers.get('HOST') == 'example.com'
+    assert headers.get('missing') is None
+    assert headers.get('missing', 'default') == 'default'
+    assert headers.getall('X-Custom') == ['one', 'two']
+    assert headers.getone('x-custom') == 'one'
+    assert headers['X-Latin'] == 'caf\xe9'
+    assert 'accept' in headers
+    assert 'missing' not in headers
+    assert len(headers) == 5
+
+    with pytest.raises(KeyError):
+        headers['missing']
+    with pytest.raises(KeyError):
+        headers.getall('missing')
+
+
+def test_headers_items():
+    headers = Headers(list(RAW_HEADERS))
+
+    assert list(headers.items()) == [
+        ('host', 'example.com'),
+        ('accept', 'text/html'),
+        ('x-custom', 'one'),
+        ('x-custom', 'two'),
+        ('x-latin', 'caf\xe9'),
+    ]
+    assert list(headers) == ['host', 'accept', 'x-custom', 'x-custom',
+                             'x-latin']
+    assert headers == CIMultiDict(headers.items())
+
+
+def test_headers_modification():
+    headers = Headers(list(RAW_HEADERS))
+    assert headers['accept'] == 'text/html'
+
+    headers['Accept'] = 'application/json'
+    headers.add('X-Custom', 'three')
+    del headers['host']
+
+    assert headers['accept'] == 'application/json'
+    assert headers.getall('x-custom') == ['one', 'two', 'three']
+    assert 'host' not in headers
+    assert len(headers) == 5
+
+
+def test_request_headers():
+    app = Necktie('test_request_headers')
+
+    @app.route('/')
+    async def handler(request):
+        return json({'custom': request.headers.getall('X-Custom'),
+                     'type': type(request.headers).__name__})
+
+    request, response = app.test_client.get(
+        '/', headers=[('X-Custom', 'one'), ('X-Custom', 'two')])
+
+    assert response.json == {'custom': ['one', 'two'], 'type': 'Headers'}
+    assert request.headers['x-custom'] == 'one'
+
+
+@pytest.mark.parametrize('accept_encoding,encodings', [
+    ('', set()),
+    ('gzip, deflate, br', {'br', 'gzip'}),
+    ('x-gzip;q=0.5', {'gzip'}),
+    ('br;q=0, *', {'gzip'}),
+    ('*;q=0', set()),
+])
+def test_accepted_encodings(accept_encoding, encodings):
+    assert accepted_encodings(accept_encoding, ('br', 'gzip')) == encodings
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7),
+                                reason='needs module __getattr__')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(code):
+    """Modules imported by `code`, in a new interpreter"""
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        code + '\nimport sys\nprint(" ".join(sorted(sys.modules)))'],
+        cwd=ROOT)
+    return set(output.decode().split())
+
+
+def test_import_package_only():
+    modules = imported_modules('import pynecktie')
+    assert 'pynecktie.app' not in modules
+    assert not any(name.split('.')[0] == 'sanic' for name in modules)
+
+
+@pytest.mark.parametrize('code', [
+    'import pynecktie.response',
+    'from pynecktie import Blueprint',
+])
+def test_import_without_app(code):
+    modules = imported_modules(code)
+    assert not modules & {'pynecktie.app', 'pynecktie.server',
+                          'pynecktie.testing', 'pynecktie.websocket'}
+
+
+def test_import_app_without_testing():
+    modules = imported_modules('from pynecktie import Necktie')
+    assert 'pynecktie.app' in modules
+    assert 'pynecktie.testing' not in modules
+    assert 'pynecktie.websocket' not in modules
+
+    modules = imported_modules('from pynecktie import Necktie\n'
+                               'Necktie("app").test_client')
+    assert 'pynecktie.testing' in modules
+
+
+def test_lazy_attributes():
+    import pynecktie
+    from pynecktie.app import Necktie
+
+    assert pynecktie.Necktie is Necktie
+    assert {'Necktie', 'Blueprint', '__version__'} <= set(dir(pynecktie))
+    with pytest.raises(AttributeError):
+        pynecktie.Sanic
@@ -0,0 +1,142 @@
+import pytest
+
+from pynecktie import Necktie
+from pynecktie.json_codec import JSON_CODECS, JSONCodec, get_codec
+from pynecktie.response import json, json_dumps, json_stream
+
+
+@pytest.mark.parametrize('name', sorted(JSON_CODECS))
+def test_codec_round_trip(name):
+    codec = get_codec(name)
+    data = {'text': 'café / ☃', 'number': 1.5, 'list': [1, None]}
+
+    encoded = codec.dumps(data)
+    assert isinstance(encoded, bytes)
+    assert codec.loads(encoded) == data
+    assert codec.loads(encoded.decode().encode()) == data
+
+
+@pytest.mark.parametrize('name', sorted(JSON_CODECS))
+def test_codec_integer_keys(name):
+    codec = get_codec(name)
+    assert codec.loads(codec.dumps({1: 'one'})) == {'1': 'one'}
+
+
+def test_get_codec_auto():
+    expected = [name for name in ('ujson', 'json')
+                if name in JSON_CODECS][0]
+    assert get_codec('auto').name == expected
+
+
+def test_default_output_unchanged():
+    data = {'text': 'café / ☃', 'list': [1, None], 1: 'one'}
+    assert json(data).body == json_dumps(data).encode()
+
+
+def test_get_codec_unknown():
+    with pytest.raises(ValueError):
+        get_codec('yaml')
+
+
+def test_get_codec_encoder_function():
+    def encode(obj):
+        return b'"encoded"'
+
+    codec = get_codec(encode)
+    assert isinstance(codec, JSONCodec)
+    assert codec.name == 'encode'
+    assert codec.dumps({}) == b'"encoded"'
+    assert codec.loads(b'[1]') == [1]
+
+
+def test_json_response_body_is_bytes():
+    response = json({'a': [1, 2]})
+    response.json_codec = get_codec('json')
+    assert response.body == b'{"a":[1,2]}'
+
+    response = json({'a': [1, 2]}, indent=1)
+    response.json_codec = get_codec('json')
+    assert response.body == b'{\n "a": [\n  1,\n  2\n ]\n}'
+
+
+def test_json_response_custom_dumps():
+    response = json({'a': 1}, dumps=lambda obj: 'custom')
+    assert response.body == b'custom'
+
+
+def test_app_json_encoder():
+    app = Necktie('test_app_json_encoder')
+    encoded = []
+
+    def encode(obj, **kwargs):
+        encoded.append(obj)
+        return b'{"encoded":true}'
+
+    app.config.JSON_ENCODER = encode
+
+    @app.route('/', methods=['POST'])
+    async def handler(request):
+        return json(request.json)
+
+    request, response = app.test_client.post('/', data='{"a": [1, 2]}')
+    assert request.json == {'a': [1, 2]}
+    assert encoded == [{'a': [1, 2]}]
+    assert response.json == {'encoded': True}
+
+
+def test_app_json_encoder_per_app():
+    def encoded_app(name, encoder):
+        app = Necktie(name)
+        app.config.JSON_ENCODER = encoder
+
+        @app.route('/')
+        async def handler(request):
+            return json({'a': 1})
+
+        @app.route('/stream')
+        async def stream_handler(request):
+            return json_stream([{'a': 1}])
+
+        return app
+
+    custom = encoded_app('test_json_custom', lambda obj: b'"custom"')
+    default = encoded_app('test_json_default', 'json')
+
+    request, response = custom.test_client.get('/')
+    assert response.text == '"custom"'
+    request, response = default.test_client.get('/')
+    assert response.text == '{"a":1}'
+    request, response = custom.test_client.get('/stream')
+    assert response.text == '["custom"]'
+    request, response = default.test_client.get('/stream')
+    assert response.text == '[{"a":1}]'
+
+
+def test_json_response_not_serializable():
+    app = Necktie('test_json_response_not_serializable')
+    handled = []
+
+    @app.route('/')
+    async def handler(request):
+        return json({'object': object()})
+
+    @app.exception(TypeError)
+    def type_error(request, exception):
+        handled.append(exception)
+        return json({'error': 'not serializable'}, status=500)
+
+    request, response = app.test_client.get('/')
+    assert response.status == 500
+    assert response.json == {'error': 'not serializable'}
+    assert len(handled) == 1
+
+
+def test_request_json_invalid():
+    app = Necktie('test_request_json_invalid')
+
+    @app.route('/', methods=['POST'])
+    async def handler(request):
+        return json(request.json)
+
+    request, response = app.test_client.post('/', data='{"a": ')
+    assert response.status == 400
@@ -0,0 +1,113 @@
+from pynecktie import Necktie, Blueprint
+from pynecktie.response import text
+
+
+# ------------------------------------------------------------ #
+#  Request / response middleware
+# ------------------------------------------------------------ #
+
+def test_middleware_sync_and_async():
+    app = Necktie('test_middleware_sync_and_async')
+    calls = []
+
+    @app.middleware('request')
+    def sync_request(request):
+        calls.append('sync_request')
+
+    @app.middleware('request')
+    async def async_request(request):
+        calls.append('async_request')
+
+    @app.middleware('response')
+    def sync_response(request, response):
+        calls.append('sync_response')
+
+    @app.middleware('response')
+    async def async_response(request, response):
+        calls.append('async_response')
+
+    @app.route('/')
+    async def handler(request):
+        calls.append('handler')
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+
+    assert response.text == 'OK'
+    assert calls == ['sync_request', 'async_request', 'handler',
+                     'async_response', 'sync_response']
+
+
+def test_middleware_short_circuit():
+    app = Necktie('test_middleware_short_circuit')
+
+    @app.middleware('request')
+    def halt_request(request):
+        return text('halted')
+
+    @app.middleware('response')
+    async def add_header(request, response):
+        response.headers['x-middleware'] = 'yes'
+
+    @app.route('/')
+    async def handler(request):
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+
+    assert response.text == 'halted'
+    assert response.headers['x-middleware'] == 'yes'
+
+
+def test_middleware_replaces_response():
+    app = Necktie('test_middleware_replaces_response')
+
+    @app.middleware('response')
+    def replace(request, response):
+        return text('replaced', status=201)
+
+    @app.route('/')
+    async def handler(request):
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+
+    assert response.status == 201
+    assert response.text == 'replaced'
+
+
+def test_blueprint_middleware():
+    app = Necktie('test_blueprint_middleware')
+    bp = Blueprint('test_blueprint_middleware')
+
+    @bp.middleware('request')
+    async def bp_request(request):
+        request['bp'] = True
+
+    @bp.route('/')
+    async def handler(request):
+        return text(str(request.get('bp')))
+
+    app.blueprint(bp)
+
+    request, response = app.test_client.get('/')
+
+    assert response.text == 'True'
+
+
+def test_middleware_registered_after_run():
+    app = Necktie('test_middleware_registered_after_run')
+
+    @app.route('/')
+    async def handler(request):
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+    assert 'x-late' not in response.headers
+
+    @app.middleware('response')
+    def late(request, response):
+        response.headers['x-late'] = 'yes'
+
+    request, response = app.test_client.get('/')
+    assert response.headers['x-late'] == 'yes'
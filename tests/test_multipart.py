@@ -0,0 +1,202 @@
+import asyncio
+import tracemalloc
+
+import pytest
+
+from pynecktie import Necktie
+from pynecktie.exceptions import InvalidUsage
+from pynecktie.multipart import MultipartParser, MultipartReader, \
+    read_multipart, PART_HEADERS, PART_DATA, PART_END, BODY_END
+from pynecktie.response import json
+
+BOUNDARY = '----necktie'
+HEADERS = {'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY}
+
+
+def multipart_body(*parts):
+    """Encode (headers, body) parts with the test boundary"""
+    lines = [b'preamble']
+    for headers, body in parts:
+        lines.append(b'--' + BOUNDARY.encode())
+        lines.extend(headers)
+        lines.append(b'')
+        lines.append(body)
+    lines.append(b'--' + BOUNDARY.encode() + b'--')
+    lines.append(b'epilogue')
+    return b'\r\n'.join(lines)
+
+
+FIELD = ([b'Content-Disposition: form-data; name="field"'], b'value')
+FILE = ([b'Content-Disposition: form-data; name="file"; filename="a.txt"',
+         b'Content-Type: text/csv'], b'a,b\r\n--\r\n1,2' * 100)
+
+
+def parse(body, chunk_size):
+    parser = MultipartParser(BOUNDARY)
+    events = []
+    for start in range(0, len(body), chunk_size):
+        events.extend(parser.feed(body[start:start + chunk_size]))
+    parser.close()
+    # join the data events, which depend on the chunk size
+    joined = []
+    for event, value in events:
+        if event == PART_DATA and joined and joined[-1][0] == PART_DATA:
+            joined[-1] = (PART_DATA, joined[-1][1] + value)
+        else:
+            joined.append((event, value))
+    return joined
+
+
+# ------------------------------------------------------------ #
+#  Parser
+# ------------------------------------------------------------ #
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 100000])
+def test_parser_chunks(chunk_size):
+    events = parse(multipart_body(FIELD, FILE), chunk_size)
+    assert events == [
+        (PART_HEADERS, {'content-disposition': 'form-data; name="field"'}),
+        (PART_DATA, b'value'),
+        (PART_END, None),
+        (PART_HEADERS, {
+            'content-disposition': 'form-data; name="file"; '
+                                   'filename="a.txt"',
+            'content-type': 'text/csv'}),
+        (PART_DATA, FILE[1]),
+        (PART_END, None),
+        (BODY_END, None),
+    ]
+
+
+def test_parser_empty_parts():
+    events = parse(multipart_body(([], b''), ([], b'')), 3)
+    assert events == [(PART_HEADERS, {}), (PART_END, None),
+                      (PART_HEADERS, {}), (PART_END, None),
+                      (BODY_END, None)]
+
+
+def test_parser_incomplete():
+    parser = MultipartParser(BOUNDARY)
+    parser.feed(multipart_body(FIELD)[:-20])
+    with pytest.raises(InvalidUsage):
+        parser.close()
+
+
+def test_parser_header_size():
+    parser = MultipartParser(BOUNDARY, max_header_size=100)
+    with pytest.raises(InvalidUsage):
+        parser.feed(multipart_body(([b'X-Large: ' + b'x' * 200], b'')))
+
+
+def test_parser_constant_memory():
+    async def read(stream):
+        size = 0
+        async for part in MultipartReader(request, BOUNDARY):
+            async for chunk in part:
+                size += len(chunk)
+        return size
+
+    class StreamRequest:
+        stream = asyncio.Queue()
+
+    request = StreamRequest()
+    chunk = b'x' * 65536
+    request.stream.put_nowait(
+        b'--' + BOUNDARY.encode() + b'\r\n'
+        b'Content-Disposition: form-data; name="file"; filename="big"\r\n'
+        b'\r\n')
+    for _ in range(320):
+        request.stream.put_nowait(chunk)
+    request.stream.put_nowait(b'\r\n--' + BOUNDARY.encode() + b'--\r\n')
+    request.stream.put_nowait(None)
+
+    loop = asyncio.new_event_loop()
+    tracemalloc.start()
+    try:
+        size = loop.run_until_complete(read(request))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        loop.close()
+    assert size == 320 * 65536
+    # the 20 MB upload passed through a few chunks worth of memory
+    assert peak < 1024 * 1024
+
+
+# ------------------------------------------------------------ #
+#  Routes
+# ------------------------------------------------------------ #
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_read_multipart(stream):
+    app = Necktie('test_read_multipart')
+    results = {}
+
+    @app.post('/upload', stream=stream)
+    async def upload(request):
+        fields, files = await read_multipart(request, spool_size=100)
+        upload = files.get('file')
+        results['rolled'] = upload.body._rolled
+        results['body'] = upload.body.read()
+        return json({'field': fields.get('field'), 'name': upload.name,
+                     'type': upload.type})
+
+    request, response = app.test_client.post(
+        '/upload', data=multipart_body(FIELD, FILE), headers=HEADERS)
+    assert response.status == 200
+    assert response.json == {'field': 'value', 'name': 'a.txt',
+                             'type': 'text/csv'}
+    assert results == {'rolled': True, 'body': FILE[1]}
+
+
+def test_multipart_reader_skips_parts():
+    app = Necktie('test_multipart_reader')
+
+    @app.post('/upload', stream=True)
+    async def upload(request):
+        names = []
+        async for part in MultipartReader(request):
+            names.append(part.name)
+            if part.name == 'field':
+                names.append(await part.text())
+        return json(names)
+
+    request, response = app.test_client.post(
+        '/upload', data=multipart_body(FILE, FIELD, FILE), headers=HEADERS)
+    assert response.json == ['file', 'field', 'value', 'file']
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_read_multipart_field_too_large(stream):
+    app = Necktie('test_read_multipart_field_too_large')
+
+    @app.post('/upload', stream=stream)
+    async def upload(request):
+        fields, files = await read_multipart(request, max_field_size=4)
+        return json(fields.get('field'))
+
+    request, response = app.test_client.post(
+        '/upload', data=multipart_body(FIELD, FILE), headers=HEADERS)
+    assert response.status == 413
+    # files are not limited by the field size
+    field = ([b'Content-Disposition: form-data; name="field"'], b'four')
+    request, response = app.test_client.post(
+        '/upload', data=multipart_body(field, FILE), headers=HEADERS)
+    assert response.json == 'four'
+
+
+@pytest.mark.parametrize('body,headers', [
+    (multipart_body(FIELD)[:-30], HEADERS),
+    (b'field=value', {'Content-Type': 'application/x-www-form-urlencoded'}),
+])
+def test_read_multipart_invalid(body, headers):
+    app = Necktie('test_read_multipart_invalid')
+
+    @app.post('/upload', stream=True)
+    async def upload(request):
+        await read_multipart(request)
+        return json(None)
+
+    request, response = app.test_client.post('/upload', data=body,
+                                             headers=headers)
+    assert response.status == 400
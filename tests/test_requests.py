@@ -1,3 +1,4 @@
+import asyncio
 from json import loads as json_loads, dumps as json_dumps
 from urllib.parse import urlparse
 import os
@@ -8,7 +9,9 @@ import pytest
 from pynecktie import Necktie
 from pynecktie.exceptions import ServerError
 from pynecktie.response import json, text
-from pynecktie.request import DEFAULT_HTTP_CONTENT_TYPE
+from pynecktie.headers import Headers
+from pynecktie.request import DEFAULT_HTTP_CONTENT_TYPE, Request, \
+    RequestParameters, RequestStream
 from pynecktie.testing import HOST
 
 
@@ -379,3 +382,153 @@ def test_url_attributes_with_ssl(path, query, expected_url):
     assert parsed.path == request.path
     assert parsed.query == request.query_string
     assert parsed.netloc == request.host
+
+
+# ------------------------------------------------------------ #
+#  Lazy parsing
+# ------------------------------------------------------------ #
+
+def make_request(url=b'/?a=1&b=2', headers=(), body=b''):
+    request = Request(url, Headers(list(headers)), '1.1', 'POST', None)
+    request.body = body
+    return request
+
+
+def test_request_slots():
+    request = make_request()
+    assert not hasattr(request, '__dict__')
+    with pytest.raises(AttributeError):
+        request.custom = True
+    request['custom'] = True
+    assert request['custom'] is True
+
+
+def test_request_parsed_on_access():
+    request = make_request(headers=[(b'Cookie', b'session=abc')])
+    assert request.parsed_args is None
+    assert request.args == {'a': ['1'], 'b': ['2']}
+    assert isinstance(request.args, RequestParameters)
+    assert request.args is request.args
+    # the other values are parsed on their own
+    assert request._cookies is None
+    assert request.parsed_form is None
+    assert request.parsed_json is None
+
+    assert request.cookies == {'session': 'abc'}
+    assert request.cookies is request.cookies
+    assert request.parsed_form is None
+
+
+def test_request_json_parsed_once():
+    loads = []
+
+    def counting_loads(data):
+        loads.append(data)
+        return json_loads(data.decode())
+
+    request = make_request(body=b'null')
+    assert request.load_json(loads=counting_loads) is None
+    assert request.json is None
+    assert request.json is None
+    assert loads == [b'null']
+
+
+def test_request_form_and_files():
+    request = make_request(
+        headers=[(b'Content-Type', b'application/x-www-form-urlencoded')],
+        body=b'name=necktie&name=bowtie')
+    assert request.files == {}
+    assert request.form.getlist('name') == ['necktie', 'bowtie']
+    assert request.form is request.form
+
+
+def test_request_bytearray_body():
+    # bodies received in several chunks are a bytearray
+    request = make_request(
+        headers=[(b'Content-Type', b'multipart/form-data; boundary=bb')],
+        body=bytearray(b'--bb\r\n'
+                       b'Content-Disposition: form-data; name="a"; '
+                       b'filename="a.txt"\r\n\r\nfile\r\n'
+                       b'--bb\r\n'
+                       b'Content-Disposition: form-data; name="b"\r\n'
+                       b'\r\nfield\r\n--bb--\r\n'))
+    assert request.form.get('b') == 'field'
+    assert request.files.get('a').body == b'file'
+    assert type(request.files.get('a').body) is bytes
+
+    request = make_request(body=bytearray(b'{"a": [1, 2]}'))
+    assert request.json == {'a': [1, 2]}
+
+
+# ------------------------------------------------------------ #
+#  Request stream
+# ------------------------------------------------------------ #
+
+def run_stream(coroutine_fn, chunks, **kwargs):
+    loop = asyncio.new_event_loop()
+    stream = RequestStream(loop, **kwargs)
+
+    async def feed():
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            stream.feed_data(chunk)
+        stream.feed_eof()
+
+    try:
+        feeder = loop.create_task(feed())
+        result = loop.run_until_complete(coroutine_fn(stream))
+        loop.run_until_complete(feeder)
+    finally:
+        loop.close()
+    return result
+
+
+def test_request_stream_read():
+    async def read(stream):
+        return [await stream.read(3), await stream.readexactly(5),
+                await stream.read(), await stream.read(), await stream.get()]
+
+    assert run_stream(read, [b'abcd', b'ef', b'ghijk']) == \
+        [b'abc', b'defgh', b'ijk', b'', None]
+
+
+def test_request_stream_incomplete_read():
+    async def read(stream):
+        with pytest.raises(asyncio.IncompleteReadError) as error:
+            await stream.readexactly(10)
+        return error.value.partial
+
+    assert run_stream(read, [b'abc', b'def']) == b'abcdef'
+
+
+def test_request_stream_iteration():
+    async def read(stream):
+        return [chunk async for chunk in stream]
+
+    assert run_stream(read, [b'one', b'two']) == [b'one', b'two']
+
+
+def test_request_stream_water_marks():
+    calls = []
+    stream = RequestStream(asyncio.new_event_loop(), high_water=10,
+                           low_water=4,
+                           pause_reading=lambda: calls.append('pause'),
+                           resume_reading=lambda: calls.append('resume'))
+    stream.feed_data(b'x' * 6)
+    stream.feed_data(b'x' * 6)
+    stream.feed_data(b'x' * 6)
+    assert calls == ['pause']
+    assert len(stream) == 18
+
+    async def read(n):
+        return await stream.readexactly(n)
+
+    stream._loop.run_until_complete(read(12))
+    assert calls == ['pause']
+    stream._loop.run_until_complete(read(2))
+    assert calls == ['pause', 'resume']
+
+    stream.discard()
+    stream.feed_data(b'dropped')
+    assert len(stream) == 0
+    stream._loop.close()
@@ -1,6 +1,7 @@
 import asyncio
 import inspect
 import os
+import time
 from aiofiles import os as async_os
 from mimetypes import guess_type
 from urllib.parse import unquote
@@ -9,7 +10,11 @@ import pytest
 from random import choice
 
 from pynecktie import Necktie
-from pynecktie.response import HTTPResponse, stream, StreamingHTTPResponse, file, file_stream, json
+from pynecktie import response as response_module
+from pynecktie.response import HTTPResponse, stream, StreamingHTTPResponse, \
+    file, file_stream, json, raw, text
+from pynecktie.response import COALESCE_BODY_SIZE, json_stream, \
+    update_date_header
 from pynecktie.testing import HOST
 from unittest.mock import MagicMock
 
@@ -30,6 +35,99 @@ def test_response_body_not_a_string():
     assert response.text == str(random_num)
 
 
+def test_output_buffers_small_body_coalesced():
+    response = text('hello')
+    buffers = response.output_buffers('1.1', True, 5)
+
+    assert len(buffers) == 1
+    assert buffers[0] == text('hello').output('1.1', True, 5)
+    assert buffers[0].endswith(b'\r\n\r\nhello')
+
+
+def test_output_buffers_large_body_not_copied():
+    body = b'x' * (COALESCE_BODY_SIZE + 1)
+    response = raw(body)
+    head, view = response.output_buffers('1.1', False)
+
+    assert isinstance(view, memoryview)
+    assert view.obj is body
+    assert head + view == raw(body).output('1.1', False)
+    assert b'Content-Length: %d\r\n' % len(body) in head
+
+
+def test_output_buffers_no_body_status():
+    response = raw(b'x' * (COALESCE_BODY_SIZE + 1), status=304)
+    buffers = response.output_buffers('1.1', False)
+
+    assert len(buffers) == 1
+    assert buffers[0].endswith(b'\r\n\r\n')
+
+
+def test_output_headers():
+    update_date_header(0)
+    output = text('hello', status=201).output('1.1', True, 5)
+    head, body = output.split(b'\r\n\r\n')
+
+    lines = head.split(b'\r\n')
+    assert lines[0] == b'HTTP/1.1 201 Created'
+    assert sorted(lines[1:]) == [
+        b'Connection: keep-alive',
+        b'Content-Length: 5',
+        b'Content-Type: text/plain; charset=utf-8',
+        b'Date: Thu, 01 Jan 1970 00:00:00 GMT',
+        b'Keep-Alive: 5',
+    ]
+    assert body == b'hello'
+    update_date_header()
+
+
+def test_output_date_header_refreshed_without_tick(monkeypatch):
+    update_date_header(0)
+    # not updated by update_current_time for more than a second
+    monkeypatch.setattr(response_module, '_date_header_time', time.time() - 2)
+    output = text('hello').output('1.1', False)
+
+    assert b'Date: ' in output
+    assert b'1970' not in output
+
+
+def test_output_headers_set_by_handler_not_repeated():
+    response = raw(b'hello', status=299, headers={
+        'Content-Type': 'text/html', 'Content-Length': 5,
+        'Date': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+    output = response.output('1.0', False)
+
+    assert output.startswith(b'HTTP/1.0 299 UNKNOWN RESPONSE\r\n')
+    assert output.count(b'Content-Type') == 1
+    assert output.count(b'Content-Length') == 1
+    assert output.count(b'Date') == 1
+    assert b'Connection: close\r\n' in output
+
+
+def test_date_header_sent():
+    app = Necktie('test_date_header_sent')
+
+    @app.route('/')
+    async def handler(request):
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+    assert response.headers['Date'].endswith(' GMT')
+
+
+def test_large_response_body():
+    app = Necktie('test_large_response_body')
+    data = {'items': ['x' * 100] * 20000}
+
+    @app.route('/')
+    async def handler(request):
+        return json(data)
+
+    request, response = app.test_client.get('/')
+    assert response.status == 200
+    assert response.json == data
+
+
 async def sample_streaming_fn(response):
     response.write('foo,')
     await asyncio.sleep(.001)
@@ -143,6 +241,69 @@ def test_stream_response_writes_correct_content_to_transport(streaming_app):
     streaming_app.run(host=HOST, port=streaming_app.test_port)
 
 
+def test_json_stream_array():
+    app = Necktie('test_json_stream_array')
+
+    @app.route('/')
+    async def handler(request):
+        async def items():
+            for i in range(1000):
+                yield {'id': i}
+        return json_stream(items(), flush_size=100)
+
+    request, response = app.test_client.get('/')
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response.headers['Transfer-Encoding'] == 'chunked'
+    assert response.json == [{'id': i} for i in range(1000)]
+
+
+def test_json_stream_ndjson():
+    app = Necktie('test_json_stream_ndjson')
+
+    @app.route('/')
+    async def handler(request):
+        return json_stream(({'id': i} for i in range(3)), ndjson=True)
+
+    request, response = app.test_client.get('/')
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    assert response.text == '{"id":0}\n{"id":1}\n{"id":2}\n'
+
+
+def test_json_stream_empty():
+    app = Necktie('test_json_stream_empty')
+
+    @app.route('/')
+    async def handler(request):
+        return json_stream([])
+
+    request, response = app.test_client.get('/')
+    assert response.json == []
+
+
+def test_json_stream_flushes_and_drains():
+    chunks = []
+    drained = []
+
+    class Transport:
+        def write(self, data):
+            chunks.append(data)
+
+        async def drain(self):
+            drained.append(len(chunks))
+
+    response = json_stream(list(range(100)), flush_size=50)
+    response.transport = Transport()
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(response.streaming_fn(response))
+    loop.close()
+
+    body = b''.join(chunk.split(b'\r\n')[1] for chunk in chunks)
+    assert body == b'[' + b','.join(b'%d' % i for i in range(100)) + b']'
+    assert all(len(chunk) < 100 for chunk in chunks)
+    # The response waited for the client after every full chunk
+    assert drained == list(range(1, len(chunks)))
+
+
 @pytest.fixture
 def static_file_directory():
     """The static directory to serve"""
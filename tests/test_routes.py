@@ -0,0 +1,331 @@
+import pytest
+
+from pynecktie import Necktie
+from pynecktie.exceptions import MethodNotSupported, NotFound
+from pynecktie.response import text
+from pynecktie.router import Router, TrieRouter, RouteCache, RouteExists, \
+    url_hash
+
+
+def handler(request, *args, **kwargs):
+    pass
+
+
+# ------------------------------------------------------------ #
+#  Router lookups
+# ------------------------------------------------------------ #
+
+def test_router_static_and_dynamic_lookup():
+    router = Router()
+    router.add('/static', ['GET'], handler)
+    router.add('/user/<id:int>', ['GET'], handler)
+
+    assert router._get('/static', 'GET', '') == \
+        (handler, [], {}, '/static')
+    assert router._get('/user/12', 'GET', '') == \
+        (handler, [], {'id': 12}, '/user/<id:int>')
+
+
+def test_router_not_found():
+    router = Router()
+    router.add('/static', ['GET'], handler)
+
+    with pytest.raises(NotFound):
+        router._get('/missing', 'GET', '')
+
+
+@pytest.mark.parametrize('url', ['/static', '/user/12'])
+def test_router_method_not_supported(url):
+    router = Router()
+    router.add('/static', ['GET', 'POST'], handler)
+    router.add('/user/<id:int>', ['GET', 'POST'], handler)
+
+    with pytest.raises(MethodNotSupported) as excinfo:
+        router._get(url, 'DELETE', '')
+    assert excinfo.value.headers['Content-Length'] == 0
+
+
+def test_method_not_supported_allow_header():
+    app = Necktie('test_method_not_supported_allow_header')
+
+    @app.route('/', methods=['GET', 'POST'])
+    async def handler(request):
+        return text('OK')
+
+    request, response = app.test_client.put('/')
+
+    assert response.status == 405
+    assert set(response.headers['Allow'].split(', ')) == {'GET', 'POST'}
+
+
+# ------------------------------------------------------------ #
+#  Route cache
+# ------------------------------------------------------------ #
+
+def test_route_cache_counters():
+    cache = RouteCache(maxsize=2)
+
+    assert cache.get('a') is None
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    assert cache.get('a') == 1
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+
+
+def test_route_cache_keeps_frequent_entries():
+    cache = RouteCache(maxsize=8)
+    hot = ['hot{}'.format(i) for i in range(8)]
+    for _ in range(3):
+        for key in hot:
+            if cache.get(key) is None:
+                cache.put(key, key)
+
+    # One-hit keys mixed into the traffic must not flush out the hot
+    # entries
+    hot_hits = 0
+    for i in range(1000):
+        key = hot[i % len(hot)]
+        if cache.get(key) is None:
+            cache.put(key, key)
+        else:
+            hot_hits += 1
+        key = 'cold{}'.format(i)
+        if cache.get(key) is None:
+            cache.put(key, key)
+
+    assert hot_hits > 900
+    assert cache.info().rejections > 900
+
+
+def test_route_cache_eviction():
+    cache = RouteCache(maxsize=1)
+    cache.get('a')
+    cache.put('a', 1)
+    for _ in range(3):
+        cache.get('b')
+    cache.put('b', 2)
+
+    assert cache.get('b') == 2
+    assert cache.get('a') is None
+    assert cache.info().evictions == 1
+
+
+def test_router_uses_cache():
+    app = Necktie('test_router_uses_cache')
+
+    @app.route('/user/<id:int>')
+    async def handler(request, id):
+        return text('OK')
+
+    for _ in range(2):
+        request, response = app.test_client.get('/user/1')
+        assert response.status == 200
+
+    info = app.router.cache.info()
+    assert info.hits == 1
+    assert info.misses == 1
+
+
+def test_router_cache_size_config():
+    app = Necktie('test_router_cache_size_config')
+    app.config.ROUTER_CACHE_SIZE = 0
+
+    @app.route('/')
+    async def handler(request):
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+
+    assert response.status == 200
+    assert app.router.cache.info().maxsize == 0
+    assert app.router.cache.info().currsize == 0
+
+
+# ------------------------------------------------------------ #
+#  Route table freezing
+# ------------------------------------------------------------ #
+
+def test_router_merges_dynamic_routes():
+    router = Router()
+    router.add('/user/<id:int>', ['GET'], handler)
+    router.add('/user/<id:int>', ['POST'], lambda request, id: None)
+
+    route = router.routes_all['/user/<id:int>']
+    assert route.methods == {'GET', 'POST'}
+    assert route in router.routes_dynamic[url_hash('/user/<id:int>')]
+    # the merged routes replace the originals, with and without the
+    # trailing slash
+    assert sum(len(routes) for routes in router.routes_dynamic.values()) == 2
+    assert router._get('/user/1', 'GET', '')[0] is handler
+    with pytest.raises(RouteExists):
+        router.add('/user/<id:int>', ['GET'], handler)
+
+
+def test_router_freeze():
+    router = Router()
+    router.add('/user/<id:int>', ['GET'], handler)
+    router.freeze()
+    router.freeze()
+
+    assert router.frozen
+    assert router._get('/user/1', 'GET', '')[2] == {'id': 1}
+    with pytest.raises(RuntimeError):
+        router.add('/static', ['GET'], handler)
+    with pytest.raises(RuntimeError):
+        router.remove('/user/<id:int>')
+
+    router.unfreeze()
+    router.add('/static', ['GET'], handler)
+    assert router._get('/static', 'GET', '')[0] is handler
+
+
+@pytest.mark.parametrize('methods', [['GET'], ['GET', 'POST'], None])
+def test_router_freeze_conflict(methods):
+    router = Router()
+    router.add('/user/<id:int>', ['GET'], handler)
+    router.add('/user/<name:int>', methods, handler)
+
+    with pytest.raises(RouteExists):
+        router.freeze()
+    assert not router.frozen
+
+
+def test_router_freeze_no_conflict():
+    router = Router()
+    router.add('/user/<id:int>', ['GET'], handler)
+    router.add('/user/<name:int>', ['POST'], handler)
+    router.freeze()
+    assert router.frozen
+
+
+def test_trie_router_freeze():
+    router = TrieRouter()
+    router.add('/user/<id:int>', ['GET'], handler)
+    router.freeze()
+
+    assert router._trie is not None
+    assert router._get('/user/1', 'GET', '')[2] == {'id': 1}
+
+
+def test_app_freezes_router():
+    app = Necktie('test_app_freezes_router')
+    frozen = []
+
+    @app.route('/')
+    async def handler(request):
+        frozen.append(app.router.frozen)
+        return text('OK')
+
+    request, response = app.test_client.get('/')
+
+    assert response.status == 200
+    assert frozen == [True]
+    assert not app.router.frozen
+
+
+# ------------------------------------------------------------ #
+#  TrieRouter
+# ------------------------------------------------------------ #
+
+TRIE_ROUTES = [
+    ('/', ['GET']),
+    ('/a', ['GET', 'POST']),
+    ('/a/<x>', ['GET']),
+    ('/a/<x:int>', ['POST']),
+    ('/a/<y:int>', ['GET']),
+    ('/a/b', ['GET']),
+    ('/a/<x>/c', ['GET']),
+    ('/a/b/<z:number>', ['PUT']),
+    ('/f/<p:path>', ['GET']),
+    ('/f/<x>/e', ['POST']),
+    ('/u/<id:uuid>', ['GET']),
+    ('/n/<a>-<b:int>.json', ['GET']),
+    ('/v1.0/<x>', ['GET']),
+    ('/al/<x:alpha>', ['GET']),
+    ('/al/<x:[0-9]{2}>', ['GET']),
+    ('/a/<x>', ['DELETE']),
+]
+
+TRIE_URLS = [
+    '/', '/a', '/a/', '/a/1', '/a/xx', '/a/b', '/a/b/', '/a/1/c', '/a/b/c',
+    '/a/b/1.5', '/f/a/b/c', '/f/q/e',
+    '/u/12345678-1234-1234-1234-123456789012', '/n/foo-12.json',
+    '/n/foo-x.json', '/v1.0/z', '/v1x0/z', '/al/ab', '/al/12', '/al/1',
+    '/missing', '/a//c',
+]
+
+
+def lookup(router, url, method):
+    try:
+        return router._get(url, method, '')
+    except NotFound:
+        return NotFound
+    except MethodNotSupported as e:
+        return MethodNotSupported, e.headers['Allow']
+
+
+@pytest.mark.parametrize('url', TRIE_URLS)
+def test_trie_router_matches_router(url):
+    handlers = [lambda request, **kwargs: None for _ in TRIE_ROUTES]
+    routers = Router(), TrieRouter()
+    for router in routers:
+        for handler, (uri, methods) in zip(handlers, TRIE_ROUTES):
+            router.add(uri, methods, handler)
+
+    for method in ('GET', 'POST', 'PUT', 'DELETE'):
+        assert lookup(routers[1], url, method) == \
+            lookup(routers[0], url, method)
+
+
+MULTI_SEGMENT_ROUTES = [
+    ('/files/<user>/<rest:.+>', ['GET']),
+    ('/files/<user>/<rest:.+>/raw', ['POST']),
+    ('/files/<user>/list', ['GET']),
+    ('/docs/<page:[a-z/]+>', ['GET']),
+    ('/docs/<page:[a-z]+>', ['GET', 'POST']),
+    ('/tree/<id:int>/<rest:.*>', ['GET']),
+    ('/x<rest:.+>', ['GET']),
+]
+
+MULTI_SEGMENT_URLS = [
+    '/files/bob/a', '/files/bob/a/b/c', '/files/bob/a/b/c/raw',
+    '/files/bob/list', '/files/bob/', '/docs/intro', '/docs/a/b',
+    '/docs/a/b/', '/tree/1/', '/tree/1/a/b', '/tree/x/a', '/xy/z', '/x',
+]
+
+
+@pytest.mark.parametrize('url', MULTI_SEGMENT_URLS)
+def test_trie_router_multi_segment_parameters(url):
+    handlers = [lambda request, **kwargs: None for _ in MULTI_SEGMENT_ROUTES]
+    routers = Router(), TrieRouter()
+    for router in routers:
+        for handler, (uri, methods) in zip(handlers, MULTI_SEGMENT_ROUTES):
+            router.add(uri, methods, handler)
+
+    for method in ('GET', 'POST'):
+        assert lookup(routers[1], url, method) == \
+            lookup(routers[0], url, method)
+
+
+def test_trie_router_remove():
+    router = TrieRouter()
+    router.add('/user/<id:int>', ['GET'], handler)
+    assert router._get('/user/1', 'GET', '')[2] == {'id': 1}
+
+    router.remove('/user/<id:int>')
+    with pytest.raises(NotFound):
+        router._get('/user/2', 'GET', '')
+
+
+def test_trie_router_app():
+    app = Necktie('test_trie_router_app', router=TrieRouter())
+
+    @app.route('/user/<id:int>/<action>')
+    async def handler(request, id, action):
+        return text('{} {} {}'.format(id, action, request.uri_template))
+
+    request, response = app.test_client.get('/user/42/edit')
+
+    assert response.text == '42 edit /user/<id:int>/<action>'
@@ -0,0 +1,1016 @@
+import asyncio
+import gc
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing import Process
+
+import pytest
+
+from pynecktie import Necktie
+from pynecktie.handlers import ErrorHandler
+from pynecktie.response import json, stream, text
+from pynecktie.server import HttpProtocol, TimerWheel, worker_metrics, \
+    worker_cpus, serve_multiple, process_rss, SO_REUSEPORT, WorkerManager, \
+    WorkerMetrics, _MeteredTransport
+from pynecktie.testing import PORT
+
+
+# ------------------------------------------------------------ #
+#  Worker metrics
+# ------------------------------------------------------------ #
+
+def test_worker_metrics_count_requests():
+    app = Necktie('test_worker_metrics_count_requests')
+
+    @app.route('/', methods=['POST'])
+    async def handler(request):
+        return text('OK')
+
+    @app.route('/metrics')
+    async def metrics(request):
+        return json(worker_metrics.snapshot())
+
+    worker_metrics.reset()
+    # A body large enough to arrive in several chunks
+    payload = 'x' * 2 ** 20
+    request, response = app.test_client.post('/', data=payload)
+    assert response.text == 'OK'
+
+    request, response = app.test_client.get('/metrics')
+    assert response.json['requests'] == 2
+    assert response.json['bytes_in'] > len(payload)
+    assert response.json['bytes_out'] > 0
+
+
+def test_worker_metrics_count_streamed_bytes():
+    app = Necktie('test_worker_metrics_count_streamed_bytes')
+
+    @app.route('/')
+    async def handler(request):
+        async def streaming(response):
+            response.write('x' * 1000)
+        return stream(streaming)
+
+    worker_metrics.reset()
+    request, response = app.test_client.get('/')
+
+    assert response.text == 'x' * 1000
+    assert worker_metrics.bytes_out > 1000
+
+
+# ------------------------------------------------------------ #
+#  Timer wheel
+# ------------------------------------------------------------ #
+
+def test_timer_wheel_fires_after_delay():
+    wheel = TimerWheel(size=8)
+    fired = []
+    wheel.call_later(3, fired.append, 'a')
+    wheel.call_later(0.5, fired.append, 'b')
+
+    wheel.tick()
+    assert fired == ['b']
+    wheel.tick()
+    assert fired == ['b']
+    wheel.tick()
+    assert fired == ['b', 'a']
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_delay_longer_than_wheel():
+    wheel = TimerWheel(size=4)
+    fired = []
+    wheel.call_later(10, fired.append, 'a')
+
+    for _ in range(9):
+        wheel.tick()
+    assert fired == []
+    wheel.tick()
+    assert fired == ['a']
+
+
+def test_timer_wheel_cancel():
+    wheel = TimerWheel(size=8)
+    fired = []
+    timer = wheel.call_later(1, fired.append, 'a')
+    timer.cancel()
+    # Cancelling twice is harmless, as it is for asyncio handles
+    timer.cancel()
+
+    wheel.tick()
+    assert fired == []
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_rearm_from_callback():
+    wheel = TimerWheel(size=8)
+    fired = []
+
+    def callback():
+        fired.append(wheel.ticks)
+        if len(fired) < 3:
+            wheel.call_later(2, callback)
+
+    wheel.call_later(2, callback)
+    for _ in range(8):
+        wheel.tick()
+    assert fired == [2, 4, 6]
+
+
+def test_timer_wheel_callback_exception_does_not_stop_tick():
+    wheel = TimerWheel(size=8)
+    fired = []
+    wheel.call_later(1, lambda: 1 / 0)
+    wheel.call_later(1, fired.append, 'a')
+
+    wheel.tick()
+    assert fired == ['a']
+
+
+def test_server_closes_idle_keep_alive_connection():
+    app = Necktie('test_server_closes_idle_keep_alive_connection')
+    app.config.KEEP_ALIVE_TIMEOUT = 1
+    results = []
+
+    @app.route('/')
+    async def handler(request):
+        return text('OK')
+
+    @app.listener('after_server_start')
+    async def idle_client(app, loop):
+        reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+        writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        results.append(await reader.readuntil(b'\r\n\r\nOK'))
+        # The keep-alive timeout closes the connection on a wheel tick
+        results.append(await asyncio.wait_for(reader.read(), 5))
+        writer.close()
+        app.stop()
+
+    app.run(host='127.0.0.1', port=PORT)
+
+    assert results[0].startswith(b'HTTP/1.1 200 OK')
+    assert results[1] == b''
+
+
+# ------------------------------------------------------------ #
+#  Pipelining
+# ------------------------------------------------------------ #
+
+def pipelined_exchange(app, payload, until):
+    results = []
+
+    @app.listener('after_server_start')
+    async def pipelining_client(app, loop):
+        reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+        writer.write(payload)
+        data = b''
+        try:
+            while data.count(until[0]) < until[1]:
+                chunk = await asyncio.wait_for(reader.read(65536), 5)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            writer.close()
+            results.append(data)
+            app.stop()
+
+    app.run(host='127.0.0.1', port=PORT)
+    return results[0]
+
+
+def pipelined_request(path, headers=''):
+    return 'GET {} HTTP/1.1\r\nHost: localhost\r\n{}\r\n'.format(
+        path, headers).encode()
+
+
+def response_bodies(data):
+    return [part.split(b'\r\n\r\n', 1)[1]
+            for part in data.split(b'HTTP/1.1 ')[1:]]
+
+
+def test_pipelined_requests_answered_in_order():
+    app = Necktie('test_pipelined_requests_answered_in_order')
+
+    @app.route('/<name>')
+    async def handler(request, name):
+        return text(name)
+
+    payload = b''.join(pipelined_request('/' + name)
+                       for name in ('one', 'two', 'three'))
+    data = pipelined_exchange(app, payload, (b'HTTP/1.1 200', 3))
+
+    assert response_bodies(data) == [b'one', b'two', b'three']
+
+
+def test_pipelined_requests_concurrent_handlers():
+    app = Necktie('test_pipelined_requests_concurrent_handlers')
+    app.config.PIPELINE_CONCURRENCY = 4
+    finished = []
+
+    @app.route('/<delay:number>')
+    async def handler(request, delay):
+        await asyncio.sleep(delay)
+        finished.append(delay)
+        return text(str(delay))
+
+    payload = b''.join(pipelined_request('/' + delay)
+                       for delay in ('0.2', '0.1', '0.0'))
+    data = pipelined_exchange(app, payload, (b'HTTP/1.1 200', 3))
+
+    # Handlers ran at the same time, responses are still in request order
+    assert finished == [0, 0.1, 0.2]
+    assert response_bodies(data) == [b'0.2', b'0.1', b'0.0']
+
+
+def test_pipelined_request_closing_connection():
+    app = Necktie('test_pipelined_request_closing_connection')
+
+    @app.route('/<name>')
+    async def handler(request, name):
+        return text(name)
+
+    payload = (pipelined_request('/one') +
+               pipelined_request('/two', 'Connection: close\r\n') +
+               pipelined_request('/three'))
+    data = pipelined_exchange(app, payload, (b'HTTP/1.1 200', 3))
+
+    assert response_bodies(data) == [b'one', b'two']
+
+
+def test_pipelined_requests_with_body_and_stream():
+    app = Necktie('test_pipelined_requests_with_body_and_stream')
+
+    @app.route('/echo', methods=['POST'])
+    async def echo(request):
+        return text(request.body.decode())
+
+    @app.route('/stream')
+    async def streaming(request):
+        async def body(response):
+            response.write('streamed')
+        return stream(body)
+
+    body = 'x' * 100
+    payload = (
+        'POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+        'Content-Length: {}\r\n\r\n{}'.format(len(body), body).encode() +
+        pipelined_request('/stream') +
+        pipelined_request('/stream'))
+    data = pipelined_exchange(app, payload, (b'0\r\n\r\n', 2))
+
+    assert data.count(b'HTTP/1.1 200') == 3
+    assert data.index(body.encode()) < data.index(b'streamed')
+    assert data.count(b'streamed') == 2
+
+
+# ------------------------------------------------------------ #
+#  Request bodies
+# ------------------------------------------------------------ #
+
+def body_exchange(app, pieces):
+    """Send a request in pieces, so that its body is received in chunks"""
+    results = []
+
+    @app.listener('after_server_start')
+    async def client(app, loop):
+        reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+        try:
+            for piece in pieces:
+                writer.write(piece)
+                await writer.drain()
+                await asyncio.sleep(0.02)
+            results.append(await asyncio.wait_for(reader.read(65536), 5))
+        finally:
+            writer.close()
+            app.stop()
+
+    app.run(host='127.0.0.1', port=PORT)
+    return results[0]
+
+
+def body_app(name, received):
+    app = Necktie(name)
+
+    @app.post('/echo')
+    async def echo(request):
+        received.append(request.body)
+        return json(request.json)
+
+    return app
+
+
+def test_request_body_preallocated():
+    received = []
+    app = body_app('test_request_body_preallocated', received)
+    body = ('{"data": "' + 'x' * 10000 + '"}').encode()
+    head = ('POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+            'Content-Length: {}\r\n\r\n'.format(len(body))).encode()
+    data = body_exchange(app, [head, body[:100], body[100:5000],
+                               body[5000:]])
+
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    # the chunks were written into a single buffer of the body's size
+    assert type(received[0]) is bytearray
+    assert received[0] == body
+
+
+def test_request_body_larger_than_preallocated():
+    received = []
+    app = body_app('test_request_body_larger_than_preallocated', received)
+    app.config.REQUEST_BODY_PREALLOCATE = 65536
+    body = ('{"data": "' + 'x' * 200000 + '"}').encode()
+    head = ('POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+            'Content-Length: {}\r\n\r\n'.format(len(body))).encode()
+    data = body_exchange(app, [head, body[:100], body[100:100000],
+                               body[100000:]])
+
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    assert type(received[0]) is bytearray
+    assert received[0] == body
+
+
+def test_request_body_single_chunk():
+    received = []
+    app = body_app('test_request_body_single_chunk', received)
+    body = b'{"data": 1}'
+    data = body_exchange(app, [
+        'POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+        'Content-Length: {}\r\n\r\n'.format(len(body)).encode() + body])
+
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    # used as it is, without a copy
+    assert received == [body]
+    assert type(received[0]) is bytes
+
+
+def test_request_body_chunked():
+    received = []
+    app = body_app('test_request_body_chunked', received)
+    pieces = [b'POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+              b'Transfer-Encoding: chunked\r\n\r\n']
+    parts = [b'{"data": "', b'x' * 3000, b'y' * 7000, b'"}']
+    for part in parts:
+        pieces.append('{:x}\r\n'.format(len(part)).encode() +
+                      part + b'\r\n')
+    pieces.append(b'0\r\n\r\n')
+    data = body_exchange(app, pieces)
+
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    assert received == [b''.join(parts)]
+    assert type(received[0]) is bytearray
+
+
+class FakeTransport:
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def writelines(self, data):
+        self.written.extend(data)
+
+    def close(self):
+        self.closed = True
+
+    def is_closing(self):
+        return self.closed
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+def body_protocol(request_max_size, **kwargs):
+    loop = asyncio.new_event_loop()
+    protocol = HttpProtocol(loop=loop, request_handler=None,
+                            error_handler=ErrorHandler(),
+                            request_max_size=request_max_size, **kwargs)
+    protocol.transport = FakeTransport()
+    loop.close()
+    return protocol
+
+
+def test_request_body_too_large_content_length():
+    protocol = body_protocol(request_max_size=100000)
+    protocol.data_received(b'POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+                           b'Content-Length: 2000000000\r\n\r\nabc')
+    protocol.data_received(b'def')
+
+    assert b''.join(protocol.transport.written).startswith(
+        b'HTTP/1.1 413 Request Entity Too Large')
+    assert protocol.transport.closed
+    # nothing was parsed or allocated after the request was rejected
+    assert protocol._body is None
+    assert protocol._message is None
+
+
+def test_request_body_preallocation_is_bounded():
+    protocol = body_protocol(request_max_size=2 ** 30)
+    protocol.data_received(b'POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+                           b'Content-Length: 50000000\r\n\r\na')
+    # a body of tens of megabytes is preallocated
+    assert not protocol.transport.written
+    assert len(protocol._body) == 50000000
+
+    protocol = body_protocol(request_max_size=2 ** 30,
+                             body_preallocate_max=65536)
+    protocol.data_received(b'POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+                           b'Content-Length: 1000000000\r\n\r\na')
+    assert len(protocol._body) == 65536
+
+
+def test_request_body_empty():
+    received = []
+    app = body_app('test_request_body_empty', received)
+    data = body_exchange(app, [
+        b'POST /echo HTTP/1.1\r\nHost: localhost\r\n'
+        b'Content-Length: 0\r\n\r\n'])
+
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    assert received == [b'']
+    assert type(received[0]) is bytes
+
+
+# ------------------------------------------------------------ #
+#  Protocol upgrades
+# ------------------------------------------------------------ #
+
+UPGRADE_HEADERS = ('Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                   'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                   'Sec-WebSocket-Version: 13\r\n')
+
+
+def test_websocket_app_pipelined_requests():
+    app = Necktie('test_websocket_app_pipelined_requests')
+
+    @app.websocket('/ws')
+    async def feed(request, ws):
+        pass
+
+    @app.route('/<name>')
+    async def handler(request, name):
+        return text(name)
+
+    worker_metrics.reset()
+    payload = b''.join(pipelined_request('/' + name)
+                       for name in ('one', 'two', 'three'))
+    data = pipelined_exchange(app, payload, (b'HTTP/1.1 200', 3))
+
+    assert response_bodies(data) == [b'one', b'two', b'three']
+    assert worker_metrics.requests == 3
+
+
+def test_upgrade_request_closes_connection():
+    app = Necktie('test_upgrade_request_closes_connection')
+
+    @app.route('/<name>')
+    async def handler(request, name):
+        return text(name)
+
+    payload = (pipelined_request('/one', UPGRADE_HEADERS) +
+               pipelined_request('/two'))
+    data = pipelined_exchange(app, payload, (b'HTTP/1.1 200', 2))
+
+    # the server does not switch protocols, nothing after the request is
+    # parsed as HTTP
+    assert response_bodies(data) == [b'one']
+    assert b'Connection: close' in data
+
+
+def test_websocket_protocol_keeps_upgrade_data():
+    from pynecktie.websocket import WebSocketProtocol
+    loop = asyncio.new_event_loop()
+    received = []
+
+    async def request_handler(request, write_callback, stream_callback):
+        received.append(request)
+
+    protocol = WebSocketProtocol(loop=loop, request_handler=request_handler,
+                                 error_handler=ErrorHandler(),
+                                 request_max_size=65536)
+    protocol.transport = FakeTransport()
+    protocol.data_received(pipelined_request('/ws', UPGRADE_HEADERS) +
+                           b'\x81\x00')
+    protocol.data_received(b'\x89\x00')
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+
+    assert [request.path for request in received] == ['/ws']
+    assert not protocol.transport.written
+    # the frames sent after the request are kept for the websocket
+    assert protocol._upgrade == b'\x81\x00\x89\x00'
+
+
+# ------------------------------------------------------------ #
+#  Flow control
+# ------------------------------------------------------------ #
+
+def test_drain_waits_for_resume_writing():
+    loop = asyncio.new_event_loop()
+    protocol = HttpProtocol(loop=loop, request_handler=None,
+                            error_handler=None)
+    protocol.transport = object()
+
+    # Not paused, returns at once
+    loop.run_until_complete(protocol.drain())
+
+    protocol.pause_writing()
+    drain = loop.create_task(protocol.drain())
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert not drain.done()
+
+    protocol.resume_writing()
+    loop.run_until_complete(drain)
+    loop.close()
+
+
+class BufferedTransport(FakeTransport):
+    """Transport holding written data until the buffer limits are set"""
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+        self.limits = (16, 65536)
+        self.limit_calls = []
+
+    def get_extra_info(self, name, default=None):
+        return self.sock if name == 'socket' else default
+
+    def get_write_buffer_size(self):
+        return 100
+
+    def get_write_buffer_limits(self):
+        return self.limits
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        if high < low:
+            raise ValueError('high must be >= low')
+        self.limit_calls.append((low, high))
+        self.limits = (low, high)
+
+
+def test_sendfile_restores_write_buffer_limits(tmpdir):
+    loop = asyncio.new_event_loop()
+
+    class Loop:
+        # an event loop without loop.sendfile, as uvloop
+        create_future = loop.create_future
+        add_writer = loop.add_writer
+        remove_writer = loop.remove_writer
+
+    drained = []
+
+    async def drain():
+        drained.append(True)
+
+    path = tmpdir.join('file')
+    path.write_binary(b'sendfile' * 100)
+    server_sock, client_sock = socket.socketpair()
+    transport = BufferedTransport(server_sock)
+    metered = _MeteredTransport(transport, WorkerMetrics(), drain,
+                                Loop())
+    try:
+        with open(str(path), 'rb') as file:
+            loop.run_until_complete(metered.sendfile(file, 8, 792))
+        assert client_sock.recv(1024) == b'sendfile' * 99
+    finally:
+        server_sock.close()
+        client_sock.close()
+        loop.close()
+
+    assert drained == [True]
+    # lowered to send the buffered data first, then restored
+    assert transport.limit_calls == [(0, 0), (16, 65536)]
+    assert metered.metrics.bytes_out == 792
+
+
+def current_rss():
+    """Resident memory of the process (bytes), from /proc"""
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/statm'),
+                    reason='needs /proc to measure the memory used')
+def test_request_stream_backpressure():
+    app = Necktie('test_request_stream_backpressure')
+    app.config.REQUEST_MAX_SIZE = 2 ** 31
+    size = 2 ** 30
+    chunk = b'x' * 2 ** 20
+    results = {'received': 0, 'buffered': 0, 'rss': 0}
+
+    @app.post('/upload', stream=True)
+    async def upload(request):
+        baseline = current_rss()
+        megabytes = 0
+        while True:
+            data = await request.stream.read(65536)
+            if not data:
+                break
+            results['received'] += len(data)
+            results['buffered'] = max(results['buffered'],
+                                      len(request.stream))
+            if results['received'] >> 20 > megabytes:
+                megabytes = results['received'] >> 20
+                # a handler slower than the client
+                await asyncio.sleep(0.002)
+                if megabytes % 64 == 0:
+                    results['rss'] = max(results['rss'],
+                                         current_rss() - baseline)
+        return text('OK')
+
+    @app.listener('after_server_start')
+    async def upload_client(app, loop):
+        reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+        try:
+            writer.write(b'POST /upload HTTP/1.1\r\nHost: localhost\r\n'
+                         b'Content-Length: %d\r\n\r\n' % size)
+            for _ in range(size // len(chunk)):
+                writer.write(chunk)
+                await writer.drain()
+            results['response'] = await asyncio.wait_for(
+                reader.read(65536), 60)
+        finally:
+            writer.close()
+            app.stop()
+
+    app.run(host='127.0.0.1', port=PORT)
+
+    assert results['response'].startswith(b'HTTP/1.1 200 OK')
+    assert results['received'] == size
+    # the server stopped reading while the handler was behind
+    high_water = app.config.REQUEST_STREAM_HIGH_WATER
+    assert high_water < results['buffered'] <= high_water + 2 ** 20
+    assert results['rss'] < 64 * 2 ** 20
+
+
+# ------------------------------------------------------------ #
+#  Workers
+# ------------------------------------------------------------ #
+
+def test_worker_cpus():
+    assert worker_cpus(0, None) is None
+    assert worker_cpus(3, [0, {2, 3}]) == {2, 3}
+    assert worker_cpus(4, [0, {2, 3}]) == {0}
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+        assert worker_cpus(len(cpus), True) == {cpus[0]}
+
+
+def test_worker_cpus_without_sched_getaffinity(monkeypatch):
+    monkeypatch.delattr(os, 'sched_getaffinity', raising=False)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    assert worker_cpus(5, True) == {1}
+
+
+def test_serve_multiple_reuse_port_with_sock():
+    with socket.socket() as sock, pytest.raises((ValueError, RuntimeError)):
+        serve_multiple({'sock': sock}, 2, reuse_port=True)
+
+
+def worker_pid(path='/'):
+    with socket.create_connection(('127.0.0.1', PORT), timeout=5) as sock:
+        sock.sendall('GET {} HTTP/1.1\r\nConnection: close\r\n\r\n'.format(
+            path).encode())
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+    body = response.split(b'\r\n\r\n', 1)[1]
+    return int(body) if path == '/' else body.decode()
+
+
+def start_workers(name, **kwargs):
+    """Run an app answering with its worker's pid in a new process"""
+    app = Necktie(name)
+    app.config.update(kwargs.pop('config', {}))
+
+    @app.route('/')
+    async def handler(request):
+        return text(str(os.getpid()))
+
+    kwargs.setdefault('workers', 2)
+    server = Process(target=app.run, kwargs=dict(
+        host='127.0.0.1', port=PORT, access_log=False, **kwargs))
+    server.start()
+    return server
+
+
+def stop_workers(server):
+    os.kill(server.pid, signal.SIGTERM)
+    server.join(20)
+
+
+def collect_pids(until, timeout=10):
+    """Request worker pids until `until(pids)` is true"""
+    pids = []
+    deadline = time.monotonic() + timeout
+    while not until(pids) and time.monotonic() < deadline:
+        try:
+            pids.append(worker_pid())
+        except OSError:
+            # not started yet
+            time.sleep(0.05)
+    return pids
+
+
+@pytest.mark.skipif(SO_REUSEPORT is None, reason='needs SO_REUSEPORT')
+def test_workers_reuse_port():
+    server = start_workers('test_workers_reuse_port', reuse_port=True)
+    try:
+        pids = set(collect_pids(lambda pids: len(set(pids)) >= 2))
+    finally:
+        stop_workers(server)
+
+    # the connections were spread over both workers' sockets
+    assert len(pids) == 2
+    assert server.pid not in pids
+    assert server.exitcode == 0
+
+
+@pytest.mark.skipif(SO_REUSEPORT is None, reason='needs SO_REUSEPORT')
+def test_workers_reuse_port_recycled_without_refusing():
+    server = start_workers('test_workers_reuse_port_recycled',
+                           reuse_port=True,
+                           config={'WORKER_MAX_REQUESTS': 5})
+    try:
+        first = set(collect_pids(lambda pids: len(set(pids)) >= 2))
+        # the socket of a recycled worker stays open for its replacement
+        failures = []
+        pids = set()
+        deadline = time.monotonic() + 15
+        while len(pids - first) < 4 and time.monotonic() < deadline:
+            try:
+                pids.add(worker_pid())
+            except OSError as error:
+                failures.append(error)
+    finally:
+        stop_workers(server)
+
+    assert failures == []
+    assert len(pids - first) >= 4
+
+
+def test_workers_restarted():
+    server = start_workers('test_workers_restarted')
+    try:
+        pids = set(collect_pids(lambda pids: len(set(pids)) >= 2))
+        killed = pids.pop()
+        os.kill(killed, signal.SIGKILL)
+        restarted = set(collect_pids(
+            lambda new: len(set(new) - pids - {killed}) >= 1))
+    finally:
+        stop_workers(server)
+
+    assert killed not in restarted
+    assert restarted - pids
+    assert server.exitcode == 0
+
+
+def test_workers_recycled_after_max_requests():
+    server = start_workers('test_workers_recycled',
+                           config={'WORKER_MAX_REQUESTS': 5})
+    try:
+        # the workers report their request counts once a second
+        pids = collect_pids(lambda pids: len(set(pids)) >= 4)
+    finally:
+        stop_workers(server)
+
+    assert len(set(pids)) >= 4
+    assert server.exitcode == 0
+
+
+@pytest.mark.skipif(process_rss(os.getpid()) is None,
+                    reason='needs /proc to measure the memory used')
+def test_workers_recycled_above_max_memory():
+    server = start_workers('test_workers_recycled_above_max_memory',
+                           config={'WORKER_MAX_MEMORY': 1024})
+    try:
+        pids = collect_pids(lambda pids: len(set(pids)) >= 4)
+    finally:
+        stop_workers(server)
+
+    assert len(set(pids)) >= 4
+
+
+def test_workers_reloaded_on_sighup():
+    server = start_workers('test_workers_reloaded_on_sighup')
+    try:
+        old = set(collect_pids(lambda pids: len(set(pids)) >= 2))
+        os.kill(server.pid, signal.SIGHUP)
+        failures = []
+        new = set()
+        deadline = time.monotonic() + 15
+        while len(new) < 2 and time.monotonic() < deadline:
+            try:
+                pid = worker_pid()
+            except OSError as error:
+                failures.append(error)
+                continue
+            if pid not in old:
+                new.add(pid)
+    finally:
+        stop_workers(server)
+
+    # every request was answered while the workers were replaced
+    assert failures == []
+    assert len(new) == 2
+    assert server.exitcode == 0
+
+
+def test_workers_restart_backoff():
+    manager = WorkerManager({}, 2)
+    delays = [manager._backoff(0) for _ in range(7)]
+
+    assert delays == [1, 2, 4, 8, 16, 30, 30]
+    assert manager._backoff(1) == 1
+
+
+def test_workers_stop_without_master():
+    server = start_workers('test_workers_stop_without_master')
+    collect_pids(lambda pids: len(set(pids)) >= 2)
+    os.kill(server.pid, signal.SIGKILL)
+    server.join()
+
+    # the workers notice within a second that the master is gone, and
+    # close the socket
+    refused = False
+    deadline = time.monotonic() + 10
+    while not refused and time.monotonic() < deadline:
+        try:
+            worker_pid()
+            time.sleep(0.1)
+        except OSError:
+            refused = True
+    assert refused
+
+
+def test_workers_max_requests_with_websocket_route():
+    app = Necktie('test_workers_max_requests_with_websocket_route')
+    app.config.WORKER_MAX_REQUESTS = 5
+
+    @app.websocket('/ws')
+    async def feed(request, ws):
+        pass
+
+    @app.route('/')
+    async def handler(request):
+        return text(str(os.getpid()))
+
+    server = Process(target=app.run, kwargs=dict(
+        host='127.0.0.1', port=PORT, workers=2, access_log=False))
+    server.start()
+    try:
+        pids = collect_pids(lambda pids: len(set(pids)) >= 4)
+    finally:
+        stop_workers(server)
+
+    assert len(set(pids)) >= 4
+
+
+RELOADED_APP = """
+import os
+from pynecktie import Necktie
+from pynecktie.response import text
+
+app = Necktie('reloaded_app')
+
+
+@app.route('/version')
+async def version(request):
+    return text('{} {}'.format(VERSION, os.getpid()))
+
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=PORT, workers=2, access_log=False)
+"""
+
+
+def write_reloaded_app(path, version):
+    with open(path, 'w') as script:
+        script.write('VERSION = {!r}\nPORT = {}\n'.format(version, PORT) +
+                     RELOADED_APP)
+
+
+def test_workers_reload_code_on_sighup(tmpdir):
+    path = str(tmpdir.join('reloaded_app.py'))
+    write_reloaded_app(path, 'one')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    server = subprocess.Popen([sys.executable, path], env=env)
+    try:
+        versions = set()
+        deadline = time.monotonic() + 10
+        while not versions and time.monotonic() < deadline:
+            try:
+                versions.add(worker_pid('/version').split()[0])
+            except OSError:
+                time.sleep(0.05)
+        assert versions == {'one'}
+        write_reloaded_app(path, 'two')
+        server.send_signal(signal.SIGHUP)
+        failures = []
+        seen = set()
+        deadline = time.monotonic() + 20
+        while len(seen) < 2 and time.monotonic() < deadline:
+            try:
+                version, pid = worker_pid('/version').split()
+            except OSError as error:
+                failures.append(error)
+                continue
+            if version == 'two':
+                seen.add(pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(20)
+
+    # the new code was loaded without refusing a connection, by the same
+    # master process
+    assert failures == []
+    assert len(seen) == 2
+    assert server.returncode == 0
+
+
+@pytest.mark.skipif(not hasattr(gc, 'freeze'), reason='needs gc.freeze')
+def test_workers_preload():
+    app = Necktie('test_workers_preload')
+
+    @app.listener('before_fork')
+    async def warm(app, loop):
+        app.config.WARMED_IN = os.getpid()
+        app.config.WARMED_LOOP = loop is not None
+
+    @app.route('/preload')
+    async def handler(request):
+        return text('{} {} {}'.format(
+            app.config.WARMED_IN, app.config.WARMED_LOOP,
+            gc.get_freeze_count()))
+
+    server = Process(target=app.run, kwargs=dict(
+        host='127.0.0.1', port=PORT, workers=2, preload=True,
+        access_log=False))
+    server.start()
+    try:
+        bodies = []
+        deadline = time.monotonic() + 10
+        while not bodies and time.monotonic() < deadline:
+            try:
+                bodies.append(worker_pid('/preload'))
+            except OSError:
+                time.sleep(0.05)
+    finally:
+        stop_workers(server)
+
+    warmed_in, warmed_loop, frozen = bodies[0].split()
+    # the listener ran once in the main process, before the fork
+    assert int(warmed_in) == server.pid
+    assert warmed_loop == 'True'
+    assert int(frozen) > 0
+
+
+@pytest.mark.skipif(not hasattr(gc, 'freeze'), reason='needs gc.freeze')
+def test_preload_with_one_worker():
+    app = Necktie('test_preload_with_one_worker')
+    results = {}
+
+    @app.listener('before_fork')
+    async def warm(app, loop):
+        results['warmed_in'] = os.getpid()
+
+    @app.listener('after_server_start')
+    async def stop(app, loop):
+        results['frozen'] = gc.get_freeze_count()
+        app.stop()
+
+    try:
+        app.run(host='127.0.0.1', port=PORT, preload=True, access_log=False)
+    finally:
+        gc.unfreeze()
+
+    # the same preloading as with several workers
+    assert results['warmed_in'] == os.getpid()
+    assert results['frozen'] > 0
+
+
+def test_before_fork_skipped_with_one_worker():
+    app = Necktie('test_before_fork_skipped_with_one_worker')
+    warmed = []
+
+    @app.listener('before_fork')
+    async def warm(app, loop):
+        warmed.append(True)
+
+    @app.listener('after_server_start')
+    async def stop(app, loop):
+        app.stop()
+
+    app.run(host='127.0.0.1', port=PORT, access_log=False)
+
+    assert warmed == []
@@ -0,0 +1,248 @@
+import gzip
+import inspect
+import os
+from mimetypes import guess_type
+
+import pytest
+
+from pynecktie import Necktie
+from pynecktie.response import FileHTTPResponse
+from pynecktie.static import StaticCache
+
+
+@pytest.fixture(scope='module')
+def static_file_directory():
+    """The static directory to serve"""
+    current_file = inspect.getfile(inspect.currentframe())
+    current_directory = os.path.dirname(os.path.abspath(current_file))
+    static_directory = os.path.join(current_directory, 'static')
+    return static_directory
+
+
+def get_file_content(static_file_directory, file_name):
+    """The content of the static file to check"""
+    with open(os.path.join(static_file_directory, file_name), 'rb') as file:
+        return file.read()
+
+
+@pytest.fixture
+def sent_in_chunks(monkeypatch):
+    """Record the responses that fell back to reading the file in chunks"""
+    calls = []
+    send_chunks = FileHTTPResponse._send_chunks
+
+    async def _send_chunks(self):
+        calls.append(self)
+        await send_chunks(self)
+
+    monkeypatch.setattr(FileHTTPResponse, '_send_chunks', _send_chunks)
+    return calls
+
+
+# ------------------------------------------------------------ #
+#  sendfile
+# ------------------------------------------------------------ #
+
+@pytest.mark.parametrize('file_name',
+                         ['test.file', 'decode me.txt', 'python.png'])
+def test_static_file_sendfile(file_name, static_file_directory,
+                              sent_in_chunks):
+    app = Necktie('test_static')
+    app.static('/testing.file',
+               os.path.join(static_file_directory, file_name))
+
+    request, response = app.test_client.get('/testing.file')
+    assert response.status == 200
+    assert response.body == get_file_content(static_file_directory, file_name)
+    assert int(response.headers['Content-Length']) == len(response.body)
+    assert 'Transfer-Encoding' not in response.headers
+    assert sent_in_chunks == []
+
+
+def test_static_directory_sendfile(static_file_directory, sent_in_chunks):
+    app = Necktie('test_static')
+    app.static('/dir', static_file_directory)
+
+    request, response = app.test_client.get('/dir/python.png')
+    assert response.status == 200
+    assert response.body == get_file_content(static_file_directory,
+                                             'python.png')
+    assert response.headers['Content-Type'] == 'image/png'
+    assert sent_in_chunks == []
+
+
+def test_static_content_range_sendfile(static_file_directory,
+                                       sent_in_chunks):
+    app = Necktie('test_static')
+    app.static('/testing.file',
+               os.path.join(static_file_directory, 'python.png'),
+               use_content_range=True)
+    content = get_file_content(static_file_directory, 'python.png')
+
+    headers = {'Range': 'bytes=12-1000'}
+    request, response = app.test_client.get('/testing.file', headers=headers)
+    assert response.status == 206
+    assert response.headers['Content-Range'] == \
+        'bytes 12-1000/{}'.format(len(content))
+    # the upstream range handler excludes the last byte of the range
+    assert response.body == content[12:1000]
+    assert int(response.headers['Content-Length']) == len(response.body)
+    assert sent_in_chunks == []
+
+
+def test_static_head_request(static_file_directory):
+    app = Necktie('test_static')
+    app.static('/testing.file',
+               os.path.join(static_file_directory, 'test.file'),
+               use_content_range=True)
+
+    request, response = app.test_client.head('/testing.file')
+    assert response.status == 200
+    assert response.body == b''
+    assert int(response.headers['Content-Length']) == len(
+        get_file_content(static_file_directory, 'test.file'))
+
+
+def test_static_not_modified(static_file_directory):
+    app = Necktie('test_static')
+    app.static('/testing.file',
+               os.path.join(static_file_directory, 'test.file'))
+
+    request, response = app.test_client.get('/testing.file')
+    last_modified = response.headers['Last-Modified']
+    headers = {'If-Modified-Since': last_modified}
+    request, response = app.test_client.get('/testing.file', headers=headers)
+    assert response.status == 304
+
+
+# ------------------------------------------------------------ #
+#  Without sendfile
+# ------------------------------------------------------------ #
+
+@pytest.mark.parametrize('stream_large_files,chunked', [
+    (False, 0), (1024 * 1024, 0), (1, 1)])
+def test_static_file_no_sendfile(stream_large_files, chunked,
+                                 static_file_directory, sent_in_chunks):
+    app = Necktie('test_static')
+    app.static('/testing.file',
+               os.path.join(static_file_directory, 'python.png'),
+               use_sendfile=False, stream_large_files=stream_large_files)
+
+    request, response = app.test_client.get('/testing.file')
+    assert response.status == 200
+    assert response.body == get_file_content(static_file_directory,
+                                             'python.png')
+    # only files over the threshold are streamed, and read in chunks
+    assert len(sent_in_chunks) == chunked
+
+
+def test_static_file_missing(static_file_directory):
+    app = Necktie('test_static')
+    app.static('/dir', static_file_directory)
+
+    request, response = app.test_client.get('/dir/not_found.txt')
+    assert response.status == 404
+
+
+# ------------------------------------------------------------ #
+#  Static cache
+# ------------------------------------------------------------ #
+
+APP_JS = b'console.log("app");' * 10
+
+
+@pytest.fixture
+def asset_directory(tmpdir):
+    """A directory with a file and its precompressed siblings"""
+    tmpdir.join('app.js').write_binary(APP_JS)
+    tmpdir.join('app.js.br').write_binary(b'brotli')
+    tmpdir.join('app.js.gz').write_binary(gzip.compress(APP_JS))
+    tmpdir.join('logo.txt').write_binary(b'logo')
+    return tmpdir
+
+
+def test_static_cache_etag(asset_directory):
+    app = Necktie('test_static_cache')
+    cache = StaticCache()
+    app.static('/assets', str(asset_directory), cache=cache)
+
+    request, response = app.test_client.get('/assets/logo.txt')
+    assert response.status == 200
+    assert response.body == b'logo'
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert etag.startswith('"') and etag.endswith('"')
+    assert 'Vary' not in response.headers
+
+    headers = {'If-None-Match': 'W/{}, "other"'.format(etag)}
+    request, response = app.test_client.get('/assets/logo.txt',
+                                            headers=headers)
+    assert response.status == 304
+    assert response.headers['ETag'] == etag
+
+    headers = {'If-Modified-Since': last_modified}
+    request, response = app.test_client.get('/assets/logo.txt',
+                                            headers=headers)
+    assert response.status == 304
+    assert cache.info().misses == 1
+    assert cache.info().hits == 2
+
+
+@pytest.mark.parametrize('accept_encoding,body,encoding', [
+    (None, APP_JS, None),
+    ('gzip, deflate', gzip.compress(APP_JS), 'gzip'),
+    ('br;q=0, *', gzip.compress(APP_JS), 'gzip'),
+    ('identity', APP_JS, None),
+])
+def test_static_cache_precompressed(accept_encoding, body, encoding,
+                                    asset_directory):
+    app = Necktie('test_static_cache')
+    app.static('/assets', str(asset_directory), cache=True)
+
+    # the test client would decode the body, so only check its length
+    headers = {'Accept-Encoding': accept_encoding or ''}
+    request, response = app.test_client.head('/assets/app.js',
+                                             headers=headers)
+    assert response.status == 200
+    assert int(response.headers['Content-Length']) == len(body)
+    assert response.headers.get('Content-Encoding') == encoding
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['Content-Type'] == guess_type('app.js')[0]
+
+
+def test_static_cache_changed_file(asset_directory):
+    app = Necktie('test_static_cache')
+    cache = StaticCache(check_interval=0)
+    app.static('/assets', str(asset_directory), cache=cache)
+
+    request, response = app.test_client.get('/assets/logo.txt')
+    etag = response.headers['ETag']
+    logo = asset_directory.join('logo.txt')
+    logo.write_binary(b'new logo')
+    logo.setmtime(logo.mtime() + 10)
+
+    request, response = app.test_client.get('/assets/logo.txt')
+    assert response.body == b'new logo'
+    assert response.headers['ETag'] != etag
+
+    logo.remove()
+    request, response = app.test_client.get('/assets/logo.txt')
+    assert response.status == 404
+    assert cache.info().entries == 0
+
+
+def test_static_cache_size(asset_directory):
+    app = Necktie('test_static_cache')
+    cache = StaticCache(max_size=1000, max_file_size=100)
+    app.static('/assets', str(asset_directory), cache=cache)
+
+    request, response = app.test_client.get('/assets/app.js')
+    assert response.body == APP_JS
+    request, response = app.test_client.get('/assets/logo.txt')
+    assert response.body == b'logo'
+    # app.js is larger than max_file_size, so it is sent from disk, but
+    # its entry is still evicted to make room for logo.txt
+    info = cache.info()
+    assert info.entries == 1
+    assert info.evictions == 1
+    assert info.currsize <= 1000